@@ -0,0 +1,97 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ('evaluation', 'code_files'):
+    if os.path.join(ROOT, directory) not in sys.path:
+        sys.path.insert(0, os.path.join(ROOT, directory))
+
+from cs4_dataset import NUM_CONSTRAINTS
+
+# Synthetic corpora shaped like CS4 for the benchmarks.
+# Scale 1 is the size of one CS4 constraint file: 50 instructions x 5 constraint counts (7..39) = 250
+# rows per model; scale s has 50*s instructions. Texts are drawn from a Zipf-distributed vocabulary
+# of made-up words, so n-gram statistics behave like prose without shipping any text. Everything is
+# generated from the seed, so a scale always produces the same corpus.
+
+CS4_INSTRUCTIONS = 50
+MODELS = ('Gemma', 'Llama', 'Mistral')
+VOCABULARY_SIZE = 5000
+STORY_WORDS = 250
+LETTERS = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+
+
+class SyntheticCorpus:
+    def __init__(self, scale=1, seed=0, story_words=STORY_WORDS, models=MODELS):
+        self.scale = scale
+        self.seed = seed
+        self.story_words = story_words
+        self.models = list(models)
+        self.instructions = CS4_INSTRUCTIONS * scale
+        self.rng = np.random.default_rng(seed)
+        lengths = self.rng.integers(2, 10, VOCABULARY_SIZE)
+        self.vocabulary = np.array([''.join(self.rng.choice(LETTERS, length)) for length in lengths])
+        ranks = np.arange(1, VOCABULARY_SIZE + 1)
+        self.word_probabilities = (1 / ranks) / (1 / ranks).sum()
+
+    def rows_per_model(self):
+        return self.instructions * len(NUM_CONSTRAINTS)
+
+    def texts(self, count, words):
+        tokens = self.vocabulary[self.rng.choice(VOCABULARY_SIZE, size=(count, words), p=self.word_probabilities)]
+        return [' '.join(row) + '.' for row in tokens]
+
+    # Function to build the constraint rows storygen reads: every instruction with the first k of its
+    # 39 constraints for each constraint count
+    def constraint_rows(self):
+        count = max(NUM_CONSTRAINTS)
+        instructions = [f"Write a story in less than 500 words about {text}" for text in self.texts(self.instructions, 12)]
+        base_stories = self.texts(self.instructions, self.story_words)
+        constraint_texts = self.texts(self.instructions * count, 10)
+        rows = []
+        for i, (instruction, base_story) in enumerate(zip(instructions, base_stories)):
+            lines = [f"{j + 1}. The story should mention {constraint_texts[i * count + j]}" for j in range(count)]
+            for k in NUM_CONSTRAINTS:
+                rows.append({'Instruction': instruction, 'Constraints': '\n'.join(lines), 'BaseStory': base_story,
+                             'Direction': 'direction2', 'SelectedConstraints': '\n'.join(lines[:k]), 'Number_of_Constraints': k})
+        return pd.DataFrame(rows)
+
+    # Function to build the diversity_calculation input of one model: three stories per row
+    def story_rows(self):
+        rows = self.rows_per_model()
+        df = pd.DataFrame({'Number_of_Constraints': np.tile(NUM_CONSTRAINTS, self.instructions)})
+        for label in ('Story1', 'Story2', 'Story3'):
+            df[label] = self.texts(rows, self.story_words)
+        return df
+
+    # Function to build the judge responses for one model, one per row, in the format constraint_satisfaction gets back
+    def judge_responses(self):
+        responses = []
+        for k in np.tile(NUM_CONSTRAINTS, self.instructions):
+            verdicts = self.rng.random(k) < 0.7
+            lines = [f"{j + 1}. {'Yes' if verdict else 'No'} - The story {'mentions' if verdict else 'does not mention'} it." for j, verdict in enumerate(verdicts)]
+            lines.append(f"Number of constraints satisfied: {int(verdicts.sum())}")
+            responses.append('\n'.join(lines))
+        return responses
+
+    # Function to build the per-story metric rows of every model (the columns the graphs aggregate)
+    def result_rows(self):
+        rows = self.rows_per_model()
+        frames = []
+        for model in self.models:
+            constraints = np.tile(NUM_CONSTRAINTS, self.instructions)
+            satisfied = np.clip(self.rng.normal(90 - constraints, 15), 0, 100)
+            frames.append(pd.DataFrame({
+                'model': model,
+                'direction': 'default',
+                'Number_of_Constraints': constraints,
+                'satisfied': satisfied,
+                'Percentage_GPT4': satisfied,
+                'coherence_score': self.rng.integers(1, 6, rows).astype(float),
+                'Perplexity': self.rng.lognormal(1.5, 0.3, rows),
+                'Product_diversity': self.rng.uniform(0.3, 0.9, rows),
+            }))
+        return pd.concat(frames, ignore_index=True)
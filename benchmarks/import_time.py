@@ -0,0 +1,72 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Startup time check for the command line scripts.
+# Every script is started with --help in a fresh interpreter a few times; the median wall time must
+# stay under the threshold. Heavy libraries (pandas, matplotlib, torch, vllm, nltk, openai) are
+# imported lazily, so a script that imports one of them at the top again shows up here.
+# Exits with status 1 when a script is too slow or fails to start.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = [
+    'run_all_evals.py',
+    'code_files/storygen.py',
+    'code_files/cs4_dataset.py',
+    'evaluation/constraint_satisfaction.py',
+    'evaluation/constraint_satisfaction_graph_generation.py',
+    'evaluation/coherence_vs_constraint_graph.py',
+    'evaluation/corpus_diversity.py',
+    'evaluation/diversity_calculation.py',
+    'evaluation/diversity_graphs.py',
+    'evaluation/pairwise_ranking.py',
+    'evaluation/perplexity.py',
+    'evaluation/perplexity_graphs.py',
+    'evaluation/quc_and_rcs.py',
+    'evaluation/results_store.py',
+    'evaluation/story_quality_eval.py',
+    'evaluation/telemetry.py',
+]
+
+
+# Function to time `python <script> --help` from the script's directory (as the scripts import their siblings)
+def startup_time(script, env):
+    path = os.path.join(ROOT, script)
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, os.path.basename(path), '--help'], cwd=os.path.dirname(path),
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"{script} --help exited with {completed.returncode}:\n{completed.stderr.strip()}")
+    return elapsed
+
+
+def main(scripts, repeats, threshold):
+    # Offline, so a script that reaches for the network at import fails instead of waiting on it
+    env = {**os.environ, 'CS4_OFFLINE': '1', 'HF_HUB_OFFLINE': '1'}
+    failures = 0
+    for script in scripts:
+        try:
+            median = statistics.median(startup_time(script, env) for _ in range(repeats))
+        except RuntimeError as error:
+            print(f"FAIL  {script}: {error}")
+            failures += 1
+            continue
+        status = 'ok' if median <= threshold else 'SLOW'
+        failures += status != 'ok'
+        print(f"{status:<5} {script:<56} {median:.2f}s")
+    print(f"{len(scripts) - failures}/{len(scripts)} scripts start within {threshold:.2f}s")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the scripts start (--help) within a time threshold.")
+    parser.add_argument('--scripts', nargs='+', default=SCRIPTS, help="Scripts to check, relative to the repository root")
+    parser.add_argument('--repeats', type=int, default=3, help="Runs per script; the median is compared")
+    parser.add_argument('--threshold', type=float, default=1.0, help="Maximum median startup time in seconds")
+    args = parser.parse_args()
+
+    sys.exit(1 if main(args.scripts, args.repeats, args.threshold) else 0)
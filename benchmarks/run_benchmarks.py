@@ -0,0 +1,247 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from corpus import ROOT, SyntheticCorpus
+
+# Scaling benchmarks of the evaluation pipeline on synthetic CS4-shaped corpora (see corpus.py).
+# Each benchmark prepares its inputs in setup() (not timed) and times run(), which returns the number
+# of rows it processed. Every (benchmark, scale) is run `repeats` times; the median goes into a JSON
+# results file named after the commit, so two commits are compared by their files:
+#   python benchmarks/run_benchmarks.py                                   # writes benchmarks/results/<commit>.json
+#   python benchmarks/run_benchmarks.py --baseline benchmarks/results/<old commit>.json
+# A benchmark regresses when its median exceeds the baseline median by more than --threshold
+# (1.25: 25% slower); medians under --min_seconds are treated as noise. Regressions exit with status 1.
+
+SCALES = (1, 10, 100)
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+class Benchmark:
+    name = None
+    scales = SCALES
+
+    def setup(self, corpus, directory):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+
+class DiversityCalculation(Benchmark):
+    name = 'diversity_calculation'
+
+    def setup(self, corpus, directory):
+        self.input_path = os.path.join(directory, 'stories.csv')
+        self.output_path = os.path.join(directory, 'diversity.csv')
+        self.rows = corpus.rows_per_model()
+        corpus.story_rows().to_csv(self.input_path, index=False)
+
+    def run(self):
+        import diversity_calculation
+
+        diversity_calculation.main(self.input_path, self.output_path, workers=1)
+        return self.rows
+
+
+class VerdictParsing(Benchmark):
+    name = 'verdict_parsing'
+
+    def setup(self, corpus, directory):
+        import pandas as pd
+
+        self.responses = corpus.judge_responses()
+        self.df = pd.DataFrame({'Number_of_Constraints': [response.count('\n') for response in self.responses]})
+
+    def run(self):
+        from verdicts import parse_responses, satisfaction
+
+        verdicts = parse_responses(self.df.index.tolist(), self.responses)
+        satisfaction(verdicts, self.df)
+        return len(self.responses)
+
+
+class GraphAggregation(Benchmark):
+    name = 'graph_aggregation'
+
+    def setup(self, corpus, directory):
+        from results_store import write_results
+
+        self.store = os.path.join(directory, 'store')
+        rows = corpus.result_rows()
+        self.rows = len(rows)
+        for model, model_rows in rows.groupby('model', sort=False):
+            write_results(model_rows, self.store, model)
+
+    def run(self):
+        from aggregation import aggregate, source_rows
+
+        aggregate(source_rows(store=self.store))
+        return self.rows
+
+
+class QUCAndRCS(Benchmark):
+    name = 'quc_and_rcs'
+
+    def setup(self, corpus, directory):
+        from aggregation import aggregate
+
+        self.rows = corpus.result_rows()
+        self.table = aggregate(self.rows)
+
+    def run(self):
+        from quc_and_rcs import quc_table
+
+        quc_table(self.table, self.rows, resamples=1000)
+        return len(self.rows)
+
+
+class EndToEnd(Benchmark):
+    """Story generation with the CPU stub backend, then constraint judging against the local stub server."""
+
+    name = 'generation_and_judging'
+    # 100x is 25000 judge round trips through the local HTTP stub; pass --scales 100 to include it
+    scales = (1, 10)
+
+    def setup(self, corpus, directory):
+        from stub_openai_server import start_stub_server
+
+        self.directory = directory
+        self.input_path = os.path.join(directory, 'constraints_direction2.csv')
+        self.rows = corpus.rows_per_model()
+        corpus.constraint_rows().to_csv(self.input_path, index=False)
+        self.server, self.base_url = start_stub_server()
+
+    def run(self):
+        import storygen
+        from backends import StubBackend
+        from constraint_satisfaction import main as judge
+
+        os.environ.setdefault('OPENAI_API_KEY', 'stub')
+        previous = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            storygen.generalcall(StubBackend(), 'stub-model', self.input_path, output_name='stub')
+            stories = os.path.join(self.directory, storygen.output_file_for('stub', 'd2'))
+            judge(stories, os.path.join(self.directory, 'judged.csv'), concurrency=16, base_url=self.base_url)
+        finally:
+            os.chdir(previous)
+        return self.rows
+
+    def teardown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+BENCHMARKS = {benchmark.name: benchmark for benchmark in (DiversityCalculation, VerdictParsing, GraphAggregation, QUCAndRCS, EndToEnd)}
+
+
+# Function to time one benchmark at one scale; the scripts' progress output is discarded
+def time_benchmark(benchmark_class, scale, repeats, seed=0):
+    corpus = SyntheticCorpus(scale, seed)
+    benchmark = benchmark_class()
+    with tempfile.TemporaryDirectory(prefix=f"cs4-bench-{benchmark.name}-") as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            benchmark.setup(corpus, directory)
+        try:
+            times = []
+            for _ in range(repeats):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    rows = benchmark.run()
+                    times.append(time.perf_counter() - start)
+        finally:
+            benchmark.teardown()
+    median = statistics.median(times)
+    return {'rows': rows, 'repeats': repeats, 'median': median, 'min': min(times), 'max': max(times), 'rows_per_second': rows / median if median else None}
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, dirty
+
+
+def run_suite(names, scales=None, repeats=3, seed=0):
+    commit, dirty = git_commit()
+    results = {'commit': commit, 'dirty': dirty, 'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+               'seed': seed, 'benchmarks': {}}
+    for name in names:
+        benchmark_class = BENCHMARKS[name]
+        for scale in scales or benchmark_class.scales:
+            timing = time_benchmark(benchmark_class, scale, repeats, seed)
+            results['benchmarks'].setdefault(name, {})[str(scale)] = timing
+            print(f"{name:<24} {scale:>4}x {timing['rows']:>8} rows  median {timing['median']:8.3f}s  {timing['rows_per_second']:>12,.0f} rows/s")
+    return results
+
+
+def default_results_path(results):
+    label = (results['commit'] or 'unknown')[:12] + ('-dirty' if results['dirty'] else '')
+    return os.path.join(RESULTS_DIR, f"{label}.json")
+
+
+# Function to compare two results files; returns the list of (benchmark, scale, baseline, current, ratio) that regressed
+def compare(baseline, current, threshold=1.25, min_seconds=0.05):
+    regressions = []
+    print(f"{'benchmark':<24} {'scale':>6} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, scales in current['benchmarks'].items():
+        for scale, timing in scales.items():
+            reference = baseline['benchmarks'].get(name, {}).get(scale)
+            if reference is None:
+                print(f"{name:<24} {scale + 'x':>6} {'-':>10} {timing['median']:>9.3f}s    new")
+                continue
+            ratio = timing['median'] / reference['median'] if reference['median'] else float('inf')
+            regressed = ratio > threshold and timing['median'] >= min_seconds
+            print(f"{name:<24} {scale + 'x':>6} {reference['median']:>9.3f}s {timing['median']:>9.3f}s {ratio:>6.2f}x{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append((name, scale, reference['median'], timing['median'], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the evaluation pipeline on synthetic CS4 corpora and check for regressions.")
+    parser.add_argument('--benchmarks', nargs='+', choices=sorted(BENCHMARKS), default=list(BENCHMARKS), help="Benchmarks to run (default: all)")
+    parser.add_argument('--scales', type=int, nargs='+', default=None, help=f"Corpus sizes in multiples of CS4 (default: each benchmark's own, up to {max(SCALES)})")
+    parser.add_argument('--repeats', type=int, default=3, help="Timed runs per benchmark and scale; the median is reported")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic corpora")
+    parser.add_argument('--output', default=None, help="Results JSON to write (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--current', default=None, help="Compare this results JSON instead of running the benchmarks")
+    parser.add_argument('--baseline', default=None, help="Results JSON of an earlier commit to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="Slowdown ratio over the baseline counted as a regression")
+    parser.add_argument('--min_seconds', type=float, default=0.05, help="Medians below this many seconds are never counted as regressions")
+    args = parser.parse_args()
+
+    if args.current:
+        with open(args.current, encoding='utf-8') as file:
+            results = json.load(file)
+    else:
+        results = run_suite(args.benchmarks, args.scales, args.repeats, args.seed)
+        output = args.output or default_results_path(results)
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(json.load(file), results, args.threshold, args.min_seconds)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than {args.threshold:.2f}x the baseline")
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.2f}x the baseline")
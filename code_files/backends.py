@@ -0,0 +1,556 @@
+import hashlib
+import time
+
+from decode_budget import should_stop
+
+# Generation backends used by storygen.py.
+# A backend takes a list of prompts and returns one generated text per prompt, in the same order.
+# budgets, when given, holds one decode budget (see decode_budget.py) or None per prompt.
+# Keeping the interface this small lets the batching logic be exercised on CPU with StubBackend.
+
+ORDERINGS = ['input', 'longest_first', 'shortest_first']
+
+
+class GenerationBackend:
+    max_tokens = None
+    # Running token counts of the prompts and of the generated text, for budgets and telemetry
+    prompt_tokens = 0
+    decode_tokens = 0
+
+    def generate(self, prompts, budgets=None):
+        raise NotImplementedError
+
+    # Releases what the backend holds (model weights, an engine and its GPU memory); ModelPool calls
+    # it when the model is evicted
+    def close(self):
+        pass
+
+    # prefixes[i] is the leading part of prompts[i] shared with other prompts. Backends that can
+    # reuse a computed prefix override this; the rest simply generate the full prompts.
+    def generate_with_prefixes(self, prompts, prefixes, budgets=None):
+        return self.generate(prompts, budgets)
+
+
+# Function to build a vLLM logits processor that forces EOS once the word budget is used up.
+# The generated text is only decoded every check_every tokens to keep the per-step cost low.
+def word_budget_logits_processor(tokenizer, budget, check_every=8):
+    state = {'stop': False}
+
+    def processor(token_ids, logits):
+        if not state['stop'] and token_ids and len(token_ids) % check_every == 0:
+            state['stop'] = should_stop(tokenizer.decode(token_ids, skip_special_tokens=True), budget)
+        if state['stop']:
+            logits.fill_(float('-inf'))
+            logits[tokenizer.eos_token_id] = 0.0
+        return logits
+
+    return processor
+
+
+class VLLMBackend(GenerationBackend):
+    def __init__(self, llm, sampling_params):
+        self.llm = llm
+        self.sampling_params = sampling_params
+        self.max_tokens = sampling_params.max_tokens
+        self.prompt_tokens = 0
+        self.decode_tokens = 0
+
+    def _params_for(self, budget):
+        if budget is None:
+            return self.sampling_params
+        params = self.sampling_params.clone()
+        params.max_tokens = budget['max_tokens']
+        params.logits_processors = list(params.logits_processors or []) + [word_budget_logits_processor(self.llm.get_tokenizer(), budget)]
+        return params
+
+    def generate(self, prompts, budgets=None):
+        params = self.sampling_params if budgets is None else [self._params_for(budget) for budget in budgets]
+        outputs = self.llm.generate(prompts, params, use_tqdm=False)
+        # vLLM hands out increasing request ids in submission order, so sorting by id maps
+        # every output back to the prompt it was submitted for.
+        outputs = sorted(outputs, key=lambda output: int(output.request_id))
+        self.prompt_tokens += sum(len(output.prompt_token_ids or ()) for output in outputs)
+        self.decode_tokens += sum(len(output.outputs[0].token_ids) for output in outputs)
+        return [output.outputs[0].text for output in outputs]
+
+    def close(self):
+        # The engine holds the weights and the KV cache; without dropping it the next model runs out of memory
+        self.llm = None
+        release_cuda_memory()
+
+
+class StubBackend(GenerationBackend):
+    """CPU stand-in for a model. Every generate() call sleeps for call_latency plus
+    prompt_latency per prompt and returns a deterministic text derived from the prompt."""
+
+    def __init__(self, call_latency=0.0, prompt_latency=0.0):
+        self.call_latency = call_latency
+        self.prompt_latency = prompt_latency
+        self.calls = 0
+        self.prompts_seen = 0
+
+    def generate(self, prompts, budgets=None):
+        self.calls += 1
+        self.prompts_seen += len(prompts)
+        time.sleep(self.call_latency + self.prompt_latency * len(prompts))
+        return [stub_story(prompt) for prompt in prompts]
+
+
+def stub_story(prompt):
+    digest = hashlib.md5(prompt.encode('utf-8')).hexdigest()[:12]
+    return f"Stub story {digest} for a prompt of {len(prompt)} characters."
+
+
+# Function to decide the submission order of the prompts (indices into the prompt list)
+def plan_order(prompts, order='input'):
+    indices = list(range(len(prompts)))
+    if order == 'input':
+        return indices
+    if order == 'longest_first':
+        # Long prompts go first so the slowest sequences are not left running alone at the end
+        return sorted(indices, key=lambda i: len(prompts[i]), reverse=True)
+    if order == 'shortest_first':
+        return sorted(indices, key=lambda i: len(prompts[i]))
+    raise ValueError(f"Unknown ordering '{order}', expected one of {ORDERINGS}")
+
+
+# Function to submit prompts in chunks, yielding (row positions, generated texts) per chunk.
+# chunk_size=None submits every prompt in a single call.
+def iter_generate_batched(backend, prompts, chunk_size=None, order='input', prefixes=None, budgets=None):
+    indices = plan_order(prompts, order)
+    step = chunk_size or max(len(indices), 1)
+    for start in range(0, len(indices), step):
+        chunk = indices[start:start + step]
+        chunk_budgets = None if budgets is None else [budgets[i] for i in chunk]
+        if prefixes is None:
+            texts = backend.generate([prompts[i] for i in chunk], chunk_budgets)
+        else:
+            texts = backend.generate_with_prefixes([prompts[i] for i in chunk], [prefixes[i] for i in chunk], chunk_budgets)
+        if len(texts) != len(chunk):
+            raise RuntimeError(f"Backend returned {len(texts)} outputs for {len(chunk)} prompts")
+        yield chunk, texts
+
+
+# Function to generate every prompt and return the texts aligned with the input order
+def generate_batched(backend, prompts, chunk_size=None, order='input'):
+    results = [None] * len(prompts)
+    for chunk, texts in iter_generate_batched(backend, prompts, chunk_size, order):
+        for position, text in zip(chunk, texts):
+            results[position] = text
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Real backends. Heavy libraries are imported by the loaders so that only the backends a run
+# actually uses need to be installed.
+
+DEFAULT_MAX_TOKENS = 4096
+DEFAULT_TEMPERATURE = 0.8
+DEFAULT_TOP_P = 0.95
+
+
+def release_cuda_memory():
+    import gc
+    gc.collect()
+    try:
+        import torch
+        torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+# Function to build a transformers stopping criterion that ends each row of a batch once its
+# word budget is used up (rows without a budget run to max_new_tokens)
+def word_budget_stopping_criteria(tokenizer, prompt_width, budgets, check_every=8):
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class WordBudgetCriteria(StoppingCriteria):
+        def __init__(self):
+            self.steps = 0
+            self.stopped = [False] * len(budgets)
+
+        def __call__(self, input_ids, scores, **kwargs):
+            self.steps += 1
+            if self.steps % check_every == 0:
+                for row, budget in enumerate(budgets):
+                    if budget is not None and not self.stopped[row]:
+                        text = tokenizer.decode(input_ids[row, prompt_width:], skip_special_tokens=True)
+                        self.stopped[row] = should_stop(text, budget)
+            return torch.tensor(self.stopped, device=input_ids.device)
+
+    return StoppingCriteriaList([WordBudgetCriteria()])
+
+
+# Function to wrap a prompt in the model's chat template
+def chat_prompt(tokenizer, prompt_text):
+    chat = [
+        {"role": "user", "content": prompt_text},
+    ]
+    return tokenizer.apply_chat_template(chat, tokenize=False, add_generation_prompt=True)
+
+
+class HFBackend(GenerationBackend):
+    """Batched generation with Hugging Face models. Prompts are tokenized on a background thread
+    in windows of tokenize_window prompts, sorted by length inside each window and left-padded
+    into batches. A batch grows while batch_size * (longest prompt + max_tokens) stays within
+    max_tokens_per_batch, so short prompts run in large batches and long ones in small batches."""
+
+    def __init__(self, model, tokenizer, max_tokens=DEFAULT_MAX_TOKENS, max_tokens_per_batch=65536, tokenize_window=256, reuse_prefix_cache=False):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.tokenize_window = tokenize_window
+        self.reuse_prefix_cache = reuse_prefix_cache
+        self.batch_stats = []
+        self.prefix_tokens_reused = 0
+        self.prompt_tokens = 0
+        self.decode_tokens = 0
+        if tokenizer.pad_token_id is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+    def _tokenize(self, prompts):
+        return [self.tokenizer.encode(chat_prompt(self.tokenizer, prompt), add_special_tokens=False) for prompt in prompts]
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    # Function to split token lists into length-sorted batches under the token budget
+    def plan_batches(self, token_lists):
+        batches = []
+        current = []
+        for position in sorted(range(len(token_lists)), key=lambda i: len(token_lists[i])):
+            # Sorted ascending, so the prompt being added is the longest in the batch
+            width = len(token_lists[position]) + self.max_tokens
+            if current and (len(current) + 1) * width > self.max_tokens_per_batch:
+                batches.append(current)
+                current = []
+            current.append(position)
+        if current:
+            batches.append(current)
+        return batches
+
+    # Function to get max_new_tokens and the word-budget stopping criterion for a batch
+    def _budget_kwargs(self, budgets, prompt_width):
+        if budgets is None or not any(budgets):
+            return {'max_new_tokens': self.max_tokens}
+        return {
+            'max_new_tokens': max(budget['max_tokens'] if budget else self.max_tokens for budget in budgets),
+            'stopping_criteria': word_budget_stopping_criteria(self.tokenizer, prompt_width, budgets),
+        }
+
+    def _generate_batch(self, token_lists, budgets=None):
+        import torch
+        pad_id = self.tokenizer.pad_token_id
+        width = max(len(tokens) for tokens in token_lists)
+        input_ids = torch.tensor([[pad_id] * (width - len(tokens)) + tokens for tokens in token_lists], device=self.model.device)
+        attention_mask = torch.tensor([[0] * (width - len(tokens)) + [1] * len(tokens) for tokens in token_lists], device=self.model.device)
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            response = self.model.generate(input_ids=input_ids, attention_mask=attention_mask, do_sample=True, top_p=0.95,
+                                           pad_token_id=pad_id, **self._budget_kwargs(budgets, width))
+        elapsed = time.perf_counter() - start
+
+        new_tokens = int((response[:, width:] != pad_id).sum().item())
+        self.prompt_tokens += sum(len(tokens) for tokens in token_lists)
+        self.decode_tokens += new_tokens
+        self.batch_stats.append({'prompts': len(token_lists), 'prompt_tokens': width, 'new_tokens': new_tokens, 'seconds': elapsed})
+        print(f"HF batch of {len(token_lists)} prompts (padded to {width} tokens): {new_tokens} new tokens in {elapsed:.1f}s, {new_tokens / max(elapsed, 1e-9):.1f} tokens/sec")
+
+        # Decode the whole sequence like the single-prompt path did; left padding is a special token and is skipped
+        return self.tokenizer.batch_decode(response, skip_special_tokens=True)
+
+    def generate(self, prompts, budgets=None):
+        from concurrent.futures import ThreadPoolExecutor
+        results = [None] * len(prompts)
+        starts = range(0, len(prompts), self.tokenize_window)
+        # A single background thread tokenizes the windows in order while earlier windows generate
+        with ThreadPoolExecutor(max_workers=1) as tokenizer_thread:
+            futures = [(start, tokenizer_thread.submit(self._tokenize, prompts[start:start + self.tokenize_window])) for start in starts]
+            for start, future in futures:
+                token_lists = future.result()
+                for batch in self.plan_batches(token_lists):
+                    batch_budgets = None if budgets is None else [budgets[start + i] for i in batch]
+                    texts = self._generate_batch([token_lists[i] for i in batch], batch_budgets)
+                    for position, text in zip(batch, texts):
+                        results[start + position] = text
+        return results
+
+    # Function to tokenize the templated prefix of a prompt; None when the prefix does not end on a
+    # token boundary of the full prompt (the cache would then not match the prompt's tokens)
+    def _prefix_tokens(self, prompt, prefix, tokens):
+        templated = chat_prompt(self.tokenizer, prompt)
+        prefix_end = templated.find(prompt) + len(prefix)
+        prefix_tokens = self.tokenizer.encode(templated[:prefix_end], add_special_tokens=False)
+        if len(prefix_tokens) < len(tokens) and tokens[:len(prefix_tokens)] == prefix_tokens:
+            return prefix_tokens
+        return None
+
+    def _generate_from_prefix(self, prefix_tokens, token_lists, budgets=None):
+        import copy
+        import torch
+        device = self.model.device
+        with torch.no_grad():
+            # Prefill the shared prefix once; every variant continues from a copy of its KV cache
+            cache = self.model(input_ids=torch.tensor([prefix_tokens], device=device), use_cache=True).past_key_values
+            texts = []
+            for row, tokens in enumerate(token_lists):
+                input_ids = torch.tensor([tokens], device=device)
+                row_budgets = None if budgets is None else [budgets[row]]
+                response = self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), past_key_values=copy.deepcopy(cache),
+                                               do_sample=True, top_p=0.95, pad_token_id=self.tokenizer.pad_token_id, **self._budget_kwargs(row_budgets, len(tokens)))
+                self.prompt_tokens += len(tokens)
+                self.decode_tokens += response.shape[1] - len(tokens)
+                texts.append(self.tokenizer.batch_decode(response, skip_special_tokens=True)[0])
+        self.prefix_tokens_reused += len(prefix_tokens) * (len(token_lists) - 1)
+        return texts
+
+    def generate_with_prefixes(self, prompts, prefixes, budgets=None):
+        if not self.reuse_prefix_cache:
+            return self.generate(prompts, budgets)
+
+        results = [None] * len(prompts)
+        token_lists = self._tokenize(prompts)
+        groups = {}
+        for position, prefix in enumerate(prefixes):
+            groups.setdefault(prefix, []).append(position)
+
+        # Prompts whose prefix is shared (and token-aligned) reuse the prefix cache; the rest are batched
+        batched = []
+        for prefix, positions in groups.items():
+            prefix_tokens = self._prefix_tokens(prompts[positions[0]], prefix, token_lists[positions[0]]) if len(positions) > 1 else None
+            if prefix_tokens is None or any(token_lists[i][:len(prefix_tokens)] != prefix_tokens for i in positions):
+                batched.extend(positions)
+                continue
+            group_budgets = None if budgets is None else [budgets[i] for i in positions]
+            for position, text in zip(positions, self._generate_from_prefix(prefix_tokens, [token_lists[i] for i in positions], group_budgets)):
+                results[position] = text
+
+        batched_budgets = None if budgets is None else [budgets[i] for i in batched]
+        for position, text in zip(batched, self.generate([prompts[i] for i in batched], batched_budgets) if batched else []):
+            results[position] = text
+        return results
+
+    def throughput(self):
+        seconds = sum(stats['seconds'] for stats in self.batch_stats)
+        return sum(stats['new_tokens'] for stats in self.batch_stats) / seconds if seconds else 0.0
+
+    def close(self):
+        self.model = None
+        release_cuda_memory()
+
+
+class OpenAIBackend(GenerationBackend):
+    """Any OpenAI-compatible chat completions endpoint (OpenAI, a vLLM server, TGI, ...)."""
+
+    def __init__(self, client, model, max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMPERATURE, top_p=DEFAULT_TOP_P, concurrency=8):
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.concurrency = concurrency
+        self.prompt_tokens = 0
+        self.decode_tokens = 0
+
+    def _complete(self, prompt, budget=None):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=budget['max_tokens'] if budget else self.max_tokens,
+            temperature=self.temperature,
+            top_p=self.top_p,
+        )
+        if response.usage is not None:
+            self.prompt_tokens += response.usage.prompt_tokens
+            self.decode_tokens += response.usage.completion_tokens
+        return response.choices[0].message.content
+
+    def generate(self, prompts, budgets=None):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return list(pool.map(self._complete, prompts, budgets or [None] * len(prompts)))
+
+
+def load_vllm(spec):
+    import torch
+    from vllm import LLM, SamplingParams
+    options = spec.get('options', {})
+    # Prefix caching pays off because the prompt planner submits prompts with shared prefixes together
+    llm = LLM(model=spec['name'], dtype=getattr(torch, options.get('dtype', 'float16')), enable_prefix_caching=options.get('enable_prefix_caching', True))
+    params = SamplingParams(max_tokens=options.get('max_tokens', DEFAULT_MAX_TOKENS),
+                            temperature=options.get('temperature', DEFAULT_TEMPERATURE),
+                            top_p=options.get('top_p', DEFAULT_TOP_P))
+    return VLLMBackend(llm, params)
+
+
+def load_hf(spec):
+    options = spec.get('options', {})
+    if options.get('loader') == 'hf_olmo':
+        from hf_olmo import OLMoForCausalLM as model_class, OLMoTokenizerFast as tokenizer_class
+    else:
+        from transformers import AutoModelForCausalLM as model_class, AutoTokenizer as tokenizer_class
+    model = model_class.from_pretrained(spec['name']).to(options.get('device', 'cuda'))
+    tokenizer = tokenizer_class.from_pretrained(spec['name'])
+    return HFBackend(model, tokenizer, max_tokens=options.get('max_tokens', DEFAULT_MAX_TOKENS),
+                     max_tokens_per_batch=options.get('max_tokens_per_batch', 65536),
+                     tokenize_window=options.get('tokenize_window', 256),
+                     reuse_prefix_cache=options.get('reuse_prefix_cache', False))
+
+
+def load_openai(spec):
+    import os
+    from openai import OpenAI
+    options = spec.get('options', {})
+    client = OpenAI(base_url=options.get('base_url'), api_key=os.environ.get(options.get('api_key_env', 'OPENAI_API_KEY'), 'EMPTY'))
+    return OpenAIBackend(client, spec['name'],
+                         max_tokens=options.get('max_tokens', DEFAULT_MAX_TOKENS),
+                         temperature=options.get('temperature', DEFAULT_TEMPERATURE),
+                         top_p=options.get('top_p', DEFAULT_TOP_P),
+                         concurrency=options.get('concurrency', 8))
+
+
+# Fake loaders mirror the cost profile of each real backend on CPU: vLLM pays one latency per
+# batched call, HF pays per prompt, and the HTTP endpoint pays per prompt spread over its workers.
+class FakeBackend(StubBackend):
+    def __init__(self, spec, call_latency=0.0, prompt_latency=0.0):
+        super().__init__(call_latency, prompt_latency)
+        self.spec = spec
+        self.closed = False
+        time.sleep(spec.get('options', {}).get('fake_load_seconds', 0.0))
+
+    def close(self):
+        self.closed = True
+
+
+def load_fake_vllm(spec):
+    return FakeBackend(spec, call_latency=spec.get('options', {}).get('fake_latency', 0.0))
+
+
+def load_fake_hf(spec):
+    return FakeBackend(spec, prompt_latency=spec.get('options', {}).get('fake_latency', 0.0))
+
+
+def load_fake_openai(spec):
+    options = spec.get('options', {})
+    return FakeBackend(spec, prompt_latency=options.get('fake_latency', 0.0) / options.get('concurrency', 8))
+
+
+# Backend registry: name -> (loader, fake loader). Loaders take a model spec dict.
+BACKENDS = {}
+
+
+def register_backend(name, loader, fake_loader):
+    BACKENDS[name] = (loader, fake_loader)
+
+
+register_backend('vllm', load_vllm, load_fake_vllm)
+register_backend('hf', load_hf, load_fake_hf)
+register_backend('openai', load_openai, load_fake_openai)
+
+
+def load_backend(spec, fake=False):
+    if spec['backend'] not in BACKENDS:
+        raise ValueError(f"Unknown backend '{spec['backend']}' for {spec['name']}, expected one of {sorted(BACKENDS)}")
+    loader, fake_loader = BACKENDS[spec['backend']]
+    return (fake_loader if fake else loader)(spec)
+
+
+# ---------------------------------------------------------------------------
+# Model list. Each spec is a dict: name, backend, output_name, memory_gb and backend options.
+
+DEFAULT_MODELS = [
+    {'name': 'allenai/OLMo-7B-SFT', 'backend': 'hf', 'options': {'loader': 'hf_olmo'}},
+    {'name': 'allenai/OLMo-7B-Instruct', 'backend': 'hf', 'options': {'loader': 'hf_olmo'}},
+    {'name': 'allenai/OLMo-7B-hf', 'backend': 'vllm'},
+]
+
+# Substring of the model name -> directory / file prefix used for its outputs
+OUTPUT_NAMES = [
+    ("gemma", 'gemma'),
+    ("Llama", 'llama'),
+    ("Mistral", 'mistral'),
+    ("OLMo-7B-hf", 'olmo_basehf'),
+    ("OLMo-7B-SFT", 'olmo_sft'),
+    ("OLMo-7B-Instruct", 'olmo_instruct'),
+]
+
+
+def output_name_for(name_model):
+    for pattern, output_name in OUTPUT_NAMES:
+        if pattern in name_model:
+            return output_name
+    # Unknown models get a filesystem-safe version of their name
+    return name_model.split('/')[-1].replace('.', '_').lower()
+
+
+def normalize_spec(spec):
+    spec = dict(spec)
+    if 'name' not in spec:
+        raise ValueError(f"Model spec {spec} has no name")
+    spec.setdefault('backend', 'vllm')
+    spec.setdefault('output_name', output_name_for(spec['name']))
+    spec.setdefault('memory_gb', 16.0)
+    spec.setdefault('options', {})
+    return spec
+
+
+# Function to read model specs from a YAML file ({models: [...]}) and/or CLI entries "name[:backend]"
+def load_model_specs(config_path=None, cli_models=None):
+    specs = []
+    if config_path:
+        import yaml
+        with open(config_path) as config_file:
+            config = yaml.safe_load(config_file) or {}
+        specs.extend(config.get('models', []))
+    for entry in cli_models or []:
+        name, _, backend = entry.partition(':')
+        specs.append({'name': name, 'backend': backend or 'vllm'})
+    return [normalize_spec(spec) for spec in (specs or DEFAULT_MODELS)]
+
+
+class ModelPool:
+    """Keeps recently used backends loaded. When loading a model would exceed memory_budget_gb,
+    the least recently used models are closed first. A budget of None keeps only one model."""
+
+    def __init__(self, memory_budget_gb=None, fake=False):
+        from collections import OrderedDict
+        self.memory_budget_gb = memory_budget_gb
+        self.fake = fake
+        self.resident = OrderedDict()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def used_gb(self):
+        return sum(spec['memory_gb'] for spec, _ in self.resident.values())
+
+    def _key(self, spec):
+        return (spec['name'], spec['backend'])
+
+    def get(self, spec):
+        key = self._key(spec)
+        if key in self.resident:
+            self.resident.move_to_end(key)
+            self.hits += 1
+            return self.resident[key][1]
+
+        while self.resident and (self.memory_budget_gb is None or self.used_gb() + spec['memory_gb'] > self.memory_budget_gb):
+            self.evict()
+
+        backend = load_backend(spec, fake=self.fake)
+        self.loads += 1
+        self.resident[key] = (spec, backend)
+        return backend
+
+    def evict(self):
+        _, (spec, backend) = self.resident.popitem(last=False)
+        backend.close()
+        self.evictions += 1
+        print(f"Evicted {spec['name']} from the model pool")
+
+    def close(self):
+        while self.resident:
+            self.evict()
@@ -0,0 +1,86 @@
+import glob
+import json
+import os
+import time
+
+# Append-only checkpointing for story generation.
+# Every finished row is written as one JSON line to a shard file inside the checkpoint directory.
+# Each run opens a new shard, so a crash can at worst truncate the last line of its own shard.
+# On restart, rows whose key is already present in any shard are skipped.
+
+ROW_KEY_COLUMNS = ['Instruction', 'SelectedConstraints', 'Direction', 'Model']
+
+
+def row_key(row):
+    return tuple(str(row[column]) for column in ROW_KEY_COLUMNS)
+
+
+def _to_json_value(value):
+    # numpy scalars (e.g. Number_of_Constraints read by pandas) are not JSON serialisable
+    return value.item() if hasattr(value, 'item') else value
+
+
+class ShardWriter:
+    def __init__(self, checkpoint_dir, flush_every=50):
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.path = os.path.join(checkpoint_dir, f"shard-{int(time.time() * 1000)}-{os.getpid()}.jsonl")
+        self.flush_every = flush_every
+        self.buffer = []
+        self.rows_written = 0
+
+    def write(self, record):
+        self.buffer.append(json.dumps({key: _to_json_value(value) for key, value in record.items()}))
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with open(self.path, 'a', encoding='utf-8') as shard:
+            shard.write('\n'.join(self.buffer) + '\n')
+            shard.flush()
+            os.fsync(shard.fileno())
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# Function to read every complete record from the shards of a checkpoint directory
+def read_shards(checkpoint_dir):
+    records = []
+    for path in sorted(glob.glob(os.path.join(checkpoint_dir, 'shard-*.jsonl'))):
+        with open(path, encoding='utf-8') as shard:
+            for line in shard:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A line cut short by a crash; the row is regenerated on the next run
+                    continue
+    return records
+
+
+def load_done_keys(checkpoint_dir):
+    return {row_key(record) for record in read_shards(checkpoint_dir)}
+
+
+# Function to assemble the final DataFrame from the shards, ordered like the input rows
+def assemble_from_shards(checkpoint_dir, columns, keys):
+    import pandas as pd
+
+    by_key = {}
+    for record in read_shards(checkpoint_dir):
+        by_key.setdefault(row_key(record), record)
+
+    missing = [key for key in keys if key not in by_key]
+    if missing:
+        raise RuntimeError(f"{len(missing)} rows are missing from the checkpoint shards in {checkpoint_dir}")
+
+    return pd.DataFrame([by_key[key] for key in keys], columns=columns)
@@ -0,0 +1,253 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+
+# Indexed access to the CS4_dataset constraint CSVs.
+# Each CSV row stores one constraint set of an instruction as a numbered free-text blob
+# ("1. ...\n2. ..."; the Story-based file also has "Stylistic Constraints:" headings between the
+# numbered lines). Within an instruction the smaller sets (7/15/23/31) are prefixes of the largest (39).
+# The CSV is parsed once into a binary index file:
+#   - a UTF-8 string table holding every instruction text and every constraint line ("n. text")
+#   - instructions: (instruction number, text start, text end, first line, line count) of the largest set
+#   - lines: (start, text start, end) of each constraint line in the string table
+#   - sets: (instruction row, Number of Constraints, first line, line count) of each CSV row; a set
+#     that is a prefix of the largest one points into its lines, any other set gets lines of its own
+# The lines of a set are stored one after another, so the first k constraints of an instruction are
+# a single slice of the string table. Later loads memory-map the file; it is rebuilt when the SHA-256
+# of the CSV changes.
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'CS4_dataset')
+DATASET_FILES = {
+    'instruction': 'Instruction-based Constraints.csv',
+    'story': 'Story-based Constraints.csv',
+}
+# Constraint counts of the generation sweep (storygen.generalcall)
+NUM_CONSTRAINTS = (7, 15, 23, 31, 39)
+INDEX_DIR = os.path.join(os.path.expanduser(os.environ.get('CS4_CACHE_DIR', os.path.join('~', '.cache', 'cs4'))), 'dataset_index')
+
+MAGIC = b'CS4IDX01'
+INDEX_VERSION = 1
+CONSTRAINT_LINE = re.compile(r'^\s*\d+\.\s*(.*\S)', re.MULTILINE)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_constraints(text):
+    return CONSTRAINT_LINE.findall(text or '')
+
+
+# Function to read the CSV rows as (instruction number, instruction, Number of Constraints, constraints)
+def read_rows(csv_path):
+    with open(csv_path, newline='', encoding='utf-8-sig') as source:
+        reader = csv.DictReader(source)
+        # Header names carry stray whitespace ('Instruction ')
+        reader.fieldnames = [name.strip() for name in reader.fieldnames]
+        for row in reader:
+            yield int(row['Instruction Number']), row['Instruction'].strip(), int(row['Number of Constraints']), parse_constraints(row['Constraints'])
+
+
+# Function to parse a constraint CSV into the index arrays and the string table
+def build_arrays(csv_path):
+    import numpy as np
+
+    grouped = {}
+    for number, instruction, label, constraints in read_rows(csv_path):
+        grouped.setdefault(number, (instruction, []))[1].append((label, constraints))
+
+    table = bytearray()
+    lines, instructions, sets = [], [], []
+
+    def add_lines(constraints):
+        first = len(lines)
+        for position, constraint in enumerate(constraints, start=1):
+            prefix = f"{position}. ".encode('utf-8')
+            start = len(table)
+            table.extend(prefix + constraint.encode('utf-8') + b'\n')
+            lines.append((start, start + len(prefix), len(table) - 1))
+        return first
+
+    for row, (number, (instruction, constraint_sets)) in enumerate(grouped.items()):
+        text_start = len(table)
+        table.extend(instruction.encode('utf-8') + b'\n')
+        text_end = len(table) - 1
+        longest = max((constraints for _, constraints in constraint_sets), key=len)
+        first = add_lines(longest)
+        instructions.append((number, text_start, text_end, first, len(longest)))
+        for label, constraints in constraint_sets:
+            own = first if constraints == longest[:len(constraints)] else add_lines(constraints)
+            sets.append((row, label, own, len(constraints)))
+
+    return {
+        'instructions': np.array(instructions, dtype=np.int64).reshape(-1, 5),
+        'lines': np.array(lines, dtype=np.int64).reshape(-1, 3),
+        'sets': np.array(sets, dtype=np.int64).reshape(-1, 4),
+        'strings': np.frombuffer(bytes(table), dtype=np.uint8),
+    }
+
+
+def write_index(index_path, arrays, source_sha256):
+    header = {'version': INDEX_VERSION, 'source_sha256': source_sha256, 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset += -(-array.nbytes // 8) * 8
+    encoded = json.dumps(header).encode('utf-8')
+    encoded += b' ' * (-(len(MAGIC) + 8 + len(encoded)) % 8)
+
+    directory = os.path.dirname(index_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Written to a temporary file and renamed, so a reader never maps a half-written index
+    temporary = f"{index_path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as index:
+        index.write(MAGIC + len(encoded).to_bytes(8, 'little') + encoded)
+        for array in arrays.values():
+            data = array.tobytes()
+            index.write(data + b'\0' * (-len(data) % 8))
+    os.replace(temporary, index_path)
+
+
+# Function to read the header of an index file; None when it is missing or not a current index
+def read_header(index_path):
+    try:
+        with open(index_path, 'rb') as index:
+            if index.read(len(MAGIC)) != MAGIC:
+                return None
+            header = json.loads(index.read(int.from_bytes(index.read(8), 'little')))
+            header['data_offset'] = index.tell()
+    except (OSError, ValueError):
+        return None
+    return header if header.get('version') == INDEX_VERSION else None
+
+
+def default_index_path(csv_path):
+    name = os.path.splitext(os.path.basename(csv_path))[0].replace(' ', '_')
+    location = hashlib.sha256(os.path.abspath(csv_path).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(INDEX_DIR, f"{name}-{location}.idx")
+
+
+class ConstraintIndex:
+    def __init__(self, index_path, header):
+        import numpy as np
+
+        self.path = index_path
+        self.source_sha256 = header['source_sha256']
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            shape = tuple(spec['shape'])
+            if 0 in shape:
+                arrays[name] = np.empty(shape, dtype=spec['dtype'])
+            else:
+                arrays[name] = np.memmap(index_path, dtype=spec['dtype'], mode='r', offset=header['data_offset'] + spec['offset'], shape=shape)
+        self.instructions = arrays['instructions']
+        self.lines = arrays['lines']
+        self.sets = arrays['sets']
+        self.strings = arrays['strings']
+        self._rows = {number: row for row, number in enumerate(self.instructions[:, 0].tolist())}
+        self._sets = {(int(self.instructions[row, 0]), label): position for position, (row, label) in enumerate(self.sets[:, :2].tolist())}
+
+    # Function to open the index of a constraint CSV, (re)building it when it is missing or the CSV changed
+    @classmethod
+    def load(cls, csv_path, index_path=None, rebuild=False):
+        index_path = index_path or default_index_path(csv_path)
+        source_sha256 = file_sha256(csv_path)
+        header = None if rebuild else read_header(index_path)
+        if header is None or header['source_sha256'] != source_sha256:
+            write_index(index_path, build_arrays(csv_path), source_sha256)
+            header = read_header(index_path)
+        return cls(index_path, header)
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def _text(self, start, end):
+        return bytes(self.strings[start:end]).decode('utf-8')
+
+    def _row(self, number):
+        try:
+            return self._rows[number]
+        except KeyError:
+            raise KeyError(f"No instruction {number} in {self.path}") from None
+
+    def instruction_numbers(self):
+        return list(self._rows)
+
+    def instruction(self, number):
+        _, start, end, _, _ = self.instructions[self._row(number)]
+        return self._text(start, end)
+
+    def num_constraints(self, number):
+        return int(self.instructions[self._row(number), 4])
+
+    def _first_lines(self, first, count, k):
+        if k is None:
+            k = count
+        if not 0 <= k <= count:
+            raise ValueError(f"k must be between 0 and {count}, got {k}")
+        return first, k
+
+    # Function to get the first k constraints of an instruction as the numbered text used in the prompts
+    def selected_constraints(self, number, k=None):
+        _, _, _, first, count = self.instructions[self._row(number)]
+        first, k = self._first_lines(first, count, k)
+        if k == 0:
+            return ''
+        return self._text(self.lines[first, 0], self.lines[first + k - 1, 2])
+
+    # Function to get the first k constraints of an instruction as a list (without numbering)
+    def constraints(self, number, k=None):
+        _, _, _, first, count = self.instructions[self._row(number)]
+        first, k = self._first_lines(first, count, k)
+        return [self._text(body, end) for _, body, end in self.lines[first:first + k].tolist()]
+
+    # Function to get the constraint set stored in the CSV row of (instruction, Number of Constraints)
+    def constraint_set(self, number, num_constraints):
+        try:
+            _, _, first, count = self.sets[self._sets[(number, num_constraints)]]
+        except KeyError:
+            raise KeyError(f"No row with {num_constraints} constraints for instruction {number} in {self.path}") from None
+        return [self._text(body, end) for _, body, end in self.lines[first:first + count].tolist()]
+
+    # Function to yield (instruction number, instruction, k, selected constraints) for the constraint sweep
+    def sweep(self, counts=NUM_CONSTRAINTS):
+        for number in self._rows:
+            instruction = self.instruction(number)
+            for k in counts:
+                if k <= self.num_constraints(number):
+                    yield number, instruction, k, self.selected_constraints(number, k)
+
+
+def load_dataset(name='instruction', index_path=None, rebuild=False):
+    if name not in DATASET_FILES:
+        raise ValueError(f"Unknown dataset {name!r}; expected one of {', '.join(DATASET_FILES)}")
+    return ConstraintIndex.load(os.path.join(DATASET_DIR, DATASET_FILES[name]), index_path, rebuild)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the index of a CS4 constraint CSV and print constraint sets.")
+    parser.add_argument('--dataset', choices=sorted(DATASET_FILES), default='instruction', help="CS4 dataset file to use")
+    parser.add_argument('--csv', default=None, help="Constraint CSV to index instead of a CS4 dataset file")
+    parser.add_argument('--index_path', default=None, help=f"Index file (default: under {INDEX_DIR})")
+    parser.add_argument('--instruction', type=int, default=None, help="Print this instruction and its constraints")
+    parser.add_argument('--k', type=int, default=None, help="Only print the first k constraints")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the index even if the CSV is unchanged")
+    args = parser.parse_args()
+
+    if args.csv:
+        index = ConstraintIndex.load(args.csv, args.index_path, args.rebuild)
+    else:
+        index = load_dataset(args.dataset, args.index_path, args.rebuild)
+    if args.instruction is None:
+        print(f"{len(index)} instructions, {len(index.sets)} constraint sets, {len(index.lines)} constraint lines in {index.path}")
+    else:
+        print(index.instruction(args.instruction))
+        print(index.selected_constraints(args.instruction, args.k))
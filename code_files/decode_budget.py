@@ -0,0 +1,71 @@
+import math
+import re
+
+# Word-limit-aware decode budgets.
+# Every storygen prompt asks for a story "within 500 words" and the CS4 instructions state their own
+# length ("Write a story in less than 500 words about ..."). A row's budget is derived from that
+# story-length instruction plus a safety margin, so a runaway generation cannot use the global
+# max_tokens. Word counts inside the constraints ("a title in 5 words") are about parts of the story
+# and do not set the budget; a row whose constraints ask for at least as many words as the limit
+# gets no budget. Generation is also ended at the first sentence end once the word limit is reached.
+
+WORD_LIMIT_PATTERN = re.compile(
+    r"\b(?:within|in|under|below|less than|fewer than|no more than|not more than|at most|up to|"
+    r"about|around|approximately|roughly|exactly)\s+(?:a maximum of\s+)?(\d{1,3}(?:,\d{3})*|\d+)\s+words\b",
+    re.IGNORECASE,
+)
+MIN_WORDS_PATTERN = re.compile(
+    r"\b(?:at least|no fewer than|no less than|not fewer than|not less than|(?<!no )(?<!not )more than|over|"
+    r"a minimum of|minimum of)\s+(\d{1,3}(?:,\d{3})*|\d+)\s+words\b",
+    re.IGNORECASE,
+)
+SENTENCE_END_PATTERN = re.compile(r"[.!?][\"'”’)]*(?:\s|$)")
+
+DEFAULT_MARGIN = 0.2
+DEFAULT_TOKENS_PER_WORD = 1.4
+MIN_BUDGET_TOKENS = 64
+
+
+# Function to get the limit of a story-length instruction: the first word limit in the text
+def word_limit(text):
+    match = WORD_LIMIT_PATTERN.search(text)
+    return int(match.group(1).replace(',', '')) if match else None
+
+
+# Function to get the largest minimum length ("at least 700 words") asked for in the text
+def minimum_words(text):
+    minimums = [int(match.group(1).replace(',', '')) for match in MIN_WORDS_PATTERN.finditer(text)]
+    return max(minimums) if minimums else None
+
+
+# Function to compute a row's budget from its story-length instruction, or None when it carries no
+# word limit or the constraints ask for at least as many words
+def decode_budget(text, max_tokens, margin=DEFAULT_MARGIN, tokens_per_word=DEFAULT_TOKENS_PER_WORD, constraints=None):
+    limit = word_limit(text)
+    if limit is None:
+        return None
+    minimum = minimum_words(constraints) if constraints else None
+    if minimum is not None and minimum >= limit:
+        return None
+    max_words = int(math.ceil(limit * (1 + margin)))
+    tokens = min(max_tokens, max(MIN_BUDGET_TOKENS, int(math.ceil(max_words * tokens_per_word))))
+    return {'word_limit': limit, 'max_words': max_words, 'max_tokens': tokens}
+
+
+# Function to decide whether generated text has used up its word budget: either the hard
+# max_words is reached, or the word limit is reached and a sentence has ended after it
+def should_stop(text, budget):
+    words = text.split()
+    if len(words) >= budget['max_words']:
+        return True
+    if len(words) < budget['word_limit']:
+        return False
+    return SENTENCE_END_PATTERN.search(' '.join(words[budget['word_limit'] - 1:])) is not None
+
+
+def budget_report(budgets, max_tokens):
+    budgeted = sum(budget['max_tokens'] if budget else max_tokens for budget in budgets)
+    capped = max_tokens * len(budgets)
+    limited = sum(1 for budget in budgets if budget)
+    return (f"Decode budget: {limited}/{len(budgets)} prompts word-limited, {budgeted} max decode tokens "
+            f"vs {capped} with max_tokens={max_tokens} ({capped - budgeted} saved)")
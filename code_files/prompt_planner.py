@@ -0,0 +1,72 @@
+# Prompt planning for story generation.
+# Many rows of a constraints file share the same Instruction and BaseStory and only differ in
+# SelectedConstraints, and repeated rows produce identical prompts. The planner generates every
+# distinct prompt once and orders them so prompts with the same prefix are submitted next to each
+# other, which is what vLLM's prefix caching and the HF prefix KV cache need to get hits.
+
+
+def approx_token_count(text):
+    # Whitespace words; backends with a tokenizer pass an exact counter instead
+    return len(text.split())
+
+
+class PromptPlan:
+    def __init__(self, prompts, prefixes, count_tokens=None):
+        count_tokens = count_tokens or approx_token_count
+
+        # Deduplicate identical prompts, remembering every row that asked for each one
+        unique_index = {}
+        unique_prompts = []
+        unique_prefixes = []
+        rows_of = []
+        duplicate_tokens = 0
+        for position, (prompt, prefix) in enumerate(zip(prompts, prefixes)):
+            if prompt in unique_index:
+                rows_of[unique_index[prompt]].append(position)
+                duplicate_tokens += count_tokens(prompt)
+                continue
+            unique_index[prompt] = len(unique_prompts)
+            unique_prompts.append(prompt)
+            unique_prefixes.append(prefix)
+            rows_of.append([position])
+
+        # Group prompts by prefix; groups keep the order in which their prefix first appeared
+        group_of = {}
+        for prefix in unique_prefixes:
+            group_of.setdefault(prefix, len(group_of))
+        order = sorted(range(len(unique_prompts)), key=lambda i: (group_of[unique_prefixes[i]], i))
+
+        self.prompts = [unique_prompts[i] for i in order]
+        self.prefixes = [unique_prefixes[i] for i in order]
+        self.rows = [rows_of[i] for i in order]
+
+        # Every unique prompt after the first one of its group finds its prefix already cached
+        prefix_tokens = {prefix: count_tokens(prefix) for prefix in group_of}
+        self.num_rows = len(prompts)
+        self.num_unique = len(unique_prompts)
+        self.prefix_hits = self.num_unique - len(group_of)
+        self.prefix_hit_ratio = self.prefix_hits / self.num_unique if self.num_unique else 0.0
+        self.prefill_tokens_total = sum(count_tokens(prompt) for prompt in prompts)
+        self.prefill_tokens_saved = duplicate_tokens + sum(prefix_tokens[prefix] * (count - 1) for prefix, count in self._group_sizes().items())
+
+    def _group_sizes(self):
+        sizes = {}
+        for prefix in self.prefixes:
+            sizes[prefix] = sizes.get(prefix, 0) + 1
+        return sizes
+
+    # Function to turn (planned positions, texts) chunks into (row positions, texts) chunks
+    def expand(self, finished):
+        for chunk, texts in finished:
+            positions = []
+            row_texts = []
+            for planned, text in zip(chunk, texts):
+                positions.extend(self.rows[planned])
+                row_texts.extend([text] * len(self.rows[planned]))
+            yield positions, row_texts
+
+    def report(self):
+        saved_share = self.prefill_tokens_saved / self.prefill_tokens_total if self.prefill_tokens_total else 0.0
+        return (f"Prompt plan: {self.num_rows} rows -> {self.num_unique} unique prompts, "
+                f"prefix-hit ratio {self.prefix_hit_ratio:.2%}, "
+                f"prefill tokens saved {self.prefill_tokens_saved}/{self.prefill_tokens_total} ({saved_share:.2%})")
@@ -0,0 +1,69 @@
+import os
+
+# Result accumulation for story generation.
+# Growing a DataFrame with df.loc[len(df)] = {...} reallocates on every insert; these builders keep
+# plain per-column lists and only create a DataFrame once (or once per flushed chunk).
+
+
+class ResultBuilder:
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.data = {column: [] for column in self.columns}
+
+    def append(self, record):
+        for column in self.columns:
+            self.data[column].append(record[column])
+
+    def __len__(self):
+        return len(self.data[self.columns[0]]) if self.columns else 0
+
+    def to_frame(self):
+        import pandas as pd
+
+        return pd.DataFrame(self.data, columns=self.columns)
+
+
+class StreamingCSVWriter:
+    """Writes rows to a CSV in input order while generation is still running. Rows that finish
+    before an earlier row are held back until the gap is filled, and at most flush_every
+    rows are kept in memory before they are appended to the file."""
+
+    def __init__(self, path, columns, flush_every=1000):
+        self.path = path
+        self.columns = list(columns)
+        self.flush_every = flush_every
+        self.held = {}
+        self.next_position = 0
+        self.chunk = ResultBuilder(self.columns)
+        self.header_written = False
+        self.rows_written = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def put(self, position, record):
+        self.held[position] = record
+        while self.next_position in self.held:
+            self.chunk.append(self.held.pop(self.next_position))
+            self.next_position += 1
+        if len(self.chunk) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not len(self.chunk):
+            return
+        self.chunk.to_frame().to_csv(self.path, mode='a' if self.header_written else 'w', header=not self.header_written, index=False)
+        self.header_written = True
+        self.rows_written += len(self.chunk)
+        self.chunk = ResultBuilder(self.columns)
+
+    def close(self):
+        import pandas as pd
+
+        if self.held:
+            raise RuntimeError(f"{len(self.held)} rows finished but row {self.next_position} never did")
+        self.flush()
+        if not self.header_written:
+            # Keep the schema even when no row was generated
+            pd.DataFrame(columns=self.columns).to_csv(self.path, index=False)
+            self.header_written = True
@@ -0,0 +1,53 @@
+import hashlib
+import subprocess
+import sys
+
+# Data-parallel generation. Every worker takes the rows whose key hashes to its rank and writes
+# them, in input order, to its own part file. Because the assignment only depends on the row key,
+# the merge can replay the input file and pull each row from the part of the worker that owns it,
+# which gives the same row order for any number of workers.
+
+
+def shard_of(key, num_workers):
+    digest = hashlib.sha1('\x1f'.join(key).encode('utf-8')).hexdigest()
+    return int(digest[:16], 16) % num_workers
+
+
+def part_path(output_path, worker_rank, num_workers):
+    stem, _, extension = output_path.rpartition('.')
+    return f"{stem}.part-{worker_rank:03d}-of-{num_workers:03d}.{extension}"
+
+
+# Function to merge worker parts into one file, ordered like the input keys
+def merge_parts(output_path, keys, num_workers):
+    import pandas as pd
+
+    parts = [pd.read_csv(part_path(output_path, rank, num_workers)) for rank in range(num_workers)]
+    offsets = [0] * num_workers
+    for rank in range(1, num_workers):
+        offsets[rank] = offsets[rank - 1] + len(parts[rank - 1])
+
+    # Position of every input row inside the concatenation of all parts
+    next_row = [0] * num_workers
+    order = []
+    for key in keys:
+        rank = shard_of(key, num_workers)
+        order.append(offsets[rank] + next_row[rank])
+        next_row[rank] += 1
+
+    for rank, part in enumerate(parts):
+        if next_row[rank] != len(part):
+            raise RuntimeError(f"Part {part_path(output_path, rank, num_workers)} has {len(part)} rows, expected {next_row[rank]}")
+
+    merged = pd.concat(parts, ignore_index=True).iloc[order].reset_index(drop=True)
+    merged.to_csv(output_path, index=False)
+    return merged
+
+
+# Function to run the same command once per worker rank and wait for all of them
+def launch_local(argv, num_workers):
+    processes = [subprocess.Popen([sys.executable] + argv + ['--num_workers', str(num_workers), '--worker_rank', str(rank)])
+                 for rank in range(num_workers)]
+    failed = [rank for rank, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise RuntimeError(f"Workers {failed} failed")
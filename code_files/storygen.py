@@ -1,42 +1,37 @@
 import argparse
 from collections import defaultdict
-import pandas as pd
 import random
-from vllm import LLM, SamplingParams
-from hf_olmo import OLMoForCausalLM, OLMoTokenizerFast
-import torch
 import re
 import os
-from tqdm import tqdm 
+import shutil
+import sys
 import subprocess
-import gc
+import time
+from backends import BACKENDS, ORDERINGS, GenerationBackend, ModelPool, VLLMBackend, iter_generate_batched, load_model_specs, output_name_for
+from checkpoint import ShardWriter, assemble_from_shards, load_done_keys, row_key
+from cs4_dataset import NUM_CONSTRAINTS
+from decode_budget import DEFAULT_MARGIN, DEFAULT_TOKENS_PER_WORD, budget_report, decode_budget
+from prompt_planner import PromptPlan
+from results import ResultBuilder, StreamingCSVWriter
+from sharding import launch_local, merge_parts, part_path, shard_of
+
+# The telemetry layer is shared with the evaluation scripts
+EVALUATION_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'evaluation')
+if EVALUATION_DIR not in sys.path:
+    sys.path.append(EVALUATION_DIR)
+from telemetry import add_rows, add_telemetry_arguments, configure, get_telemetry, stage
 
 
 max_tokens = 4096
-sampling_params = SamplingParams(max_tokens=max_tokens, temperature=0.8, top_p=0.95)
 
 
-def generate_response(tokenizer, olmo, prompt_text, max_tokens=4096):
-    # Load the model and tokenizer
-    
-    # Create chat history
-    chat = [
-        {"role": "user", "content": prompt_text},
-    ]
-
-    # Apply chat template and tokenize
-    prompt = tokenizer.apply_chat_template(chat, tokenize=False, add_generation_prompt=True)
-    inputs = tokenizer.encode(prompt, add_special_tokens=False, return_tensors="pt").to('cuda')
+# vllm is imported only when a bare vllm.LLM needs the default sampling parameters
+def default_sampling_params():
+    from vllm import SamplingParams
+    return SamplingParams(max_tokens=max_tokens, temperature=0.8, top_p=0.95)
 
-    # Generate response
-    response = olmo.generate(input_ids=inputs, max_new_tokens=max_tokens, do_sample=True, top_p=0.95)
-    inputs = inputs.cpu()
 
-    # Decode and return response
-    return tokenizer.batch_decode(response, skip_special_tokens=True)[0]
-
-    
-def clear_cache_if_needed(directory, directo):
+def clear_cache_if_needed(directory):
     # Execute the df command to check disk usage for the specified directory
     abs_directory = os.path.expanduser(directory)
 
@@ -51,75 +46,130 @@ def clear_cache_if_needed(directory, directo):
     usage_percentage = int(fields[4].rstrip('%'))
     
     # Check if usage exceeds 85%
-    files_in_directory = os.listdir('/home/rbheemreddy_umass_edu/.cache/huggingface/hub')
+    files_in_directory = os.listdir(abs_directory)
     print(files_in_directory)
 
     if usage_percentage>60:
-        command = f"rm -rfv ~/.cache/huggingface/hub/*"
-        subprocess.call(command, shell=True)
+        # Remove the directory's entries directly; the path comes from the command line and never goes through a shell
+        for name in files_in_directory:
+            path = os.path.join(abs_directory, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            print(f"removed {path}")
 
         print(f"Cache cleared successfully for models as usage percentage is {usage_percentage}")
     else:
         print("Disk usage is below 60%. No need to clear cache. Usage Percentage:", usage_percentage)
 
 
-def clear_cuda_memory():
-    torch.cuda.empty_cache()
+# Function to build the revision prompt for one row of the constraints CSV
+def build_storygen_prompt(row):
+    revision_prompt = f"Now revise the given BaseStory to satisfy the following constraints within 500 words: \n{row['SelectedConstraints']}"
+    return f"""Story Instruction: {row['Instruction']}\nBaseStory: {row["BaseStory"]}\nTask: {revision_prompt}"""
+
+
+# Function to get a row's story-length instruction: the Instruction's own limit when it states one,
+# otherwise the "within 500 words" of the revision prompt
+def budget_text(row):
+    return f"{row['Instruction']}\nwithin 500 words"
+
+
+# Function to get the part of the prompt shared by every constraint variant of an instruction
+def storygen_prefix(row):
+    prompt = build_storygen_prompt(row)
+    return prompt[:len(prompt) - len(str(row['SelectedConstraints']))]
+
+
+STORY_COLUMNS = ['Instruction', 'Constraints', 'BaseStory', 'Direction', 'Model', 'SelectedConstraints', 'Number_of_Constraints', 'Final_Prompt', 'FinalGeneratedStory']
+
+
+# Function to build one output row from an input row and its generated story
+def story_record(row, storygen_prompt, final_generated_story):
+    return {
+        'Instruction': row['Instruction'],
+        # 'Category': row['Category'],
+        'Constraints': row['Constraints'],
+        'BaseStory': row["BaseStory"],
+        'Direction': row['Direction'],
+        'Model': row["Model"],
+        'SelectedConstraints': row['SelectedConstraints'],
+        'Number_of_Constraints': row['Number_of_Constraints'],
+        'Final_Prompt': storygen_prompt,
+        'FinalGeneratedStory': final_generated_story
+    }
 
 
 """Takes one instruction as input -> generates story based on the input -> proceed further with tuning the story based on the constraints selected"""
-def addNewStory(df, list_num_constraints, llm=None):
-    # Initialize an empty DataFrame to store the results
-    single_instruction_df = pd.DataFrame(columns=['Instruction', 'Constraints', 'BaseStory', 'Direction', 'Model', 'SelectedConstraints', 'Number_of_Constraints', 'Final_Prompt', 'FinalGeneratedStory'])
-
-
-    if llm==None:
-        olmo = OLMoForCausalLM.from_pretrained(model).to('cuda')
-        tokenizer = OLMoTokenizerFast.from_pretrained(model)
-    for index, row in tqdm(df.iterrows(), total=len(df), desc="Processing rows"):
-
-        revision_prompt = f"Now revise the given BaseStory to satisfy the following constraints within 500 words: \n{row['SelectedConstraints']}"
-        storygen_prompt = f"""Story Instruction: {row['Instruction']}\nBaseStory: {row["BaseStory"]}\nTask: {revision_prompt}"""
-        
-        if llm==None:
-            final_generated_story = generate_response(tokenizer, olmo, storygen_prompt, max_tokens)
-        else:
-            # sampling_params = 
-            output2 = llm.generate([storygen_prompt], sampling_params)
-            for output in output2:
-                final_generated_story = output.outputs[0].text
-
-        # Add the data to the result DataFrame
-
-        single_instruction_df.loc[len(single_instruction_df)] = {
-            'Instruction': row['Instruction'],
-            # 'Category': row['Category'],
-            'Constraints': row['Constraints'],
-            'BaseStory': row["BaseStory"],
-            'Direction': row['Direction'],
-            'Model': row["Model"],
-            'SelectedConstraints': row['SelectedConstraints'],
-            'Number_of_Constraints': row['Number_of_Constraints'],
-            'Final_Prompt': storygen_prompt,
-            'FinalGeneratedStory': final_generated_story
-        }
-
-    return single_instruction_df
-
-def generalcall(llm, name_model, filename):
-
-    if "gemma" in name_model:
-        base_path = 'gemma'
-    if "Llama" in name_model:
-        base_path = 'llama'
-    if "Mistral" in name_model:
-        base_path = 'mistral'
-    if "OLMo-7B-hf" in name_model:
-        base_path = 'olmo_basehf'
-    if "OLMo-7B-SFT" in name_model:
-        base_path = 'olmo_sft'
-    if "OLMo-7B-Instruct" in name_model:
-        base_path = 'olmo_instruct'
+def addNewStory(df, list_num_constraints, llm, batch_size=None, order='input', writer=None, stream_path=None, plan_prompts=False, word_budget=None):
+    # Rows are accumulated column by column and turned into a DataFrame once at the end.
+    # With stream_path the rows go straight to that CSV instead and nothing is returned.
+    results = ResultBuilder(STORY_COLUMNS)
+    stream = StreamingCSVWriter(stream_path, STORY_COLUMNS) if stream_path else None
+
+    # Build every prompt up front so the batched path can submit them together
+    rows = [row for _, row in df.iterrows()]
+    prompts = [build_storygen_prompt(row) for row in rows]
+
+    # llm is a GenerationBackend; a bare vllm.LLM is wrapped with the default sampling parameters.
+    # Chunks of (row positions, generated stories) are yielded as soon as they are finished.
+    backend = llm if isinstance(llm, GenerationBackend) else VLLMBackend(llm, default_sampling_params())
+    # word_budget = (margin, tokens per word) gives every row a decode budget from its word limit
+    budgets = None
+    decode_tokens_before = backend.decode_tokens
+    if word_budget is not None:
+        cap = backend.max_tokens or max_tokens
+        budgets = [decode_budget(budget_text(row), cap, *word_budget, constraints=str(row['SelectedConstraints'])) for row in rows]
+        print(budget_report(budgets, cap))
+
+    if plan_prompts:
+        # Generate each distinct prompt once, with prompts sharing a prefix submitted together
+        plan = PromptPlan(prompts, [storygen_prefix(row) for row in rows], count_tokens=getattr(backend, 'count_tokens', None))
+        print(plan.report())
+        planned_budgets = None if budgets is None else [budgets[rows_of[0]] for rows_of in plan.rows]
+        finished = plan.expand(iter_generate_batched(backend, plan.prompts, chunk_size=batch_size, prefixes=plan.prefixes, budgets=planned_budgets))
+    else:
+        finished = iter_generate_batched(backend, prompts, chunk_size=batch_size, order=order, budgets=budgets)
+
+    # Every finished chunk is a telemetry event with its generation time and token counts
+    telemetry = get_telemetry()
+    add_rows(len(rows))
+    tokens_seen = (backend.prompt_tokens, backend.decode_tokens)
+    chunk_started = time.perf_counter()
+    stories = [None] * len(rows)
+    for chunk, texts in finished:
+        telemetry.generation(len(chunk), time.perf_counter() - chunk_started, backend.prompt_tokens - tokens_seen[0], backend.decode_tokens - tokens_seen[1])
+        tokens_seen = (backend.prompt_tokens, backend.decode_tokens)
+        for position, text in zip(chunk, texts):
+            record = story_record(rows[position], prompts[position], text)
+            # Stream the finished row to the checkpoint shard
+            if writer is not None:
+                writer.write(record)
+            if stream is not None:
+                stream.put(position, record)
+            else:
+                stories[position] = text
+        chunk_started = time.perf_counter()
+
+    decoded = backend.decode_tokens - decode_tokens_before
+    if budgets is not None and decoded:
+        cap_total = (backend.max_tokens or max_tokens) * len(rows)
+        print(f"Decoded {decoded} tokens; the max_tokens cap allowed {cap_total} ({cap_total - decoded} decode tokens saved)")
+
+    if stream is not None:
+        stream.close()
+        return None
+
+    for row, storygen_prompt, final_generated_story in zip(rows, prompts, stories):
+        # Add the data to the result builder
+        results.append(story_record(row, storygen_prompt, final_generated_story))
+
+    return results.to_frame()
+
+# Function to read the constraints CSV and add the output columns for one model
+def load_generation_rows(filename, base_path):
+    import pandas as pd
 
     auto_gen = pd.read_csv(filename)
     unique_instructions = auto_gen['Instruction'].unique()
@@ -130,32 +180,80 @@ def generalcall(llm, name_model, filename):
     auto_gen_eval['Final_Prompt'] = ''
     auto_gen_eval['FinalGeneratedStory'] = ''
     auto_gen_eval['Model'] = base_path
+    return auto_gen_eval
 
-    # List of constraints to try
-    list_num_constraints = [7, 15, 23, 31, 39]
 
-    # Initialize an empty list to store all generated DataFrames
-    all_dfs = []
-    count=0
+def direction_of(filename):
+    if "direction3" in filename:
+        return "d3"
+    elif "direction2" in filename:
+        return 'd2'
+
 
-    combined_df = addNewStory(auto_gen_eval, list_num_constraints, llm)
+def output_file_for(base_path, d):
+    return os.path.join(base_path, f'{d}_{base_path}_{d}.csv')
 
-    # Append the generated DataFrame to the list
-    all_dfs.append(combined_df)
 
-    # Concatenate all DataFrames in the list into a single DataFrame
-    total_stories_df = pd.concat(all_dfs, ignore_index=True)
+def generalcall(llm, name_model, filename, batch_size=None, order='input', checkpoint_dir=None, flush_every=50, stream_output=False, output_name=None, plan_prompts=False, num_workers=1, worker_rank=0, word_budget=None):
+    import pandas as pd
 
-    # Save the combined DataFrame to a single CSV file
-    if "direction3" in filename:
-        d = "d3"
-    elif "direction2" in filename:
-        d = 'd2'
+    # Output directory / file prefix, e.g. "llama" for meta-llama/Llama-2-7b-chat-hf
+    base_path = output_name or output_name_for(name_model)
+    d = direction_of(filename)
+    output_file = output_file_for(base_path, d)
+
+    auto_gen_eval = load_generation_rows(filename, base_path)
+
+    if num_workers > 1:
+        # Keep only this worker's hash shard of the rows; merge_outputs() puts the parts back together
+        auto_gen_eval = auto_gen_eval[[shard_of(row_key(row), num_workers) == worker_rank for _, row in auto_gen_eval.iterrows()]]
+        output_file = part_path(output_file, worker_rank, num_workers)
+        print(f"Worker {worker_rank}/{num_workers}: {len(auto_gen_eval)} rows")
+
+    # List of constraints to try
+    list_num_constraints = list(NUM_CONSTRAINTS)
+
+    if checkpoint_dir:
+        # Skip rows that a previous (crashed) run already generated, then rebuild the output from the shards
+        model_checkpoint_dir = os.path.join(checkpoint_dir, f'{d}_{base_path}')
+        keys = [row_key(row) for _, row in auto_gen_eval.iterrows()]
+        done = load_done_keys(model_checkpoint_dir)
+        pending = auto_gen_eval[[key not in done for key in keys]]
+        print(f"Checkpoint {model_checkpoint_dir}: {len(auto_gen_eval) - len(pending)} rows done, {len(pending)} to generate")
+
+        with ShardWriter(model_checkpoint_dir, flush_every=flush_every) as writer:
+            addNewStory(pending, list_num_constraints, llm, batch_size=batch_size, order=order, writer=writer, plan_prompts=plan_prompts, word_budget=word_budget)
+        total_stories_df = assemble_from_shards(model_checkpoint_dir, STORY_COLUMNS, keys)
+    elif stream_output:
+        # Very large sweeps: write rows to the final CSV as they finish instead of holding them all
+        os.makedirs(base_path, exist_ok=True)
+        addNewStory(auto_gen_eval, list_num_constraints, llm, batch_size=batch_size, order=order, plan_prompts=plan_prompts, word_budget=word_budget, stream_path=output_file)
+        print("Path saving file:", output_file)
+        return
+    else:
+        # Initialize an empty list to store all generated DataFrames
+        all_dfs = []
+
+        combined_df = addNewStory(auto_gen_eval, list_num_constraints, llm, batch_size=batch_size, order=order, plan_prompts=plan_prompts, word_budget=word_budget)
+
+        # Append the generated DataFrame to the list
+        all_dfs.append(combined_df)
+
+        # Concatenate all DataFrames in the list into a single DataFrame
+        total_stories_df = pd.concat(all_dfs, ignore_index=True)
 
-    save_path = f"{base_path}"
+    # Save the combined DataFrame to a single CSV file
     os.makedirs(base_path, exist_ok=True)
-    print("Path saving file:", save_path)
-    total_stories_df.to_csv(os.path.join(save_path, f'{d}_{base_path}_{d}.csv'), index=False)
+    print("Path saving file:", output_file)
+    total_stories_df.to_csv(output_file, index=False)
+
+
+# Function to merge the worker parts of one model/file into the usual output CSV
+def merge_outputs(filename, output_name, num_workers):
+    keys = [row_key(row) for _, row in load_generation_rows(filename, output_name).iterrows()]
+    output_file = output_file_for(output_name, direction_of(filename))
+    merge_parts(output_file, keys, num_workers)
+    print("Merged worker parts into", output_file)
 
 
 def main():
@@ -163,37 +261,68 @@ def main():
     parser = argparse.ArgumentParser(description="Generate Stories")
 
     # Add arguments to the parser
-    parser.add_argument('file_path', type=str, help='The path to the constraints')
+    parser.add_argument('file_path', type=str, nargs='+', help='The path to the constraints (several files are run one after another)')
+    parser.add_argument('--model_config', type=str, default=None, help='YAML file with a "models" list (name, backend, output_name, memory_gb, options)')
+    parser.add_argument('--models', nargs='+', default=None, help=f'Models as name[:backend] with backend one of {sorted(BACKENDS)}; default is the three OLMo checkpoints')
+    parser.add_argument('--memory_budget_gb', type=float, default=None, help='Keep recently used models loaded up to this many GB (default: one model at a time)')
+    parser.add_argument('--fake_backends', action='store_true', help='Replace every backend with its CPU fake, to dry-run a sweep')
+    parser.add_argument('--hf_cache_dir', type=str, default=None, help='Hugging Face hub cache to clear when the disk is nearly full')
+    parser.add_argument('--batch_size', type=int, default=None, help='Number of prompts submitted to vLLM per call (default: the whole file at once)')
+    parser.add_argument('--order', choices=ORDERINGS, default='input', help='Submission order of the prompts, e.g. longest_first to cut tail latency')
+    parser.add_argument('--plan_prompts', action='store_true', help='Deduplicate identical prompts and submit prompts sharing an instruction/base story together (overrides --order)')
+    parser.add_argument('--word_budget', action='store_true', help='Limit each row\'s decode tokens by the word limit in its instruction/constraints and stop once it is reached')
+    parser.add_argument('--budget_margin', type=float, default=DEFAULT_MARGIN, help='Extra fraction of words allowed beyond the word limit')
+    parser.add_argument('--tokens_per_word', type=float, default=DEFAULT_TOKENS_PER_WORD, help='Tokens per word used to turn the word budget into max_tokens')
+    parser.add_argument('--checkpoint_dir', type=str, default=None, help='Directory for append-only checkpoint shards; rows already in it are skipped on restart')
+    parser.add_argument('--flush_every', type=int, default=50, help='Number of finished rows buffered before a checkpoint shard is flushed')
+    parser.add_argument('--stream_output', action='store_true', help='Write rows to the output CSV as they finish instead of keeping the whole sweep in memory')
+    parser.add_argument('--num_workers', type=int, default=1, help='Total number of data-parallel workers')
+    parser.add_argument('--worker_rank', type=int, default=0, help='Rank of this worker; it generates the rows whose key hashes to this rank')
+    parser.add_argument('--launch_local', type=int, default=None, help='Spawn this many local workers, wait for them and merge their parts')
+    parser.add_argument('--merge_only', action='store_true', help='Only merge the parts written by --num_workers workers')
+    add_telemetry_arguments(parser)
 
     # Parse the arguments
     args = parser.parse_args()
-
-    # Access the arguments
-    file_path = args.file_path
-
-    for model  in ['allenai/OLMo-7B-SFT', 'allenai/OLMo-7B-Instruct', 'allenai/OLMo-7B-hf']:
-        
-        clear_cache_if_needed(directory)
-        
-        if model in ['allenai/OLMo-7B-hf']:
-            print("name of model", model)
-            llm = LLM(model=model, dtype=torch.float16)
-            generalcall(llm=llm, name_model=model, filename=file_path)
-            del llm
-        else:
-            generalcall(llm=None, name_model=model, filename=file_path)
-
-        print(f"Model {model} DONE")
-        
-        # Clear the model object from memory
-        del model
-        
-        gc.collect()
-        clear_cuda_memory()
-        
-        print("CUDA memory cleared.")
-
-        clear_cache_if_needed(directory)
+    # Before --launch_local, so that the workers add to the same telemetry run
+    configure(args.telemetry_dir)
+
+    specs = load_model_specs(args.model_config, args.models)
+
+    if args.launch_local:
+        # Re-run this command once per rank, then merge
+        argv = list(sys.argv)
+        position = next(i for i, arg in enumerate(argv) if arg.startswith('--launch_local'))
+        del argv[position:position + (1 if '=' in argv[position] else 2)]
+        launch_local(argv, args.launch_local)
+        args.num_workers = args.launch_local
+        args.merge_only = True
+
+    if args.merge_only:
+        for file_path in args.file_path:
+            for spec in specs:
+                merge_outputs(file_path, spec['output_name'], args.num_workers)
+        return
+    pool = ModelPool(memory_budget_gb=args.memory_budget_gb, fake=args.fake_backends)
+
+    for file_path in args.file_path:
+        for spec in specs:
+            if args.hf_cache_dir:
+                clear_cache_if_needed(args.hf_cache_dir)
+
+            print("name of model", spec['name'])
+            with stage(f"load:{spec['name']}", backend=spec['backend']):
+                backend = pool.get(spec)
+            with stage(f"generate:{spec['output_name']}:{direction_of(file_path)}", model=spec['name']):
+                generalcall(llm=backend, name_model=spec['name'], filename=file_path, batch_size=args.batch_size, order=args.order,
+                            checkpoint_dir=args.checkpoint_dir, flush_every=args.flush_every, stream_output=args.stream_output, output_name=spec['output_name'], plan_prompts=args.plan_prompts,
+                            num_workers=args.num_workers, worker_rank=args.worker_rank,
+                            word_budget=(args.budget_margin, args.tokens_per_word) if args.word_budget else None)
+
+            print(f"Model {spec['name']} DONE")
+
+    pool.close()
+    print(f"Model pool: {pool.loads} loads, {pool.hits} reuses, {pool.evictions} evictions")
 
 
 if __name__=="__main__":
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+
+from resources import CACHE_DIR, lazy_module
+from results_store import DEFAULT_DIRECTION, open_store, read_results, store_filter
+from telemetry import add_rows
+
+pd = lazy_module('pandas')
+
+# Shared aggregation behind the plotting scripts.
+# The per-story results of any number of models (CSV files or the results store) are reduced in one
+# grouped pass to a small table with one row per (model, direction, Number_of_Constraints) and
+# every statistic the graphs use. The table is cached as Parquet together with a fingerprint of its
+# sources (paths, sizes and modification times), and is only recomputed when a source changes; the
+# table of a store sits next to it, the table of CSV files under $CS4_CACHE_DIR/aggregates.
+# Models and directions selected from a store are pushed down to the scan as partition filters, so
+# only their files are read (and fingerprinted). Metrics a source does not have are left as NaN.
+
+GROUP_COLUMNS = ['model', 'direction', 'Number_of_Constraints']
+METRIC_COLUMNS = ['satisfied', 'Percentage_GPT4', 'Product_diversity', 'Perplexity', 'coherence_score']
+MARKERS = ['o', '^', 's', 'D', 'v', 'P', 'X', '*']
+
+
+# Function to compute the aggregate table from per-story rows (GROUP_COLUMNS plus any METRIC_COLUMNS)
+def aggregate(df):
+    df = df.assign(**{column: pd.to_numeric(df[column], errors='coerce') if column in df.columns else float('nan') for column in METRIC_COLUMNS})
+    grouped = df.groupby(GROUP_COLUMNS, sort=False, observed=True)
+    table = grouped.agg(
+        stories=('Number_of_Constraints', 'size'),
+        satisfied=('satisfied', 'mean'),
+        Product_diversity=('Product_diversity', 'mean'),
+        Perplexity=('Perplexity', 'mean'),
+    )
+    # Sums stay NaN for groups without any value
+    totals = grouped[['Percentage_GPT4', 'coherence_score']].sum(min_count=1)
+    table['total_percentage_gpt4'] = totals['Percentage_GPT4']
+    table['total_coherence_score'] = totals['coherence_score']
+    table = table.reset_index()
+    # As in coherence_vs_constraint_graph: satisfaction averaged over all stories of a constraint count,
+    # coherence normalized by the largest total of the model
+    table['average_percentage_gpt4'] = table['total_percentage_gpt4'] / table['stories']
+    maximum = table.groupby(['model', 'direction'], sort=False)['total_coherence_score'].transform('max')
+    table['normalized_coherence_score'] = table['total_coherence_score'] / maximum
+    return table.sort_values(['direction', 'Number_of_Constraints'], kind='stable').reset_index(drop=True)
+
+
+# Function to read only the grouping and metric columns of the sources; sources is a list of (model, csv_path).
+# models/directions select the partitions read from a store.
+def source_rows(sources=None, store=None, direction=DEFAULT_DIRECTION, models=None, directions=None):
+    if store:
+        available = set(open_store(store).schema.names)
+        return read_results(store, GROUP_COLUMNS + [column for column in METRIC_COLUMNS if column in available], models=models, directions=directions)
+    frames = []
+    for model, path in sources:
+        df = pd.read_csv(path, usecols=lambda column: column in METRIC_COLUMNS or column == 'Number_of_Constraints')
+        frames.append(df.assign(model=model, direction=direction))
+    return pd.concat(frames, ignore_index=True)
+
+
+def source_fingerprint(sources=None, store=None, direction=DEFAULT_DIRECTION, models=None, directions=None):
+    if store:
+        files = sorted(fragment.path for fragment in open_store(store).get_fragments(filter=store_filter(models, directions)))
+        labels = None
+    else:
+        files = [path for _, path in sources]
+        labels = [model for model, _ in sources]
+    stats = [(os.path.abspath(path), os.path.getsize(path), os.stat(path).st_mtime_ns) for path in files]
+    payload = {'files': stats, 'labels': labels, 'direction': direction, 'metrics': METRIC_COLUMNS,
+               'models': models and sorted(models), 'directions': directions and sorted(directions)}
+    return hashlib.sha256(json.dumps(payload).encode('utf-8')).hexdigest()
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value).encode('utf-8')).hexdigest()[:12]
+
+
+# Function to give the cache file of a store (one per selection of models/directions) or of a list of CSV sources
+def default_cache_path(store=None, sources=None, direction=DEFAULT_DIRECTION, models=None, directions=None):
+    if store:
+        selection = '' if models is None and directions is None else '.' + _digest([models and sorted(models), directions and sorted(directions)])
+        return store.rstrip('/\\') + f'.aggregates{selection}.parquet'
+    key = [[model, os.path.abspath(path)] for model, path in sources] + [direction]
+    return os.path.join(CACHE_DIR, 'aggregates', f'{_digest(key)}.parquet')
+
+
+def read_cached(cache_path, fingerprint=None):
+    import pyarrow.parquet as pq
+
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+    table = pq.read_table(cache_path)
+    if fingerprint is not None and (table.schema.metadata or {}).get(b'fingerprint') != fingerprint.encode('utf-8'):
+        return None
+    return table.to_pandas()
+
+
+def write_cached(table, cache_path, fingerprint):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    directory = os.path.dirname(cache_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+    pq.write_table(arrow_table.replace_schema_metadata({**(arrow_table.schema.metadata or {}), b'fingerprint': fingerprint.encode('utf-8')}), cache_path)
+
+
+# Function to load the aggregate table, from the cache when its sources are unchanged. With neither
+# sources nor a store, the cached table at cache_path is read as it is. models/directions only
+# select partitions of a store.
+def load_aggregates(sources=None, store=None, cache_path=None, direction=DEFAULT_DIRECTION, models=None, directions=None):
+    if not sources and not store:
+        table = read_cached(cache_path)
+        if table is None:
+            raise FileNotFoundError(f"No aggregate table at {cache_path}")
+        return table
+
+    if not store:
+        models = directions = None
+    if cache_path is None:
+        cache_path = default_cache_path(store, sources, direction, models, directions)
+    fingerprint = source_fingerprint(sources, store, direction, models, directions)
+    table = read_cached(cache_path, fingerprint)
+    if table is None:
+        table = aggregate(source_rows(sources, store, direction, models, directions))
+        write_cached(table, cache_path, fingerprint)
+    return table
+
+
+# Function used by the pipeline to (re)build the cached table of a results store
+def write_aggregates(store, output_path):
+    table = aggregate(source_rows(store=store))
+    write_cached(table, output_path, source_fingerprint(store=store))
+    add_rows(int(table['stories'].sum()))
+    print(f"Aggregated {int(table['stories'].sum())} stories into {len(table)} rows at {output_path}")
+
+
+# Function to split the table into a frame per model (indexed by Number_of_Constraints) with the given columns.
+# Models with several directions get one frame per direction, labelled "model (direction)".
+def model_frames(table, columns, models=None, direction=None):
+    if direction:
+        table = table[table['direction'] == direction]
+    models = models or list(dict.fromkeys(table['model']))
+    frames = {}
+    for model in models:
+        rows = table[table['model'] == model]
+        if rows.empty:
+            raise ValueError(f"No results for model {model!r}")
+        directions = list(dict.fromkeys(rows['direction']))
+        for model_direction in directions:
+            frame = rows[rows['direction'] == model_direction].set_index('Number_of_Constraints')[list(columns)].sort_index()
+            frames[model if len(directions) == 1 else f"{model} ({model_direction})"] = frame
+    if not frames:
+        raise ValueError(f"No results to plot{f' for direction {direction!r}' if direction else ''}")
+    return frames
+
+
+def model_series(table, metric, models=None, direction=None):
+    return {label: frame[metric] for label, frame in model_frames(table, [metric], models, direction).items()}
+
+
+# Function to draw a plot ("module.function" taking the table first) from a cached aggregate table; used by the pipeline
+def render(plot, aggregates, **kwargs):
+    import importlib
+
+    module, function = plot.rsplit('.', 1)
+    getattr(importlib.import_module(module), function)(load_aggregates(cache_path=aggregates), **kwargs)
+
+
+def add_source_arguments(parser):
+    parser.add_argument('--input_csv', nargs='+', default=None, help="Result CSV files of any number of models (format: model_name file_path ...)")
+    parser.add_argument('--file1', required=False, help="Path to the first CSV file")
+    parser.add_argument('--file2', required=False, help="Path to the second CSV file")
+    parser.add_argument('--file3', required=False, help="Path to the third CSV file")
+    parser.add_argument('--label1', default="Gemma-7B Instruct", help="Label for the first model (default: Gemma-7B Instruct)")
+    parser.add_argument('--label2', default="Llama-2-7B Chat", help="Label for the second model (default: Llama-2-7B Chat)")
+    parser.add_argument('--label3', default="Mistral-7B Instruct", help="Label for the third model (default: Mistral-7B Instruct)")
+    parser.add_argument('--store', default=None, help="Read the models from this results store instead of CSV files")
+    parser.add_argument('--models', nargs='+', default=None, help="Models to plot from the store (default: all)")
+    parser.add_argument('--direction', default=None, help="Only plot this direction (default: all)")
+    parser.add_argument('--aggregates', default=None, help="Cached aggregate table (default: <store>.aggregates*.parquet for --store, "
+                                                           "under $CS4_CACHE_DIR/aggregates for CSV files); used as it is when no CSV files or store are given")
+
+
+# Function to get the (model, csv_path) sources of the source arguments; None when they name no CSV files
+def sources_from_args(parser, args):
+    if args.input_csv:
+        if len(args.input_csv) % 2:
+            parser.error("--input_csv takes pairs of model_name file_path")
+        return [(args.input_csv[i], args.input_csv[i + 1]) for i in range(0, len(args.input_csv), 2)]
+    if args.file1 or args.file2 or args.file3:
+        return [(label, path) for label, path in ((args.label1, args.file1), (args.label2, args.file2), (args.label3, args.file3)) if path]
+    return None
+
+
+# Function to load the aggregate table for the source arguments; returns (table, models)
+def aggregates_from_args(parser, args):
+    sources = sources_from_args(parser, args)
+    if not sources and not args.store and not args.aggregates:
+        parser.error("pass the model results with --input_csv, --file1/--file2/--file3, --store or --aggregates")
+
+    table = load_aggregates(sources, args.store, args.aggregates, models=args.models, directions=store_directions(args))
+    models = [model for model, _ in sources] if sources else args.models
+    return table, models
+
+
+# Function to give the --direction selection as a store partition filter
+def store_directions(args):
+    return [args.direction] if args.direction else None
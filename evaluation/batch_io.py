@@ -0,0 +1,144 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+
+# Offline batch mode for the GPT judges.
+# --export-batch writes every judge request as one line of an OpenAI-style batch input file
+# ({"custom_id", "method", "url", "body"}), split into files capped by request count and size.
+# The results file returned by the provider ({"custom_id", "response", "error"} per line) is read
+# back with read_batch_results and joined onto the DataFrame by custom_id.
+# custom_ids are stable: they are built from the row and a hash of the request body, so an import
+# can tell results that belong to a changed story (stale) from current ones.
+
+BATCH_URL = "/v1/chat/completions"
+MAX_REQUESTS_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024
+
+
+def body_hash(body):
+    return hashlib.sha1(json.dumps(body, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:10]
+
+
+def make_custom_id(prefix, parts, body):
+    return '-'.join([prefix] + [str(part) for part in parts] + [body_hash(body)])
+
+
+def parse_custom_id(custom_id):
+    # Returns (prefix, parts, hash)
+    pieces = custom_id.split('-')
+    return pieces[0], pieces[1:-1], pieces[-1]
+
+
+# Function to write (custom_id, body) requests to size-capped batch files; returns the file paths
+def export_batch(requests, output_prefix, max_requests=MAX_REQUESTS_PER_FILE, max_bytes=MAX_BYTES_PER_FILE):
+    directory = os.path.dirname(output_prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    batch_file = None
+    count = size = 0
+    for custom_id, body in requests:
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_URL, "body": body}, ensure_ascii=False) + '\n'
+        line_bytes = len(line.encode('utf-8'))
+        if batch_file is None or count >= max_requests or size + line_bytes > max_bytes:
+            if batch_file is not None:
+                batch_file.close()
+            paths.append(f"{output_prefix}-{len(paths):03d}.jsonl")
+            batch_file = open(paths[-1], 'w', encoding='utf-8')
+            count = size = 0
+        batch_file.write(line)
+        count += 1
+        size += line_bytes
+    if batch_file is not None:
+        batch_file.close()
+
+    print(f"Exported {len(requests)} judge requests to {len(paths)} batch file(s): {', '.join(paths)}")
+    return paths
+
+
+# Function to read batch result files into {custom_id: (content, error)}; exactly one of the two is None
+def read_batch_results(paths):
+    results = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as result_file:
+            for line in result_file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get('response') or {}
+                error = entry.get('error')
+                if error is None and response.get('status_code', 200) != 200:
+                    error = response.get('body', {}).get('error', f"status {response.get('status_code')}")
+                if error is not None:
+                    results[entry['custom_id']] = (None, error.get('message', str(error)) if isinstance(error, dict) else str(error))
+                    continue
+                try:
+                    results[entry['custom_id']] = (response['body']['choices'][0]['message']['content'], None)
+                except (KeyError, IndexError, TypeError):
+                    results[entry['custom_id']] = (None, "malformed response")
+    return results
+
+
+# Function to join batch results onto requests; returns {key: (content, error)} for every request key.
+# requests is a list of (key, custom_id); missing and stale results come back as errors.
+def join_results(requests, results):
+    by_row = {}
+    for custom_id in results:
+        prefix, parts, _ = parse_custom_id(custom_id)
+        by_row['-'.join([prefix] + parts)] = custom_id
+
+    joined = {}
+    for key, custom_id in requests:
+        if custom_id in results:
+            joined[key] = results[custom_id]
+            continue
+        prefix, parts, _ = parse_custom_id(custom_id)
+        if '-'.join([prefix] + parts) in by_row:
+            joined[key] = (None, "stale result: the request changed since export")
+        else:
+            joined[key] = (None, "missing from batch results")
+    return joined
+
+
+def summarize(joined):
+    failed = sum(1 for content, _ in joined.values() if content is None)
+    return f"Imported {len(joined) - failed}/{len(joined)} judge results ({failed} missing or failed)"
+
+
+# Function to emulate a provider batch run locally: answer every request of the input files
+def run_fake_batch(input_paths, output_path, answer, failure_rate=0.0, drop_rate=0.0, seed=0):
+    rng = random.Random(seed)
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        for path in input_paths:
+            with open(path, encoding='utf-8') as input_file:
+                for line in input_file:
+                    request = json.loads(line)
+                    roll = rng.random()
+                    if roll < drop_rate:
+                        continue
+                    if roll < drop_rate + failure_rate:
+                        entry = {"id": f"batch_req_{rng.getrandbits(32):08x}", "custom_id": request['custom_id'], "response": None,
+                                 "error": {"code": "server_error", "message": "fake batch failure"}}
+                    else:
+                        user_prompt = request['body']['messages'][-1]['content']
+                        entry = {"id": f"batch_req_{rng.getrandbits(32):08x}", "custom_id": request['custom_id'],
+                                 "response": {"status_code": 200, "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": answer(user_prompt)}}]}},
+                                 "error": None}
+                    output_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+if __name__ == "__main__":
+    from stub_openai_server import judge_answer
+
+    parser = argparse.ArgumentParser(description="Process judge batch files locally with stub answers (for testing --import_batch).")
+    parser.add_argument('--input', nargs='+', required=True, help="Batch input JSONL files written by --export_batch")
+    parser.add_argument('--output', required=True, help="Path of the results JSONL file to write")
+    parser.add_argument('--failure_rate', type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument('--drop_rate', type=float, default=0.0, help="Fraction of requests missing from the results")
+    args = parser.parse_args()
+
+    run_fake_batch(args.input, args.output, judge_answer, args.failure_rate, args.drop_rate)
+    print(f"Fake batch results written to {args.output}")
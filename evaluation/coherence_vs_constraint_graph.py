@@ -1,9 +1,11 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
 import random
 import os
-from quc_and_rcs import load_grouped_dfs_from_json
+from aggregation import add_source_arguments, aggregates_from_args, model_frames
+from resources import lazy_module
+
+pd = lazy_module('pandas')
+plt = lazy_module('matplotlib.pyplot')
+sns = lazy_module('seaborn')
 
 # Dictionary mapping model short names to full names
 model_dict = {
@@ -35,6 +37,8 @@ def process_and_plot_normalized(grouped_results, title_suffix, output_dir, save_
 
     # Set colors based on available models
     colors = ['tab:blue', 'tab:orange', 'tab:green'] if 'gemma' in grouped_results else ['tab:red', 'tab:purple', 'tab:brown']
+    if len(grouped_results) > len(colors):
+        colors = [f"C{idx % 10}" for idx in range(len(grouped_results))]
 
     plt.figure(figsize=(12, 7))
     idx = 0
@@ -64,28 +68,16 @@ def main():
 
     parser = argparse.ArgumentParser(description="Plot Normalized Coherence Score by Constraint Satisfaction")
     
-    # Arguments for input CSV files and output directory
-    parser.add_argument("--input_csv", nargs='+', required=True, help="List of CSV files for each model (format: model_name file_path).")
+    # Arguments for the model results (any number of models) and output directory
+    add_source_arguments(parser)
     parser.add_argument("--output_dir", required=True, help="Directory to save the output plot.")
     parser.add_argument("--save_as_pdf", action="store_true", help="Flag to save the plot as PDF instead of displaying it.")
     
     args = parser.parse_args()
 
-    # Parse input CSV files
-    file_dict = {args.input_csv[i]: args.input_csv[i + 1] for i in range(0, len(args.input_csv), 2)}
-
-    # Load data from CSV files into grouped DataFrames
-    grouped_results = {}
-    for model, file_path in file_dict.items():
-        df = pd.read_csv(file_path)
-        grouped_model_df = df.groupby('Number_of_Constraints').agg(
-            total_coherence_score=('coherence_score', 'sum'),
-            total_percentage_gpt4=('Percentage_GPT4', 'sum')
-        )
-        grouped_model_df['average_percentage_gpt4'] = grouped_model_df['total_percentage_gpt4'] / df['Number_of_Constraints'].value_counts()
-        max_coherence_score = grouped_model_df['total_coherence_score'].max()
-        grouped_model_df['normalized_coherence_score'] = grouped_model_df['total_coherence_score'] / max_coherence_score
-        grouped_results[model] = grouped_model_df
+    # Per-model satisfaction and normalized coherence by number of constraints, from the aggregate table
+    table, models = aggregates_from_args(parser, args)
+    grouped_results = model_frames(table, ['average_percentage_gpt4', 'normalized_coherence_score'], models, args.direction)
 
     # Generate and save or display the plot
     process_and_plot_normalized(grouped_results, "Coherence vs Constraints", args.output_dir, args.save_as_pdf, "coherence_vs_constraints.pdf")
@@ -132,7 +124,7 @@ def Quc_9VsRcs_7_39(quc_results, rcs_results):
         quc_39 = quc_results[model].get("39", None)
 
         # Extract RCS_7-39 for the model
-        rcs_7_39 = rcs_results[model].get('39-7', None)
+        rcs_7_39 = rcs_results[model].get('7-39', None)
 
         # Append the data to the comparison list
         comparison_data.append({
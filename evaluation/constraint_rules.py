@@ -0,0 +1,134 @@
+import re
+
+from verdicts import response_verdicts
+
+# Deterministic checks for mechanical constraints.
+# Constraints such as "Write a story ... in less than 377 words" or "Start the story with the
+# sentence: ..." can be decided exactly from the story text, so they are taken out of the judge
+# prompt. The remaining constraints are renumbered for the judge, and its answer is mapped back to
+# the original numbering and merged with the rule verdicts.
+
+CONSTRAINT_LINE = re.compile(r"^\s*(\d+)\.\s*(.+?)\s*$", re.MULTILINE)
+WORD = re.compile(r"[A-Za-z0-9]+(?:['’-][A-Za-z0-9]+)*")
+QUOTED = r"[\"“'‘](.+?)[\"”'’]?\s*\.?\s*$"
+
+WORD_COUNT_RULE = re.compile(
+    r"\b(less than|fewer than|under|below|within|no more than|not more than|at most|up to|more than|over|at least|"
+    r"exactly|about|around|approximately|roughly)\s+(\d{1,3}(?:,\d{3})*|\d+)\s+words\b", re.IGNORECASE)
+START_RULE = re.compile(r"\b(?:start|begin)s?\s+the\s+(?:story|narrative)\s+with\s+the\s+(?:sentence|line|words?|phrase)\s*:?\s*" + QUOTED, re.IGNORECASE)
+END_RULE = re.compile(r"\bend(?:s)?\s+the\s+(?:story|narrative)\s+with\s+the\s+(?:sentence|line|words?|phrase)\s*:?\s*" + QUOTED, re.IGNORECASE)
+
+# Relative tolerance for "about N words"; the judge examples mark 470 words as missing "about 377"
+APPROXIMATE_TOLERANCE = 0.1
+RULE_EVIDENCE_PREFIX = "Rule check:"
+
+
+def count_words(text):
+    return len(WORD.findall(text))
+
+
+def normalize(text):
+    text = text.replace('“', '"').replace('”', '"').replace('‘', "'").replace('’', "'")
+    return ' '.join(text.strip().strip('"\'').split()).rstrip('.!?').lower()
+
+
+def check_word_count(story, relation, limit):
+    words = count_words(story)
+    relation = relation.lower()
+    if relation in ('less than', 'fewer than', 'under', 'below'):
+        satisfied = words < limit
+    elif relation in ('within', 'no more than', 'not more than', 'at most', 'up to'):
+        satisfied = words <= limit
+    elif relation in ('more than', 'over'):
+        satisfied = words > limit
+    elif relation == 'at least':
+        satisfied = words >= limit
+    elif relation == 'exactly':
+        satisfied = words == limit
+    else:
+        satisfied = abs(words - limit) <= APPROXIMATE_TOLERANCE * limit
+    return satisfied, f"The story is {words} words long ({relation} {limit} words required)."
+
+
+def check_start(story, sentence):
+    satisfied = normalize(story).startswith(normalize(sentence))
+    return satisfied, f"The story {'starts' if satisfied else 'does not start'} with \"{sentence}\"."
+
+
+def check_end(story, sentence):
+    satisfied = normalize(story).endswith(normalize(sentence))
+    return satisfied, f"The story {'ends' if satisfied else 'does not end'} with \"{sentence}\"."
+
+
+# Function to decide a constraint by rule; returns (satisfied, evidence) or None when the judge is needed.
+# A constraint is only taken over when the mechanical part is all it asks for.
+def check_constraint(story, constraint):
+    match = START_RULE.search(constraint)
+    if match:
+        return check_start(story, match.group(1))
+    match = END_RULE.search(constraint)
+    if match:
+        return check_end(story, match.group(1))
+    match = WORD_COUNT_RULE.search(constraint)
+    if match and re.match(r"\s*write (?:a|the) story\b", constraint, re.IGNORECASE) and not re.search(r"\b(?:and|include|must|should)\b", constraint[match.end():], re.IGNORECASE):
+        return check_word_count(story, match.group(1), int(match.group(2).replace(',', '')))
+    return None
+
+
+def split_constraints(constraints):
+    return [(int(number), text) for number, text in CONSTRAINT_LINE.findall(str(constraints))]
+
+
+class PreCheck:
+    """Rule verdicts for one story and the constraints left for the judge."""
+
+    def __init__(self, story, constraints):
+        self.rule_verdicts = {}
+        self.judge_constraints = []
+        numbered = split_constraints(constraints)
+        for number, text in numbered:
+            verdict = check_constraint(str(story), text) if isinstance(story, str) else None
+            if verdict is None:
+                self.judge_constraints.append((number, text))
+            else:
+                self.rule_verdicts[number] = verdict
+        # Constraints that are not numbered lines are left to the judge as they are
+        self.unparsed = not numbered
+
+    @property
+    def offloaded(self):
+        return len(self.rule_verdicts)
+
+    @property
+    def needs_judge(self):
+        return self.unparsed or bool(self.judge_constraints)
+
+    def judge_text(self):
+        return '\n'.join(f"{position}. {text}" for position, (_, text) in enumerate(self.judge_constraints, start=1))
+
+    # Function to rewrite the judge answer in the original numbering with the rule verdicts merged in.
+    # A failed judge call (no response) stays None so the story is not scored on the rule verdicts alone.
+    def merge(self, judge_response):
+        if self.unparsed:
+            return judge_response
+        if self.judge_constraints and not isinstance(judge_response, str):
+            return None
+
+        lines = {}
+        for position, verdict, evidence in response_verdicts(judge_response) if self.judge_constraints else []:
+            if 1 <= position <= len(self.judge_constraints):
+                lines[self.judge_constraints[position - 1][0]] = (verdict == 'Yes', evidence)
+        for number, (satisfied, evidence) in self.rule_verdicts.items():
+            lines[number] = (satisfied, f"{RULE_EVIDENCE_PREFIX} {evidence}")
+
+        text = [f"{number}. {'Yes' if satisfied else 'No'} - {evidence}" for number, (satisfied, evidence) in sorted(lines.items())]
+        text.append(f"Number of constraints satisfied: {sum(satisfied for satisfied, _ in lines.values())}")
+        return '\n'.join(text)
+
+
+def precheck_report(prechecks, saved_tokens):
+    total = sum(check.offloaded + len(check.judge_constraints) for check in prechecks)
+    offloaded = sum(check.offloaded for check in prechecks)
+    skipped = sum(1 for check in prechecks if not check.needs_judge)
+    return (f"Rule checks decided {offloaded}/{total} constraints ({offloaded / total if total else 0.0:.1%}); "
+            f"{skipped} stories needed no judge call; ~{saved_tokens} judge prompt tokens offloaded")
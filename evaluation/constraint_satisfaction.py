@@ -1,25 +1,35 @@
-import openai
-from openai import OpenAI
-import pandas as pd
-from datetime import datetime
 import os
 import argparse
-import openpyxl
 from dotenv import load_dotenv
+from batch_io import export_batch as write_batch_files, join_results, make_custom_id, read_batch_results, summarize
+from judge_cache import add_cache_arguments, open_cache
+from constraint_rules import PreCheck, precheck_report
+from judge_client import JudgeRunner, estimate_tokens, make_async_client
+from verdicts import add_satisfaction, verdicts_path_for
+from resources import lazy_module
+from telemetry import add_rows, add_telemetry_arguments, configure, stage
+
+pd = lazy_module('pandas')
 
 # The below code takes a CSV file that contains 4 columns: FinalGeneratedStory, SelectedConstraints, Number_of_Constraints, FinalPrompt.
 # It calls the GPT4 API and evaluates the story (from the column "FinalGeneratedStory") for the constraints (from the column "SelectedConstraints").
 
-def main(input_path, output_path):
-    api_key = os.environ['OPENAI_API_KEY']
-    client = OpenAI(api_key=api_key)
+def main(input_path, output_path, model="gpt-4-turbo", concurrency=8, requests_per_minute=None, tokens_per_minute=None, base_url=None, cache=None,
+         export_batch=None, import_batch=None, verdicts_path=None, rule_checks=True):
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        # Without a key every API request fails; only a local endpoint and the offline batch modes can do without
+        if not (base_url or export_batch or import_batch):
+            raise ValueError("OPENAI_API_KEY is not set; it is required unless --base_url, --export_batch or --import_batch is used")
+        api_key = 'EMPTY'
+    client = make_async_client(api_key=api_key, base_url=base_url)
     df = pd.read_csv(input_path)
 
-    def generate_prompt(row):
+    def generate_prompt(row, constraints=None, no_of_constraints=None):
         # Extracting constraints
         story = row["FinalGeneratedStory"]
-        constraints = row["SelectedConstraints"]
-        no_of_constraints = row['Number_of_Constraints']
+        constraints = row["SelectedConstraints"] if constraints is None else constraints
+        no_of_constraints = row['Number_of_Constraints'] if no_of_constraints is None else no_of_constraints
         # Combining constraints with story
         final_prompt = f"""Input - \nStory: - {story}\n\nNumber of Constraints in the story: - {no_of_constraints}\nConstraints: - \n{constraints} \n\n Output - Give me Number of Constraints Satisfied"""
 
@@ -27,6 +37,7 @@ def main(input_path, output_path):
     
     
     df = pd.read_csv(input_path)
+    add_rows(len(df))
     # Iterate over rows
     for index, row in df.iterrows():
         story = row['FinalGeneratedStory']
@@ -191,26 +202,62 @@ def main(input_path, output_path):
 
     """
 
-    def chat(user_prompt, model="gpt-4-turbo", systemprompt=system_prompt + "\n" + prompt_examples, log=False):
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": systemprompt},
-                {"role": "user", "content": user_prompt},
-            ]
-        )
-        return response
-    
-    responses = []
-    print("\n")
+    # Judge every row concurrently; responses come back in row order
+    runner = JudgeRunner(client, model, system_prompt + "\n" + prompt_examples, concurrency=concurrency,
+                         requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute, cache=cache)
+
+    # Mechanical constraints (word counts, first/last sentence) are decided by rule and left out of the
+    # judge prompt; a story whose constraints are all mechanical needs no judge call at all
+    judge_prompts = {}
+    prechecks = {}
+    saved_tokens = 0
     for index, row in df.iterrows():
-        response = chat(user_prompt=row["FinalPrompt"], log=False)
-        response_content = response.choices[0].message.content
+        check = PreCheck(row['FinalGeneratedStory'], row['SelectedConstraints']) if rule_checks else None
+        prechecks[index] = check
+        if check is None or check.unparsed or not check.offloaded:
+            judge_prompts[index] = row['FinalPrompt']
+        elif check.needs_judge:
+            judge_prompts[index] = generate_prompt(row, check.judge_text(), len(check.judge_constraints))
+            saved_tokens += estimate_tokens(row['FinalPrompt']) - estimate_tokens(judge_prompts[index])
+        else:
+            saved_tokens += estimate_tokens(runner.system_prompt, row['FinalPrompt'])
+    df['JudgePrompt'] = [judge_prompts.get(index) for index in df.index]
+    if rule_checks:
+        print(precheck_report([check for check in prechecks.values()], saved_tokens))
+
+    def merge_responses(responses):
+        df['JudgeResponseContent'] = [responses.get(index) for index in df.index]
+        df['ResponseContent'] = [prechecks[index].merge(responses.get(index)) if prechecks[index] else responses.get(index) for index in df.index]
+
+    # Offline batch mode: one request per judged row, identified by the row index and a hash of the request
+    judged = list(judge_prompts)
+    requests = [runner.request_kwargs(judge_prompts[index]) for index in judged]
+    custom_ids = [make_custom_id('cs', [index], request) for index, request in zip(judged, requests)]
+    if export_batch:
+        write_batch_files(list(zip(custom_ids, requests)), export_batch)
+        return
+    if import_batch:
+        joined = join_results(list(zip(judged, custom_ids)), read_batch_results(import_batch))
+        merge_responses({index: content for index, (content, _) in joined.items()})
+        df['batch_error'] = [joined[index][1] if index in joined else None for index in df.index]
+        print(summarize(joined))
+        if cache is not None:
+            for request, index in zip(requests, judged):
+                if joined[index][0] is not None:
+                    cache.put(request, joined[index][0])
+        add_satisfaction(df, verdicts_path or verdicts_path_for(output_path))
+        df.to_csv(output_path, index=False)
+        return
+
+    print("\n")
+    with stage(f"judge:{model}", rows=len(judged)):
+        merge_responses(dict(zip(judged, runner.run([judge_prompts[index] for index in judged]))))
+    print(f"Constraint Satisfaction computed for {len(df)} rows ({len(judged)} judge calls, {runner.retries} retried requests)")
+    if cache is not None:
+        print(cache.report())
 
-        if index%10==0:
-            print(f"Constraint Satisfaction computed till index {index+1}/{len(df)}")
-        # Append response content to the dataframe
-        df.at[index, 'ResponseContent'] = response_content
+    # Per-constraint verdicts go to a Parquet table; satisfied / Percentage_GPT4 are computed from it
+    add_satisfaction(df, verdicts_path or verdicts_path_for(output_path))
 
     # Save the final updated dataframe to the original CSV file
     df.to_csv(output_path, index=False)
@@ -222,12 +269,29 @@ if __name__ == "__main__":
     # Adding arguments for file paths
     parser.add_argument('--input_path', required=True, help="Path to the input CSV file")
     parser.add_argument('--output_path', required=True, help="Path to the output CSV file. New file will be generated with given name.")
+    parser.add_argument('--model', default="gpt-4-turbo", help="Judge model (default: gpt-4-turbo)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Maximum number of judge requests in flight")
+    parser.add_argument('--rpm', type=int, default=None, help="Requests per minute limit")
+    parser.add_argument('--tpm', type=int, default=None, help="Tokens per minute limit")
+    parser.add_argument('--base_url', default=None, help="OpenAI-compatible endpoint, e.g. a local stub_openai_server.py")
+    parser.add_argument('--export_batch', default=None, help="Write the judge requests to batch files with this path prefix instead of calling the API")
+    parser.add_argument('--import_batch', nargs='+', default=None, help="Batch result JSONL files to join back instead of calling the API")
+    parser.add_argument('--verdicts_path', default=None, help="Parquet file for the per-constraint verdicts (default: <output_path>.verdicts.parquet)")
+    parser.add_argument('--no_rule_checks', action='store_true', help="Send every constraint to the judge, including word counts and first/last sentences")
+    add_cache_arguments(parser)
+    add_telemetry_arguments(parser)
 
     # Parsing the arguments
     args = parser.parse_args()
+    configure(args.telemetry_dir)
 
     # Load environment variables (optional, if you're using dotenv to store your API key)
     load_dotenv()
 
     # Call the main function with arguments
-    main(args.input_path, args.output_path)
+    with stage('constraint_satisfaction'):
+        main(args.input_path, args.output_path, model=args.model, concurrency=args.concurrency,
+             requests_per_minute=args.rpm, tokens_per_minute=args.tpm, base_url=args.base_url,
+             cache=open_cache(args.judge_cache, args.judge_cache_max_mb, args.judge_cache_read_only),
+             export_batch=args.export_batch, import_batch=args.import_batch, verdicts_path=args.verdicts_path,
+             rule_checks=not args.no_rule_checks)
@@ -0,0 +1,320 @@
+import argparse
+import bisect
+import math
+import os
+from collections import defaultdict
+from itertools import combinations
+
+from lexical_features import preprocess_text, tokenize
+from resources import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+# Corpus-level diversity per (Model, Number_of_Constraints).
+# diversity_calculation.py compares the three stories of one prompt; this module asks whether a
+# model writes the same story across instructions and constraint counts. For every group it reports:
+#   - distinct-n: unique n-grams / total n-grams over the whole group (n = 1..4)
+#   - self-BLEU: BLEU-4 of every story against all other stories of the group, averaged
+#   - MinHash similarity: the mean estimated Jaccard similarity of word 3-gram shingles over
+#     sampled story pairs, and near-duplicate clusters found with LSH banding
+# n-grams are hashed to uint64, so everything is near-linear in the corpus size. Self-BLEU uses
+# exact multi-reference clipping: every n-gram keeps its two largest per-story counts, so the best
+# reference count excluding the story itself is known without comparing story pairs.
+# --exact recomputes everything pairwise (NLTK sentence_bleu, exact Jaccard) for validating on small samples.
+
+NGRAM_ORDERS = (1, 2, 3, 4)
+SHINGLE_ORDER = 3
+NUM_PERM = 128
+BANDS = 32
+MERSENNE_PRIME = (1 << 61) - 1
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+BLEU_EPSILON = 0.1
+GROUP_COLUMNS = ['Model', 'Number_of_Constraints']
+
+
+def _mix(values):
+    # splitmix64 finalizer, so that MinHash sees well-spread hashes
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+class Vocabulary:
+    def __init__(self):
+        self.ids = {}
+
+    def encode(self, tokens):
+        ids = self.ids
+        return np.array([ids.setdefault(token, len(ids) + 1) for token in tokens], dtype=np.uint64)
+
+
+# Function to hash the n-grams of a token id array; returns uint64 hashes in text order
+def ngram_hashes(ids, n):
+    total = len(ids) - n + 1
+    if total <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    multiplier = np.uint64(HASH_MULTIPLIER)
+    with np.errstate(over='ignore'):
+        hashes = np.full(total, np.uint64(n), dtype=np.uint64)
+        for offset in range(n):
+            hashes = hashes * multiplier + ids[offset:offset + total]
+        return _mix(hashes)
+
+
+class StorySketch:
+    """Tokens, n-gram counts and MinHash signature of one story."""
+
+    def __init__(self, story, vocabulary, permutations):
+        self.tokens = tokenize(preprocess_text(story))
+        ids = vocabulary.encode(self.tokens)
+        self.length = len(self.tokens)
+        self.ngrams = {}
+        for n in NGRAM_ORDERS:
+            self.ngrams[n] = np.unique(ngram_hashes(ids, n), return_counts=True)
+        shingles = self.ngrams[SHINGLE_ORDER][0] if self.length >= SHINGLE_ORDER else ngram_hashes(ids, 1)
+        self.signature = minhash(shingles, permutations)
+
+
+# Universal hashing (a*x + b) mod p with p = 2**61 - 1 and a, b drawn below p
+def make_permutations(num_perm=NUM_PERM, seed=1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.int64).astype(np.uint64)
+    b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.int64).astype(np.uint64)
+    return a, b
+
+
+# Function to compute (a * x) mod 2**61 - 1 for a, x < 2**61 without leaving uint64: both factors are
+# split into 31-bit halves, and 2**61 = 1 (mod p) folds the high parts of the product back in
+def mulmod_mersenne61(a, x):
+    low_mask = np.uint64((1 << 31) - 1)
+    a_high, a_low = a >> np.uint64(31), a & low_mask
+    x_high, x_low = x >> np.uint64(31), x & low_mask
+    # a*x = a_high*x_high*2**62 + middle*2**31 + a_low*x_low, and 2**62 = 2 (mod p)
+    middle = a_high * x_low + a_low * x_high
+    # middle*2**31 = (middle >> 30)*2**61 + (middle & (2**30 - 1))*2**31 = (middle >> 30) + ... (mod p)
+    total = (a_high * x_high << np.uint64(1)) + (middle >> np.uint64(30)) + ((middle & np.uint64((1 << 30) - 1)) << np.uint64(31)) + a_low * x_low
+    prime = np.uint64(MERSENNE_PRIME)
+    return ((total & prime) + (total >> np.uint64(61))) % prime
+
+
+def minhash(shingles, permutations):
+    a, b = permutations
+    if len(shingles) == 0:
+        return np.full(len(a), MERSENNE_PRIME, dtype=np.uint64)
+    prime = np.uint64(MERSENNE_PRIME)
+    values = (shingles % prime)[None, :]
+    return ((mulmod_mersenne61(a[:, None], values) + b[:, None]) % prime).min(axis=1)
+
+
+def signature_similarity(first, second):
+    return float(np.mean(first == second))
+
+
+# Function to count distinct n-grams of a group; returns {n: (unique, total)}
+def distinct_counts(sketches):
+    counts = {}
+    for n in NGRAM_ORDERS:
+        hashes = [sketch.ngrams[n][0] for sketch in sketches]
+        unique = len(np.unique(np.concatenate(hashes))) if hashes else 0
+        total = sum(int(sketch.ngrams[n][1].sum()) for sketch in sketches)
+        counts[n] = (unique, total)
+    return counts
+
+
+# Function to compute per-story clipped n-gram matches against all other stories of the group
+def clipped_matches(sketches, n):
+    hashes = np.concatenate([sketch.ngrams[n][0] for sketch in sketches])
+    counts = np.concatenate([sketch.ngrams[n][1] for sketch in sketches]).astype(np.int64)
+    docs = np.repeat(np.arange(len(sketches)), [len(sketch.ngrams[n][0]) for sketch in sketches])
+    matches = np.zeros(len(sketches), dtype=np.int64)
+    if len(hashes) == 0:
+        return matches
+
+    # Sort by n-gram, largest count first; the first two entries of each n-gram are its top-2 stories
+    order = np.lexsort((-counts, hashes))
+    hashes, counts, docs = hashes[order], counts[order], docs[order]
+    starts = np.flatnonzero(np.r_[True, hashes[1:] != hashes[:-1]])
+    group = np.cumsum(np.r_[True, hashes[1:] != hashes[:-1]]) - 1
+    sizes = np.diff(np.r_[starts, len(hashes)])
+    top1 = counts[starts]
+    top2 = np.where(sizes > 1, counts[np.minimum(starts + 1, len(hashes) - 1)], 0)
+
+    is_top = np.arange(len(hashes)) == starts[group]
+    best_other = np.where(is_top, top2[group], top1[group])
+    np.add.at(matches, docs, np.minimum(counts, best_other))
+    return matches
+
+
+def closest_reference_lengths(lengths):
+    ordered = sorted(lengths)
+    closest = []
+    for length in lengths:
+        # Drop one copy of the story's own length, then take the nearest (shorter on ties) like NLTK
+        others = ordered[:]
+        del others[bisect.bisect_left(others, length)]
+        if not others:
+            closest.append(0)
+            continue
+        position = bisect.bisect_left(others, length)
+        candidates = others[max(position - 1, 0):position + 1]
+        closest.append(min(candidates, key=lambda ref_length: (abs(ref_length - length), ref_length)))
+    return closest
+
+
+def bleu_from_counts(matches, totals, length, reference_length):
+    # BLEU-4 with uniform weights and NLTK's smoothing method1, as used for self-BLEU
+    if length == 0 or matches[0] == 0:
+        return 0.0
+    log_precision = 0.0
+    for match, total in zip(matches, totals):
+        total = max(1, total)
+        log_precision += math.log((match if match else BLEU_EPSILON) / total) / len(NGRAM_ORDERS)
+    penalty = 1.0 if length > reference_length else math.exp(1 - reference_length / length)
+    return penalty * math.exp(log_precision)
+
+
+def self_bleu(sketches):
+    if len(sketches) < 2:
+        return float('nan')
+    matches = [clipped_matches(sketches, n) for n in NGRAM_ORDERS]
+    references = closest_reference_lengths([sketch.length for sketch in sketches])
+    scores = []
+    for position, sketch in enumerate(sketches):
+        totals = [max(sketch.length - n + 1, 0) for n in NGRAM_ORDERS]
+        scores.append(bleu_from_counts([match[position] for match in matches], totals, sketch.length, references[position]))
+    return float(np.mean(scores))
+
+
+class DisjointSet:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, first, second):
+        self.parent[self.find(first)] = self.find(second)
+
+
+# Function to find near-duplicate pairs with LSH banding; candidates are confirmed on the full signature
+def near_duplicate_pairs(sketches, threshold, bands=BANDS):
+    rows = len(sketches[0].signature) // bands if sketches else 0
+    candidates = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for position, sketch in enumerate(sketches):
+            buckets[sketch.signature[band * rows:(band + 1) * rows].tobytes()].append(position)
+        for members in buckets.values():
+            candidates.update(combinations(members, 2))
+    return [(first, second) for first, second in candidates
+            if signature_similarity(sketches[first].signature, sketches[second].signature) >= threshold]
+
+
+def sample_pairs(count, max_pairs, seed=0):
+    total = count * (count - 1) // 2
+    if total <= max_pairs:
+        return list(combinations(range(count), 2))
+    rng = np.random.RandomState(seed)
+    first = rng.randint(0, count, size=max_pairs)
+    second = (first + rng.randint(1, count, size=max_pairs)) % count
+    return list(zip(first.tolist(), second.tolist()))
+
+
+def cluster_stats(count, pairs):
+    clusters = DisjointSet(count)
+    for first, second in pairs:
+        clusters.union(first, second)
+    sizes = pd.Series([clusters.find(position) for position in range(count)]).value_counts()
+    duplicated = sizes[sizes > 1]
+    return {
+        'near_duplicate_pairs': len(pairs),
+        'near_duplicate_clusters': len(duplicated),
+        'largest_cluster': int(sizes.max()) if count else 0,
+        'duplicate_fraction': float(duplicated.sum() / count) if count else 0.0,
+    }
+
+
+def group_metrics(sketches, threshold=0.5, max_pairs=2000):
+    metrics = {'stories': len(sketches)}
+    for n, (unique, total) in distinct_counts(sketches).items():
+        metrics[f'distinct_{n}'] = unique / total if total else float('nan')
+    metrics['self_bleu'] = self_bleu(sketches)
+    pairs = sample_pairs(len(sketches), max_pairs)
+    metrics['minhash_similarity'] = float(np.mean([signature_similarity(sketches[first].signature, sketches[second].signature)
+                                                   for first, second in pairs])) if pairs else float('nan')
+    metrics.update(cluster_stats(len(sketches), near_duplicate_pairs(sketches, threshold)))
+    return metrics
+
+
+# Function to compute the same metrics pairwise and without hashing (quadratic; for validation)
+def exact_group_metrics(stories, threshold=0.5):
+    from nltk.translate.bleu_score import SmoothingFunction, sentence_bleu
+    from nltk.util import ngrams
+
+    tokens = [tokenize(preprocess_text(story)) for story in stories]
+    metrics = {'stories': len(tokens)}
+    for n in NGRAM_ORDERS:
+        grams = [gram for story_tokens in tokens for gram in ngrams(story_tokens, n)]
+        metrics[f'distinct_{n}'] = len(set(grams)) / len(grams) if grams else float('nan')
+
+    smoothing = SmoothingFunction(epsilon=BLEU_EPSILON).method1
+    scores = [sentence_bleu(tokens[:position] + tokens[position + 1:], hypothesis, smoothing_function=smoothing) if hypothesis else 0.0
+              for position, hypothesis in enumerate(tokens)] if len(tokens) > 1 else []
+    metrics['self_bleu'] = float(np.mean(scores)) if scores else float('nan')
+
+    shingles = [set(ngrams(story_tokens, SHINGLE_ORDER)) if len(story_tokens) >= SHINGLE_ORDER else set(story_tokens) for story_tokens in tokens]
+    similarities = {}
+    for first, second in combinations(range(len(tokens)), 2):
+        union = shingles[first] | shingles[second]
+        similarities[(first, second)] = len(shingles[first] & shingles[second]) / len(union) if union else 1.0
+    metrics['minhash_similarity'] = float(np.mean(list(similarities.values()))) if similarities else float('nan')
+    metrics.update(cluster_stats(len(tokens), [pair for pair, similarity in similarities.items() if similarity >= threshold]))
+    return metrics
+
+
+def load_stories(paths, story_column='FinalGeneratedStory'):
+    frames = []
+    for path in paths:
+        df = pd.read_csv(path)
+        if 'Model' not in df.columns:
+            df['Model'] = os.path.splitext(os.path.basename(path))[0]
+        if 'Number_of_Constraints' not in df.columns:
+            df['Number_of_Constraints'] = -1
+        frames.append(df[GROUP_COLUMNS + [story_column]].rename(columns={story_column: 'Story'}))
+    return pd.concat(frames, ignore_index=True)
+
+
+# Function to compute the metrics of every (Model, Number_of_Constraints) group as a tidy frame
+def corpus_diversity(stories, exact=False, threshold=0.5, max_pairs=2000, num_perm=NUM_PERM):
+    permutations = make_permutations(num_perm)
+    vocabulary = Vocabulary()
+    rows = []
+    for (model, constraints), group in stories.groupby(GROUP_COLUMNS, sort=True):
+        if exact:
+            metrics = exact_group_metrics(group['Story'].tolist(), threshold)
+        else:
+            metrics = group_metrics([StorySketch(story, vocabulary, permutations) for story in group['Story']], threshold, max_pairs)
+        rows.append({'Model': model, 'Number_of_Constraints': constraints, **metrics})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute corpus-level diversity (distinct-n, self-BLEU, MinHash near-duplicates) per model and constraint count.")
+    parser.add_argument('--input_path', nargs='+', required=True, help="Story CSV files (one or more models)")
+    parser.add_argument('--output_path', required=True, help="Path of the CSV to write")
+    parser.add_argument('--story_column', default='FinalGeneratedStory', help="Column holding the stories")
+    parser.add_argument('--threshold', type=float, default=0.5, help="Jaccard similarity above which two stories are near-duplicates")
+    parser.add_argument('--max_pairs', type=int, default=2000, help="Story pairs sampled per group for the mean MinHash similarity")
+    parser.add_argument('--exact', action='store_true', help="Compare all story pairs exactly (quadratic; for validation on small samples)")
+    args = parser.parse_args()
+
+    results = corpus_diversity(load_stories(args.input_path, args.story_column), exact=args.exact, threshold=args.threshold, max_pairs=args.max_pairs)
+    results.to_csv(args.output_path, index=False)
+    print(results.to_string(index=False))
+    print(f"\nCorpus diversity for {len(results)} groups saved to {args.output_path}\n")
@@ -1,55 +1,29 @@
-# Setup NLTK
-import string
-import re
-import nltk
-from nltk import word_tokenize
-from nltk.util import ngrams
-import pandas as pd
 import argparse
+from lexical_features import LEXICAL_FEATURES, NGRAM_FEATURES, story_column_features
+from resources import lazy_module
+from telemetry import add_rows
 
-nltk.download('punkt')
+pd = lazy_module('pandas')
+
+# NLTK data (punkt) is only needed for stories with non-ASCII text; lexical_features resolves it
+# through resources.py from the local cache on first use instead of downloading it at import.
 
 # This code takes a CSV file as an input (path to CSV). The CSV file has three columns - Story1, Story2, Story3 representing three stories generated for each input prompt in CS4 benchmark.
 # The code then computes the unique and total number of 2, 3, and 4 grams in each of the stories, and then computes the overall diversity of the stories for each prompt.
 # The code finally stores a CSV (file path to be given) that has columns containing the unique and total number of n-grams along with the diversity scores.
 
-def main(input_path, output_path):
-    # Function to convert text to lowercase and remove punctuation
-    def preprocess_text(text):
-        if isinstance(text, str):
-            text = text.lower()
-            text = re.sub(f"[{string.punctuation}]", "", text)
-        else:
-            text = ''  # or handle it in a different way, e.g., str(text) or "NaN"
-        return text
+STORY_LABELS = ['Story1', 'Story2', 'Story3']
 
-    # Function to calculate n-gram statistics
-    def ngram_statistics(text):
-        tokens = word_tokenize(text)
-        results = []
-        for n in range(2, 5):  # For 2-grams, 3-grams, and 4-grams
-            generated_ngrams = list(ngrams(tokens, n))
-            unique_ngrams = len(set(generated_ngrams))
-            total_ngrams = len(generated_ngrams)
-            results.append(unique_ngrams)
-            results.append(total_ngrams)
-        return results
-    
+def main(input_path, output_path, workers=None):
     # Data manipulation
     df = pd.read_csv(input_path)
+    add_rows(len(df))
 
-    # Compute n-gram statistics for each story and calculate diversity indices
-    for story_label in ['Story1', 'Story2', 'Story3']:
-        for i in range(len(df)):
-            story = df.loc[i, story_label]
-            text = preprocess_text(story)
-            n_grams = ngram_statistics(text)
-            df.loc[i, f"{story_label}_unique 2-grams"] = n_grams[0]
-            df.loc[i, f"{story_label}_total 2-grams"] = n_grams[1]
-            df.loc[i, f"{story_label}_unique 3-grams"] = n_grams[2]
-            df.loc[i, f"{story_label}_total 3-grams"] = n_grams[3]
-            df.loc[i, f"{story_label}_unique 4-grams"] = n_grams[4]
-            df.loc[i, f"{story_label}_total 4-grams"] = n_grams[5]
+    # Compute n-gram statistics for every story in one pass (see lexical_features.py)
+    features = story_column_features(df, STORY_LABELS, workers=workers)
+    for story_label in STORY_LABELS:
+        for name in NGRAM_FEATURES:
+            df[f"{story_label}_{name}"] = features[f"{story_label}_{name}"]
 
     # Calculate aggregated diversity scores
     for n in ['2', '3', '4']:
@@ -58,6 +32,11 @@ def main(input_path, output_path):
         df[f'Diversity_{n}G'] = df[f'Sum_{n}Grams'] / df[f'Total_{n}Grams']
 
     df["Product_diversity"] = df['Diversity_2G'] * df['Diversity_3G'] * df['Diversity_4G']
+
+    # Word counts and other lexical stats from the same pass
+    for story_label in STORY_LABELS:
+        for name in LEXICAL_FEATURES:
+            df[f"{story_label}_{name}"] = features[f"{story_label}_{name}"]
     df.to_csv(output_path, index=False)
 
     print("\nDiversity calculations are computed. Results are stored in the provided file path!\n")
@@ -69,9 +48,10 @@ if __name__ == "__main__":
     # Adding arguments for file paths
     parser.add_argument('--input_path', required=True, help="Path to the input CSV file")
     parser.add_argument('--output_path', required=True, help="Path to the output CSV file where results will be saved")
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes computing n-gram statistics (default: all CPUs)")
 
     # Parsing the arguments
     args = parser.parse_args()
 
     # Call the main function with arguments
-    main(args.input_path, args.output_path)
+    main(args.input_path, args.output_path, workers=args.workers)
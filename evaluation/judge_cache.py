@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Persistent cache for LLM judge responses, shared by constraint_satisfaction.py and story_quality_eval.py.
+# Responses are keyed by a hash of the full request (model, system prompt, user prompt and sampling
+# parameters), so a rerun on unchanged stories never pays for the same call twice. The database is
+# kept under max_bytes by evicting the least recently used responses. A read-only cache never
+# changes the database and raises JudgeCacheMiss for a request it does not hold, so a rerun against
+# a frozen cache is reproducible and never falls through to the (paid) judge API.
+
+
+class JudgeCacheMiss(LookupError):
+    pass
+
+
+def request_key(request):
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class JudgeCache:
+    def __init__(self, path, max_bytes=None, read_only=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        if read_only:
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self.connection.commit()
+
+    def get(self, request):
+        key = request_key(request)
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                if self.read_only:
+                    raise JudgeCacheMiss(f"Request {key[:12]} is not in the read-only judge cache {self.path}; "
+                                         "rerun without --judge_cache_read_only to call the judge")
+                return None
+            self.hits += 1
+            if not self.read_only:
+                self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.connection.commit()
+            return row[0]
+
+    def put(self, request, response):
+        if self.read_only:
+            return
+        now = time.time()
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                                    (request_key(request), response, len(response.encode('utf-8')), now, now))
+            if self.max_bytes is not None:
+                self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions}
+
+    def report(self):
+        stats = self.stats()
+        return f"Judge cache {self.path}: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), {stats['evictions']} evictions"
+
+    def close(self):
+        self.connection.close()
+
+
+# Function to open the cache from the command line options shared by the judge scripts
+def open_cache(path, max_mb=None, read_only=False):
+    if not path:
+        return None
+    return JudgeCache(path, max_bytes=int(max_mb * 1024 * 1024) if max_mb else None, read_only=read_only)
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--judge_cache', default=None, help="SQLite file caching judge responses (the same file can be shared by both judge scripts)")
+    parser.add_argument('--judge_cache_max_mb', type=float, default=None, help="Evict least recently used responses beyond this size")
+    parser.add_argument('--judge_cache_read_only', action='store_true', help="Only use cached responses: never write to the cache and stop on a request it does not hold instead of calling the judge")
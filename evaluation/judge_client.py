@@ -0,0 +1,146 @@
+import asyncio
+import random
+import time
+
+from resources import lazy_module
+from telemetry import get_telemetry, usage_tokens
+
+openai = lazy_module('openai')
+
+# Concurrent judge calls for the GPT evaluation scripts.
+# Requests are sent with bounded concurrency, paced by token buckets for requests/min and
+# tokens/min, retried with exponential backoff on 429 and 5xx responses, and the answers are
+# returned in the order of the prompts. Every request, retry and cache hit is recorded in the telemetry.
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        # A single request larger than the bucket would wait forever; let it drain the bucket instead
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def estimate_tokens(*texts):
+    # Roughly four characters per token for English text
+    return sum(len(text) for text in texts) // 4 + 1
+
+
+def is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class JudgeRunner:
+    def __init__(self, client, model, system_prompt, concurrency=8, requests_per_minute=None, tokens_per_minute=None,
+                 max_retries=6, base_delay=1.0, max_delay=60.0, max_tokens=None, cache=None):
+        self.client = client
+        self.model = model
+        self.system_prompt = system_prompt
+        self.concurrency = concurrency
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_tokens = max_tokens
+        self.cache = cache
+        self.retries = 0
+        self.completed = 0
+
+    def request_kwargs(self, user_prompt):
+        kwargs = {
+            'model': self.model,
+            'messages': [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+        }
+        if self.max_tokens:
+            kwargs['max_tokens'] = self.max_tokens
+        return kwargs
+
+    async def _call(self, user_prompt):
+        telemetry = get_telemetry()
+        request = self.request_kwargs(user_prompt)
+        if self.cache is not None:
+            cached = self.cache.get(request)
+            if cached is not None:
+                telemetry.api_call(self.model, 0.0, status='cached')
+                return cached
+
+        for attempt in range(self.max_retries + 1):
+            if self.request_bucket:
+                await self.request_bucket.acquire()
+            if self.token_bucket:
+                await self.token_bucket.acquire(estimate_tokens(self.system_prompt, user_prompt) + (self.max_tokens or 0))
+            started = time.perf_counter()
+            try:
+                response = await self.client.chat.completions.create(**request)
+            except Exception as error:
+                telemetry.api_call(self.model, time.perf_counter() - started, status='error', error=type(error).__name__, attempt=attempt)
+                if not is_retryable(error) or attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                delay = retry_after(error)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * 2 ** attempt) * (0.5 + random.random() / 2)
+                telemetry.retry(self.model, delay, type(error).__name__)
+                await asyncio.sleep(delay)
+                continue
+            telemetry.api_call(self.model, time.perf_counter() - started, *usage_tokens(response), attempt=attempt)
+            content = response.choices[0].message.content
+            if self.cache is not None:
+                self.cache.put(request, content)
+            return content
+
+    async def run_async(self, user_prompts, progress_every=10):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Locks belong to the event loop they are first used in; every run gets fresh ones
+        for bucket in (self.request_bucket, self.token_bucket):
+            if bucket:
+                bucket.lock = asyncio.Lock()
+        results = [None] * len(user_prompts)
+
+        async def worker(index, prompt):
+            async with semaphore:
+                results[index] = await self._call(prompt)
+            self.completed += 1
+            if progress_every and self.completed % progress_every == 0:
+                print(f"Judged {self.completed}/{len(user_prompts)}")
+
+        await asyncio.gather(*(worker(index, prompt) for index, prompt in enumerate(user_prompts)))
+        return results
+
+    def run(self, user_prompts, progress_every=10):
+        return asyncio.run(self.run_async(user_prompts, progress_every))
+
+
+def make_async_client(api_key=None, base_url=None):
+    # Retries are handled by JudgeRunner so that they respect the rate limiters. A local endpoint
+    # (base_url) does not check the key; the OpenAI API without one is refused by the client.
+    return openai.AsyncOpenAI(api_key=api_key or ('EMPTY' if base_url else None), base_url=base_url, max_retries=0)
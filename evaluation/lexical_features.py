@@ -0,0 +1,109 @@
+import os
+import re
+import string
+from concurrent.futures import ProcessPoolExecutor
+
+from resources import lazy_module, word_tokenizer
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+# Single-pass lexical features for the diversity scripts.
+# Each story is preprocessed and tokenized once. Its tokens are mapped to ids from a per-story
+# vocabulary, and every 2/3/4-gram is packed into one int64, so unique n-grams are counted with
+# np.unique instead of sets of tuples. Word counts and other lexical stats come from the same tokens.
+#
+# The counts match diversity_calculation's original NLTK path exactly. After preprocessing, an
+# ASCII story holds only letters, digits and whitespace. NLTK's word_tokenize then only splits on
+# whitespace and breaks up a few contractions ("cannot" -> "can not", "gonna" -> "gon na", ...),
+# and the fast tokenizer reproduces that. Stories with other characters (curly quotes, dashes,
+# ellipses) are still tokenized by word_tokenize itself.
+
+NGRAM_ORDERS = (2, 3, 4)
+PUNCTUATION = re.compile(f"[{string.punctuation}]")
+# The contractions NLTK's tokenizer splits that can survive the punctuation removal, with its
+# boundaries ("wanna" is only split before whitespace or at the end of the text)
+CONTRACTIONS = {'cannot': ' can not ', 'gimme': ' gim me ', 'gonna': ' gon na ',
+                'gotta': ' got ta ', 'lemme': ' lem me ', 'wanna': ' wan na '}
+CONTRACTION_PATTERN = re.compile(r"\b(?:cannot|gimme|gonna|gotta|lemme)\b|\bwanna(?=\s|$)")
+
+NGRAM_FEATURES = [f"{kind} {n}-grams" for n in NGRAM_ORDERS for kind in ('unique', 'total')]
+LEXICAL_FEATURES = ['word_count', 'unique_words', 'mean_word_length']
+FEATURE_NAMES = NGRAM_FEATURES + LEXICAL_FEATURES
+
+
+# Function to convert text to lowercase and remove punctuation
+def preprocess_text(text):
+    if isinstance(text, str):
+        text = text.lower()
+        text = PUNCTUATION.sub("", text)
+    else:
+        text = ''
+    return text
+
+
+def tokenize(text):
+    if not text.isascii():
+        return word_tokenizer()(text)
+    return CONTRACTION_PATTERN.sub(lambda match: CONTRACTIONS[match.group()], text).split()
+
+
+# Function to count unique and total n-grams of token ids; returns [unique, total] per order
+def ngram_counts(ids, vocab_size, orders=NGRAM_ORDERS):
+    counts = []
+    for n in orders:
+        total = max(len(ids) - n + 1, 0)
+        if total == 0:
+            counts += [0, 0]
+            continue
+        if vocab_size ** n < 2 ** 63:
+            packed = np.zeros(total, dtype=np.int64)
+            for offset in range(n):
+                packed = packed * vocab_size + ids[offset:offset + total]
+            unique = len(np.unique(packed))
+        else:
+            # Too many distinct words to pack n ids into an int64; compare the id rows instead
+            unique = len(np.unique(np.stack([ids[offset:offset + total] for offset in range(n)], axis=1), axis=0))
+        counts += [unique, total]
+    return counts
+
+
+# Function to compute FEATURE_NAMES for one story
+def story_features(story):
+    tokens = tokenize(preprocess_text(story))
+    if not tokens:
+        return [0] * len(NGRAM_FEATURES) + [0, 0, 0.0]
+    words, ids = np.unique(np.array(tokens), return_inverse=True)
+    ids = ids.astype(np.int64)
+    mean_word_length = float(np.mean([len(token) for token in tokens]))
+    return ngram_counts(ids, len(words)) + [len(tokens), len(words), mean_word_length]
+
+
+def _features_chunk(stories):
+    return [story_features(story) for story in stories]
+
+
+# Function to compute the features of many stories as one frame, fanned out over a process pool
+def lexical_features(stories, workers=None, chunk_size=256):
+    stories = list(stories)
+    workers = workers or os.cpu_count() or 1
+    chunks = [stories[start:start + chunk_size] for start in range(0, len(stories), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        rows = [row for chunk in chunks for row in _features_chunk(chunk)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            rows = [row for chunk_rows in pool.map(_features_chunk, chunks) for row in chunk_rows]
+    return pd.DataFrame(np.array(rows, dtype=np.float64).reshape(len(stories), len(FEATURE_NAMES)), columns=FEATURE_NAMES)
+
+
+# Function to compute the features of several story columns in one pass; columns are named "<label>_<feature>"
+def story_column_features(df, labels, workers=None):
+    stories = [story for label in labels for story in df[label].tolist()]
+    features = lexical_features(stories, workers=workers)
+    frames = []
+    for position, label in enumerate(labels):
+        frame = features.iloc[position * len(df):(position + 1) * len(df)].copy()
+        frame.columns = [f"{label}_{name}" for name in FEATURE_NAMES]
+        frame.index = df.index
+        frames.append(frame)
+    return pd.concat(frames, axis=1)
@@ -0,0 +1,255 @@
+import argparse
+import math
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from resources import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+# Adaptive pairwise ranking of the stories of one instruction.
+# Instead of comparing every story against one anchor story, comparisons are scheduled in rounds
+# and a Bradley-Terry model is refit after each round:
+#   - round 1 pairs the stories at random (a Swiss opening)
+#   - later rounds greedily pick disjoint pairs whose outcome is most uncertain under the current
+#     fit (win probability near 0.5 and large score variance); a pair is only compared again once
+#     every pair has been compared
+#   - the comparisons of a round run concurrently
+#   - once n-1 comparisons are made, the run stops as soon as the ranking has converged: the expected
+#     rank error of a story (the summed probability, from the score uncertainty, that it is ordered
+#     wrongly against each other story) is at most `rank_tolerance` of the number of stories on
+#     average (0.1: a story is expected to be within 10% of the ranking of its place)
+#   - otherwise it stops when the budget is spent: by default the worst case of merge sort,
+#     n*ceil(log2 n) - 2**ceil(log2 n) + 1, which is below a round robin from 4 stories on (8 of 10
+#     calls for the 5 stories of a CS4 instruction, 119 of 435 for 30)
+# Story order (A/B) is randomized per comparison to cancel the judge's position bias. Pairs and
+# orders are drawn on the coordinating thread, so a seed gives the same schedule at any concurrency.
+# The judge is any callable judge(first, second) -> 'A' | 'B' | None (None: no usable verdict).
+
+
+class BradleyTerry:
+    """Bradley-Terry scores with a Gaussian prior (keeps scores finite for undefeated stories)."""
+
+    def __init__(self, size, prior=0.1):
+        self.size = size
+        self.prior = prior
+        self.scores = np.zeros(size)
+        self.covariance = np.eye(size) / prior
+
+    def fit(self, comparisons, iterations=50, tolerance=1e-8):
+        winners = np.array([winner for winner, _ in comparisons], dtype=int)
+        losers = np.array([loser for _, loser in comparisons], dtype=int)
+        scores = self.scores.copy()
+        for _ in range(iterations):
+            p = 1 / (1 + np.exp(scores[losers] - scores[winners]))
+            gradient = -self.prior * scores
+            np.add.at(gradient, winners, 1 - p)
+            np.add.at(gradient, losers, -(1 - p))
+            weight = p * (1 - p)
+            information = self.prior * np.eye(self.size)
+            np.add.at(information, (winners, winners), weight)
+            np.add.at(information, (losers, losers), weight)
+            np.add.at(information, (winners, losers), -weight)
+            np.add.at(information, (losers, winners), -weight)
+            step = np.linalg.solve(information, gradient)
+            scores += step
+            if np.max(np.abs(step)) < tolerance:
+                break
+        self.scores = scores
+        self.covariance = np.linalg.inv(information)
+        return self
+
+    def win_probability(self, first, second):
+        return 1 / (1 + math.exp(self.scores[second] - self.scores[first]))
+
+    def difference_variance(self):
+        variances = np.diag(self.covariance)
+        return np.maximum(variances[:, None] + variances[None, :] - 2 * self.covariance, 1e-12)
+
+    # Function to compute, for every story, the expected number of stories it is ordered wrongly against
+    def expected_rank_errors(self):
+        z = (self.scores[:, None] - self.scores[None, :]) / np.sqrt(self.difference_variance())
+        confidence = 0.5 * (1 + np.vectorize(math.erf)(z / math.sqrt(2)))
+        errors = np.minimum(confidence, 1 - confidence)
+        np.fill_diagonal(errors, 0)
+        return errors.sum(axis=1)
+
+    def ranking(self):
+        return list(np.argsort(-self.scores, kind='stable'))
+
+
+class AdaptiveRanker:
+    def __init__(self, size, judge, concurrency=8, rank_tolerance=0.1, max_comparisons=None, prior=0.1, seed=0):
+        self.size = size
+        self.judge = judge
+        self.concurrency = concurrency
+        self.rank_tolerance = rank_tolerance
+        self.max_comparisons = max_comparisons or default_budget(size)
+        self.model = BradleyTerry(size, prior)
+        self.rng = random.Random(seed)
+        self.comparisons = []
+        self.records = []
+        self.pair_counts = np.zeros((size, size), dtype=int)
+        self.calls = 0
+        self.rounds = 0
+
+    def rank_error(self):
+        return float(self.model.expected_rank_errors().mean()) if self.size > 1 else 0.0
+
+    def converged(self):
+        return self.rank_error() <= self.rank_tolerance * self.size
+
+    def round_robin_calls(self):
+        return self.size * (self.size - 1) // 2
+
+    def next_round(self, budget):
+        if self.rounds == 0:
+            order = list(range(self.size))
+            self.rng.shuffle(order)
+            return list(zip(order[::2], order[1::2]))[:budget]
+
+        first, second = np.triu_indices(self.size, k=1)
+        p = 1 / (1 + np.exp(self.model.scores[second] - self.model.scores[first]))
+        information = p * (1 - p) * np.sqrt(self.model.difference_variance()[first, second])
+        # Least compared pairs first, the most informative among them first
+        order = np.lexsort((-information, self.pair_counts[first, second]))
+        candidates = zip(first[order].tolist(), second[order].tolist())
+
+        used, pairs = set(), []
+        for first, second in candidates:
+            if first in used or second in used:
+                continue
+            pairs.append((first, second))
+            used.update((first, second))
+            if len(pairs) == budget:
+                break
+        return pairs
+
+    def _orient(self, pair):
+        first, second = pair
+        return (second, first) if self.rng.random() < 0.5 else (first, second)
+
+    def _compare(self, pair):
+        story_a, story_b = pair
+        return story_a, story_b, self.judge(story_a, story_b)
+
+    def run(self):
+        if self.size < 2:
+            return self.result()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while self.calls < self.max_comparisons:
+                pairs = [self._orient(pair) for pair in self.next_round(self.max_comparisons - self.calls)]
+                if not pairs:
+                    break
+                for story_a, story_b, verdict in pool.map(self._compare, pairs):
+                    self.calls += 1
+                    self.pair_counts[min(story_a, story_b), max(story_a, story_b)] += 1
+                    self.records.append({'round': self.rounds, 'story_a': story_a, 'story_b': story_b, 'verdict': verdict})
+                    if verdict in ('A', 'B'):
+                        self.comparisons.append((story_a, story_b) if verdict == 'A' else (story_b, story_a))
+                self.rounds += 1
+                if self.comparisons:
+                    self.model.fit(self.comparisons)
+                if self.calls >= self.size - 1 and self.converged():
+                    break
+        return self.result()
+
+    def result(self):
+        wins = np.zeros(self.size, dtype=int)
+        losses = np.zeros(self.size, dtype=int)
+        for winner, loser in self.comparisons:
+            wins[winner] += 1
+            losses[loser] += 1
+        ranks = np.empty(self.size, dtype=int)
+        ranks[self.model.ranking()] = np.arange(1, self.size + 1)
+        return pd.DataFrame({
+            'item': np.arange(self.size),
+            'bt_score': self.model.scores,
+            'bt_se': np.sqrt(np.diag(self.model.covariance)),
+            'rank': ranks,
+            'expected_rank_error': self.model.expected_rank_errors() if self.size > 1 else np.zeros(self.size),
+            'wins': wins,
+            'losses': losses,
+        })
+
+    def report(self):
+        round_robin = self.round_robin_calls()
+        return (f"{self.calls} judge calls in {self.rounds} rounds for {self.size} stories, expected rank error "
+                f"{self.rank_error():.2f} ({'converged' if self.converged() else 'budget exhausted'}; "
+                f"{round_robin - self.calls} of the {round_robin} round robin calls saved)")
+
+
+# Function to give the default comparison budget: the worst case of merge sort, never more than a round robin
+def default_budget(size):
+    if size < 2:
+        return 1
+    depth = math.ceil(math.log2(size))
+    return min(size * (size - 1) // 2, size * depth - 2 ** depth + 1)
+
+
+class SimulatedJudge:
+    """Judge with hidden Bradley-Terry qualities, a position bias towards story A and verdict noise.
+    The k-th verdict on an ordered pair depends only on (seed, pair, k), so it does not matter in
+    which order concurrent comparisons reach the judge."""
+
+    def __init__(self, qualities, position_bias=0.3, failure_rate=0.0, seed=0):
+        self.qualities = np.asarray(qualities, dtype=float)
+        self.position_bias = position_bias
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.seen = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def __call__(self, story_a, story_b):
+        with self.lock:
+            self.calls += 1
+            repeat = self.seen[story_a, story_b] = self.seen.get((story_a, story_b), -1) + 1
+        rng = random.Random(hash((self.seed, int(story_a), int(story_b), repeat)))
+        if rng.random() < self.failure_rate:
+            return None
+        p = 1 / (1 + math.exp(self.qualities[story_b] - self.qualities[story_a] - self.position_bias))
+        return 'A' if rng.random() < p else 'B'
+
+
+def kendall_tau(first, second):
+    first, second = np.asarray(first), np.asarray(second)
+    upper = np.triu_indices(len(first), k=1)
+    agreement = np.sign(first[:, None] - first[None, :]) * np.sign(second[:, None] - second[None, :])
+    return float(agreement[upper].mean()) if len(upper[0]) else float('nan')
+
+
+# Function to rank a simulated instruction and compare with the hidden qualities. The anchor baseline is
+# the existing scheme (every story against the first one); the round robin baseline compares every pair once.
+def simulate(size=30, spread=1.5, rank_tolerance=0.1, max_comparisons=None, position_bias=0.3, failure_rate=0.0, seed=0):
+    qualities = np.random.RandomState(seed).normal(0, spread, size)
+    judge = SimulatedJudge(qualities, position_bias, failure_rate, seed)
+    ranker = AdaptiveRanker(size, judge, rank_tolerance=rank_tolerance, max_comparisons=max_comparisons, seed=seed)
+    result = ranker.run()
+
+    baseline = SimulatedJudge(qualities, position_bias, failure_rate, seed + 1)
+    anchor_wins = np.array([0.0] + [1.0 if baseline(story, 0) == 'A' else 0.0 for story in range(1, size)])
+    round_robin = [(first, second) if baseline(first, second) == 'A' else (second, first)
+                   for first in range(size) for second in range(first + 1, size)]
+    return {'stories': size, 'judge_calls': judge.calls, 'rounds': ranker.rounds, 'converged': ranker.converged(),
+            'kendall_tau': kendall_tau(result['bt_score'], qualities),
+            'anchor_calls': size - 1, 'anchor_tau': kendall_tau(anchor_wins, qualities),
+            'round_robin_calls': len(round_robin), 'round_robin_tau': kendall_tau(BradleyTerry(size).fit(round_robin).scores, qualities)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the adaptive pairwise ranking against a simulated judge.")
+    parser.add_argument('--stories', type=int, nargs='+', default=[10, 30, 100], help="Stories per simulated instruction")
+    parser.add_argument('--rank_tolerance', type=float, default=0.1, help="Stop once the mean expected rank error is at most this fraction of the stories")
+    parser.add_argument('--max_comparisons', type=int, default=None, help="Judge call budget per instruction (default: the worst case of merge sort)")
+    parser.add_argument('--position_bias', type=float, default=0.3, help="Judge preference for story A (logits)")
+    parser.add_argument('--failure_rate', type=float, default=0.0, help="Fraction of verdicts that cannot be parsed")
+    parser.add_argument('--seeds', type=int, default=3, help="Simulations per size")
+    args = parser.parse_args()
+
+    rows = [simulate(size, rank_tolerance=args.rank_tolerance, max_comparisons=args.max_comparisons, position_bias=args.position_bias,
+                     failure_rate=args.failure_rate, seed=seed)
+            for size in args.stories for seed in range(args.seeds)]
+    print(pd.DataFrame(rows).to_string(index=False))
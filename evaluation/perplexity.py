@@ -0,0 +1,214 @@
+import argparse
+import math
+import os
+import time
+
+from resources import lazy_module, pretrained_kwargs
+
+pd = lazy_module('pandas')
+
+# Batched perplexity scoring (replaces the one-story-at-a-time loop of perplexity_calculation.ipynb).
+# Stories are tokenized once and sorted by length. Stories that fit in the context window are
+# scored in right-padded batches under a token budget, and padding is masked out of the loss.
+# Longer stories are scored with a strided sliding window, so every token is predicted with up to
+# max_length tokens of context and counted exactly once.
+# Perplexity = exp(total negative log-likelihood / predicted tokens); the first token of a story is
+# never predicted. The notebook divided the mean loss by the token count before exponentiating;
+# this module uses the standard definition.
+# Per-row results are appended to <output>.partial.csv as batches finish, so an interrupted run
+# resumes where it stopped.
+
+PERPLEXITY_COLUMN = 'Perplexity'
+TOKENS_COLUMN = 'Perplexity_Tokens'
+
+
+def set_torch_threads(threads=None, interop_threads=None):
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        torch.set_num_interop_threads(interop_threads)
+
+
+def load_model(model_name, device=None, dtype=None):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    local = pretrained_kwargs(model_name)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, **local)
+    model = AutoModelForCausalLM.from_pretrained(model_name, **local, **({'torch_dtype': getattr(torch, dtype)} if dtype else {}))
+    model.to(device)
+    model.eval()
+    return model, tokenizer
+
+
+class PerplexityScorer:
+    def __init__(self, model, tokenizer, max_tokens_per_batch=8192, max_length=None, stride=512):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_tokens_per_batch = max_tokens_per_batch
+        context = getattr(model.config, 'max_position_embeddings', None) or 1024
+        self.max_length = min(max_length or context, context)
+        # Windows overlap by at least one token so the first token of a window is context, not lost
+        self.stride = max(1, min(stride, self.max_length - 1))
+        self.pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else (tokenizer.eos_token_id or 0)
+        self.tokens_scored = 0
+        self.seconds = 0.0
+
+    @property
+    def device(self):
+        return next(self.model.parameters()).device
+
+    def encode(self, texts):
+        return [self.tokenizer(text)['input_ids'] if isinstance(text, str) and text.strip() else [] for text in texts]
+
+    # Function to sum token losses of a padded batch; rows[i] is (ids, first_target) and only
+    # positions >= first_target are counted. Returns a list of (nll_sum, predicted_tokens).
+    def _batch_nll(self, rows):
+        import torch
+
+        width = max(len(ids) for ids, _ in rows)
+        input_ids = torch.full((len(rows), width), self.pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), width), dtype=torch.long)
+        labels = torch.full((len(rows), width), -100, dtype=torch.long)
+        for row, (ids, first_target) in enumerate(rows):
+            input_ids[row, :len(ids)] = torch.tensor(ids)
+            attention_mask[row, :len(ids)] = 1
+            labels[row, max(first_target, 1):len(ids)] = torch.tensor(ids[max(first_target, 1):])
+
+        with torch.no_grad():
+            logits = self.model(input_ids=input_ids.to(self.device), attention_mask=attention_mask.to(self.device)).logits
+        # Position t predicts token t + 1
+        targets = labels[:, 1:].to(logits.device)
+        losses = torch.nn.functional.cross_entropy(logits[:, :-1].float().transpose(1, 2), targets, ignore_index=-100, reduction='none')
+        mask = targets != -100
+        return list(zip((losses * mask).sum(dim=1).tolist(), mask.sum(dim=1).tolist()))
+
+    # Function to score one long story with a strided window; returns (nll_sum, predicted_tokens)
+    def _window_nll(self, ids):
+        nll, count = 0.0, 0
+        previous_end = 0
+        for begin in range(0, len(ids), self.stride):
+            end = min(begin + self.max_length, len(ids))
+            # Only the tokens not already predicted by the previous window are counted
+            first_target = previous_end - begin
+            window_nll, window_count = self._batch_nll([(ids[begin:end], first_target)])[0]
+            nll += window_nll
+            count += window_count
+            previous_end = end
+            if end == len(ids):
+                break
+        return nll, count
+
+    def plan_batches(self, lengths, positions):
+        batches, batch = [], []
+        for position in sorted(positions, key=lambda position: lengths[position]):
+            if batch and lengths[position] * (len(batch) + 1) > self.max_tokens_per_batch:
+                batches.append(batch)
+                batch = []
+            batch.append(position)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    # Function to score texts; yields ({position: (perplexity, predicted_tokens)}) after every batch
+    def score(self, texts, skip=()):
+        encoded = self.encode(texts)
+        lengths = [len(ids) for ids in encoded]
+        skip = set(skip)
+        pending = [position for position in range(len(texts)) if position not in skip]
+
+        empty = {position: (float('nan'), 0) for position in pending if lengths[position] < 2}
+        if empty:
+            yield empty
+        short = [position for position in pending if 2 <= lengths[position] <= self.max_length]
+        long = [position for position in pending if lengths[position] > self.max_length]
+
+        for batch in self.plan_batches(lengths, short):
+            started = time.perf_counter()
+            results = self._batch_nll([(encoded[position], 1) for position in batch])
+            yield self._finish(batch, results, started)
+        for position in long:
+            started = time.perf_counter()
+            yield self._finish([position], [self._window_nll(encoded[position])], started)
+
+    def _finish(self, batch, results, started):
+        self.seconds += time.perf_counter() - started
+        scored = {}
+        for position, (nll, count) in zip(batch, results):
+            self.tokens_scored += count
+            scored[position] = (math.exp(nll / count) if count else float('nan'), count)
+        return scored
+
+    def throughput(self):
+        return self.tokens_scored / self.seconds if self.seconds else 0.0
+
+
+def partial_path_for(output_path):
+    return os.path.splitext(output_path)[0] + '.partial.csv'
+
+
+def read_partial(path):
+    if not os.path.exists(path):
+        return {}
+    partial = pd.read_csv(path)
+    return {row: (perplexity, tokens) for row, perplexity, tokens in partial[['row', PERPLEXITY_COLUMN, TOKENS_COLUMN]].itertuples(index=False)}
+
+
+# Function to add the Perplexity column to a story CSV, appending per-row results to a partial file as they finish
+def main(input_path, output_path, model_name, story_column='FinalGeneratedStory', max_tokens_per_batch=8192, max_length=None,
+         stride=512, threads=None, interop_threads=None, device=None, dtype=None, model=None, tokenizer=None):
+    set_torch_threads(threads, interop_threads)
+    if model is None:
+        model, tokenizer = load_model(model_name, device, dtype)
+    scorer = PerplexityScorer(model, tokenizer, max_tokens_per_batch=max_tokens_per_batch, max_length=max_length, stride=stride)
+
+    df = pd.read_csv(input_path)
+    partial_path = partial_path_for(output_path)
+    done = read_partial(partial_path)
+    if done:
+        print(f"Resuming: {len(done)} of {len(df)} rows already scored in {partial_path}")
+
+    directory = os.path.dirname(partial_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    new_file = not os.path.exists(partial_path) or os.path.getsize(partial_path) == 0
+    with open(partial_path, 'a', newline='') as partial_file:
+        if new_file:
+            partial_file.write(f"row,{PERPLEXITY_COLUMN},{TOKENS_COLUMN}\n")
+        for scored in scorer.score(df[story_column].tolist(), skip=done):
+            for position, (perplexity, tokens) in sorted(scored.items()):
+                partial_file.write(f"{position},{perplexity!r},{tokens}\n")
+            partial_file.flush()
+            done.update(scored)
+            print(f"Scored {len(done)}/{len(df)} stories ({scorer.throughput():.0f} tokens/sec)")
+
+    df[PERPLEXITY_COLUMN] = [done[position][0] for position in range(len(df))]
+    df[TOKENS_COLUMN] = [done[position][1] for position in range(len(df))]
+    df.to_csv(output_path, index=False)
+    os.remove(partial_path)
+    print(f"\nPerplexity computed for {len(df)} stories: {scorer.tokens_scored} tokens in {scorer.seconds:.1f}s "
+          f"({scorer.throughput():.0f} tokens/sec). Results saved to {output_path}\n")
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the perplexity of generated stories with a causal language model.")
+    parser.add_argument('--input_path', required=True, help="Path to the input CSV file")
+    parser.add_argument('--output_path', required=True, help="Path to the output CSV file (adds the Perplexity column)")
+    parser.add_argument('--model', required=True, help="Hugging Face model name or local path, ideally the model that generated the stories")
+    parser.add_argument('--story_column', default='FinalGeneratedStory', help="Column holding the stories")
+    parser.add_argument('--max_tokens_per_batch', type=int, default=8192, help="Padded tokens per forward pass")
+    parser.add_argument('--max_length', type=int, default=None, help="Context window used for scoring (default: the model's)")
+    parser.add_argument('--stride', type=int, default=512, help="Sliding window stride for stories longer than max_length")
+    parser.add_argument('--threads', type=int, default=None, help="torch intra-op threads (CPU)")
+    parser.add_argument('--interop_threads', type=int, default=None, help="torch inter-op threads (CPU)")
+    parser.add_argument('--device', default=None, help="Device to run on (default: cuda if available)")
+    parser.add_argument('--dtype', default=None, help="Model dtype, e.g. bfloat16")
+    args = parser.parse_args()
+
+    main(args.input_path, args.output_path, args.model, story_column=args.story_column, max_tokens_per_batch=args.max_tokens_per_batch,
+         max_length=args.max_length, stride=args.stride, threads=args.threads, interop_threads=args.interop_threads,
+         device=args.device, dtype=args.dtype)
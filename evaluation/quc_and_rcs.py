@@ -1,9 +1,43 @@
 import argparse
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
 import json
 import os
+import warnings
+from aggregation import add_source_arguments, aggregates_from_args, load_aggregates, source_rows, sources_from_args, store_directions
+from resources import lazy_module
+from telemetry import add_rows
+
+plt = lazy_module('matplotlib.pyplot')
+sns = lazy_module('seaborn')
+pd = lazy_module('pandas')
+np = lazy_module('numpy')
+
+# QUC (quality under constraints) and RCS (relative change between two constraint counts).
+# The models, directions and constraint counts are laid out as a (model x direction x constraints)
+# array of per-cell totals, so QUC is one array expression and every RCS (and every difference
+# between two models) is a broadcast outer difference of the QUC array.
+# Confidence intervals come from a bootstrap over the stories of each cell: all resamples are drawn
+# as one array of story indices per chunk (chunks are sized to keep at most `max_elements` gathered
+# values in memory) and go through the same array expressions.
+# The results are written as a tidy table, one row per (metric, model, direction, constraints, baseline).
+
+MODEL_NAMES = {
+    "gemma": "Gemma-7B Instruct",
+    "mistral": "Mistral-7B Instruct",
+    "llama": "Llama-2-7B Chat",
+    "olmo_basehf": "OLMo Base",
+    "olmo_sft": "OLMo SFT",
+    "olmo_instruct": "OLMo Instruct"
+}
+TABLE_COLUMNS = ['metric', 'model', 'direction', 'Number_of_Constraints', 'baseline_constraints', 'baseline_model', 'estimate', 'ci_low', 'ci_high']
+MAX_ELEMENTS = 2 ** 22
+
+
+# Function to compute every pairwise difference along an axis at once: the axis is moved to the end
+# and result[..., i, j] = values[..., j] - values[..., i]
+def outer_differences(values, axis=-1):
+    values = np.moveaxis(values, axis, -1)
+    return values[..., None, :] - values[..., :, None]
+
 
 # Function to calculate QUC and RCS
 def calculate_quc_and_rcs(grouped_results):
@@ -14,86 +48,247 @@ def calculate_quc_and_rcs(grouped_results):
         quc = df['normalized_coherence_score'] * df['average_percentage_gpt4']
         quc_results[model] = quc
 
-        rcs = {}
         constraints = df.index.tolist()
-        for i in range(len(constraints)):
-            for j in range(i + 1, len(constraints)):
-                m = constraints[i]
-                n = constraints[j]
-                rcs[f"{n}-{m}"] = quc.loc[n] - quc.loc[m]
-
-        rcs_results[model] = rcs
+        differences = outer_differences(quc.to_numpy(dtype=float))
+        first, second = np.triu_indices(len(constraints), k=1)
+        rcs_results[model] = {f"{constraints[j]}-{constraints[i]}": differences[i, j] for i, j in zip(first.tolist(), second.tolist())}
 
     return quc_results, rcs_results
 
+
+# Function to compute QUC from per-cell totals (constraint counts on the last axis). As in
+# coherence_vs_constraint_graph, coherence is normalized by its largest total over the constraint counts.
+def quc_from_totals(stories, total_percentage, total_coherence):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        maximum = np.max(np.where(np.isnan(total_coherence), -np.inf, total_coherence), axis=-1, keepdims=True)
+        return total_coherence / maximum * (total_percentage / stories)
+
+
+def cell_axes(table, models=None, directions=None):
+    models = list(models or dict.fromkeys(table['model']))
+    directions = list(directions or dict.fromkeys(table['direction']))
+    constraints = sorted(set(table['Number_of_Constraints'].astype(int).tolist()))
+    return models, directions, constraints
+
+
+# Function to find the (model, direction, constraints) cell of every row; rows outside the axes get -1
+def cell_codes(df, axes):
+    keys = [df['model'].astype(str), df['direction'].astype(str), df['Number_of_Constraints'].astype(int)]
+    codes = [pd.Categorical(key, categories=values).codes.astype(np.int64) for key, values in zip(keys, axes)]
+    keep = (codes[0] >= 0) & (codes[1] >= 0) & (codes[2] >= 0)
+    return np.ravel_multi_index([code[keep] for code in codes], [len(values) for values in axes]), keep
+
+
+# Function to lay the aggregate table out as (model x direction x constraints) arrays; missing cells are NaN
+def cell_totals(table, axes):
+    shape = tuple(len(values) for values in axes)
+    cells, keep = cell_codes(table, axes)
+    totals = []
+    for column in ('stories', 'total_percentage_gpt4', 'total_coherence_score'):
+        values = np.full(int(np.prod(shape)), np.nan)
+        values[cells] = table[column].to_numpy(dtype=float)[keep]
+        totals.append(values.reshape(shape))
+    return totals
+
+
+# Function to lay the per-story rows out as (cell x story) arrays, plus the stories per cell. Every cell is
+# padded with NaN to one more slot than the largest cell, so position counts[cell] is always NaN.
+def story_arrays(rows, axes):
+    cell_count = int(np.prod([len(values) for values in axes]))
+    cells, keep = cell_codes(rows, axes)
+    order = np.argsort(cells, kind='stable')
+    cells = cells[order]
+    counts = np.bincount(cells, minlength=cell_count)
+    positions = np.arange(len(cells)) - np.repeat(np.cumsum(counts) - counts, counts)
+    arrays = []
+    for column in ('Percentage_GPT4', 'coherence_score'):
+        values = pd.to_numeric(rows[column], errors='coerce').to_numpy(dtype=float)[keep][order] if column in rows.columns else np.full(len(cells), np.nan)
+        padded = np.full((cell_count, int(counts.max(initial=0)) + 1), np.nan)
+        padded[cells, positions] = values
+        arrays.append(padded)
+    return arrays[0], arrays[1], counts
+
+
+# Function to sum the picked values per cell; NaN (like pandas' sum(min_count=1)) when none is a number
+def _resampled_sum(picked):
+    total = np.nansum(picked, axis=-1)
+    total[np.isnan(picked).all(axis=-1)] = np.nan
+    return total
+
+
+# Function to draw bootstrap QUC values: each resample redraws the stories of every cell with replacement.
+# A chunk of resamples is one (resamples x cells x stories) array of story positions gathered at once.
+# Returns an array (resamples x model x direction x constraints).
+def bootstrap_quc(percentage, coherence, counts, shape, resamples=2000, seed=0, max_elements=MAX_ELEMENTS):
+    rng = np.random.default_rng(seed)
+    cell_count, width = percentage.shape
+    width -= 1
+    chunk = max(1, max_elements // max(1, cell_count * width))
+    stories = np.where(counts > 0, counts, np.nan).reshape(shape)
+    cell_index = np.arange(cell_count)[None, :, None]
+    # Draws past a cell's story count point at its NaN slot and drop out of the sums
+    unused = np.arange(width)[None, :] >= counts[:, None]
+    samples = []
+    for start in range(0, resamples, chunk):
+        size = min(chunk, resamples - start)
+        index = rng.integers(0, np.maximum(counts, 1)[None, :, None], size=(size, cell_count, width))
+        index = np.where(unused, counts[:, None], index)
+        total_percentage = _resampled_sum(percentage[cell_index, index]).reshape((size,) + shape)
+        total_coherence = _resampled_sum(coherence[cell_index, index]).reshape((size,) + shape)
+        samples.append(quc_from_totals(stories, total_percentage, total_coherence))
+    return np.concatenate(samples)
+
+
+def percentile_interval(samples, confidence):
+    with warnings.catch_warnings():
+        # Cells without stories have no interval
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanquantile(samples, [(1 - confidence) / 2, (1 + confidence) / 2], axis=0)
+
+
+# Function to turn estimate/interval arrays into table rows for the index positions where the estimate is a number
+def _metric_rows(metric, estimate, low, high, columns):
+    positions = np.nonzero(~np.isnan(estimate))
+    rows = {'metric': metric, **{name: np.asarray(values)[positions[axis]] for name, (axis, values) in columns.items()},
+            'estimate': estimate[positions], 'ci_low': low[positions], 'ci_high': high[positions]}
+    return pd.DataFrame(rows)
+
+
+# Function to compute the tidy QUC/RCS table from the aggregate table. With the per-story rows the
+# estimates get percentile bootstrap intervals; without them the interval columns are NaN.
+def quc_table(table, rows=None, models=None, directions=None, resamples=2000, confidence=0.95, seed=0, max_elements=MAX_ELEMENTS):
+    axes = cell_axes(table, models, directions)
+    models, directions, constraints = axes
+    shape = tuple(len(values) for values in axes)
+    quc = quc_from_totals(*cell_totals(table, axes))
+
+    estimates = {'QUC': quc, 'RCS': outer_differences(quc), 'QUC_difference': outer_differences(quc, axis=0)}
+    if rows is not None and resamples:
+        samples = bootstrap_quc(*story_arrays(rows, axes), shape, resamples, seed, max_elements)
+        intervals = {'QUC': percentile_interval(samples, confidence),
+                     'RCS': percentile_interval(outer_differences(samples), confidence),
+                     'QUC_difference': percentile_interval(outer_differences(samples, axis=1), confidence)}
+    else:
+        intervals = {name: np.full((2,) + estimate.shape, np.nan) for name, estimate in estimates.items()}
+
+    # Each pair once: RCS from the smaller to the larger constraint count, model differences in input order
+    upper = np.triu(np.ones((len(constraints), len(constraints)), dtype=bool), k=1)
+    later = np.triu(np.ones((len(models), len(models)), dtype=bool), k=1)
+    for name, mask in (('RCS', upper), ('QUC_difference', later)):
+        estimates[name] = np.where(mask, estimates[name], np.nan)
+
+    frames = [
+        _metric_rows('QUC', estimates['QUC'], *intervals['QUC'],
+                     {'model': (0, models), 'direction': (1, directions), 'Number_of_Constraints': (2, constraints)}),
+        # rcs[m, d, i, j] = QUC at constraints[j] - QUC at constraints[i]
+        _metric_rows('RCS', estimates['RCS'], *intervals['RCS'],
+                     {'model': (0, models), 'direction': (1, directions), 'baseline_constraints': (2, constraints), 'Number_of_Constraints': (3, constraints)}),
+        # difference[d, k, a, b] = QUC of models[b] - QUC of models[a]
+        _metric_rows('QUC_difference', estimates['QUC_difference'], *intervals['QUC_difference'],
+                     {'direction': (0, directions), 'Number_of_Constraints': (1, constraints), 'baseline_model': (2, models), 'model': (3, models)}),
+    ]
+    results = pd.concat(frames, ignore_index=True).reindex(columns=TABLE_COLUMNS)
+    return results.astype({'Number_of_Constraints': 'Int64', 'baseline_constraints': 'Int64'})
+
+
 # Function to load grouped DataFrames from a JSON file
 def load_grouped_dfs_from_json(filename):
     with open(filename, 'r') as file:
         json_dict = json.load(file)
-    
+
     grouped_dfs = {key: pd.DataFrame(value) for key, value in json_dict.items()}
     return grouped_dfs
 
-# Function to visualize QUC vs Number of Constraints for two types of constraints
-def plot_quc(type1_quc, type2_quc, model_dict, output_dir):
-    sns.set(style="whitegrid")
-
-    # Plotting Type 1 constraints
+# Function to plot QUC vs Number of Constraints for one type (direction) of constraints; intervals maps a
+# model to the (low, high) Series of its confidence band
+def plot_direction_quc(quc_results, model_dict, output_path, intervals=None):
     plt.figure(figsize=(10, 6))
-    for model, series_data in type1_quc.items():
-        plt.plot(series_data.index, series_data.values, marker='o', label=model_dict[model])
+    for model, series_data in quc_results.items():
+        line, = plt.plot(series_data.index, series_data.values, marker='o', label=model_dict.get(model, model))
+        if intervals and model in intervals:
+            low, high = intervals[model]
+            plt.fill_between(low.index, low.values, high.values, color=line.get_color(), alpha=0.2)
     plt.xlabel('Number of Constraints', fontsize=14)
     plt.ylabel('QUC', fontsize=14)
     plt.legend()
     plt.grid(True)
     plt.gca().invert_xaxis()  # Reverse the x-axis
-    plt.savefig(os.path.join(output_dir, "type1_quc.pdf"), format='pdf')
+    plt.savefig(output_path, format='pdf')
     plt.close()
 
+# Function to visualize QUC vs Number of Constraints for two types of constraints
+def plot_quc(type1_quc, type2_quc, model_dict, output_dir):
+    sns.set(style="whitegrid")
+
+    # Plotting Type 1 constraints
+    plot_direction_quc(type1_quc, model_dict, os.path.join(output_dir, "type1_quc.pdf"))
+
     # Plotting Type 2 constraints
-    plt.figure(figsize=(10, 6))
-    for model, series_data in type2_quc.items():
-        plt.plot(series_data.index, series_data.values, marker='o', label=model_dict[model])
-    plt.xlabel('Number of Constraints', fontsize=14)
-    plt.ylabel('QUC', fontsize=14)
-    plt.legend()
-    plt.grid(True)
-    plt.gca().invert_xaxis()  # Reverse the x-axis
-    plt.savefig(os.path.join(output_dir, "type2_quc.pdf"), format='pdf')
-    plt.close()
+    plot_direction_quc(type2_quc, model_dict, os.path.join(output_dir, "type2_quc.pdf"))
+
+# Function to plot the QUC rows of the tidy table, one plot per direction with the bootstrap bands
+def plot_quc_table(results, output_dir, model_dict=MODEL_NAMES):
+    sns.set(style="whitegrid")
+    quc = results[results['metric'] == 'QUC']
+    for direction, rows in quc.groupby('direction', sort=False):
+        quc_results, intervals = {}, {}
+        for model, model_rows in rows.groupby('model', sort=False):
+            model_rows = model_rows.astype({'Number_of_Constraints': int}).set_index('Number_of_Constraints').sort_index()
+            quc_results[model] = model_rows['estimate']
+            if model_rows['ci_low'].notna().any():
+                intervals[model] = (model_rows['ci_low'], model_rows['ci_high'])
+        plot_direction_quc(quc_results, model_dict, os.path.join(output_dir, f"{direction}_quc.pdf"), intervals)
+        print(f"QUC plot for direction {direction} saved in {output_dir}")
+
+# Function to write the tidy table (quc_rcs.csv) and the QUC plots of the models into output_dir
+def write_quc(table, rows, output_dir, models=None, direction=None, resamples=2000, confidence=0.95, seed=0):
+    os.makedirs(output_dir, exist_ok=True)
+    results = quc_table(table, rows, models, [direction] if direction else None, resamples, confidence, seed)
+    results.to_csv(os.path.join(output_dir, 'quc_rcs.csv'), index=False)
+    plot_quc_table(results, output_dir)
+    print(f"QUC/RCS table with {len(results)} rows saved in {output_dir}")
+
+# Function used by the pipeline: QUC/RCS of the models of a results store from its cached aggregate table
+def write_store_quc(store, aggregates, output_dir, models=None, direction=None, resamples=2000):
+    rows = source_rows(store=store, models=models, directions=[direction] if direction else None)
+    add_rows(len(rows))
+    write_quc(load_aggregates(cache_path=aggregates), rows, output_dir, models, direction, resamples)
 
 # Main function to handle argument parsing
 def main():
     parser = argparse.ArgumentParser(description="Calculate and plot QUC and RCS from input data.")
-    
-    # Input and output paths
-    parser.add_argument("--input_json", required=True, help="Path to input JSON file containing grouped results.")
+
+    # Input and output paths: the grouped results JSON, or the model results (any number of models)
+    parser.add_argument("--input_json", default=None, help="Path to input JSON file containing grouped results.")
+    add_source_arguments(parser)
     parser.add_argument("--output_dir", required=True, help="Directory to save the output plots.")
-    
+    parser.add_argument("--resamples", type=int, default=2000, help="Bootstrap resamples over the stories (0: no confidence intervals)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the bootstrap")
+
     args = parser.parse_args()
 
-    # Load the grouped DataFrames from JSON file
-    grouped_dfs = load_grouped_dfs_from_json(args.input_json)
-    
-    # Calculate QUC and RCS
-    quc_results, rcs_results = calculate_quc_and_rcs(grouped_dfs)
-
-    # Define model names
-    model_dict = {
-        "gemma": "Gemma-7B Instruct",
-        "mistral": "Mistral-7B Instruct",
-        "llama": "Llama-2-7B Chat",
-        "olmo_basehf": "OLMo Base",
-        "olmo_sft": "OLMo SFT",
-        "olmo_instruct": "OLMo Instruct"
-    }
-
-    # Separate data for two types of constraints
-    type1_quc = {key: quc_results[key] for key in ['d2_mgl_quc', 'd2_olmo_quc']}
-    type2_quc = {key: quc_results[key] for key in ['d3_mgl_quc', 'd3_olmo_quc']}
-
-    # Plot and save the figures
-    plot_quc(type1_quc, type2_quc, model_dict, args.output_dir)
+    if args.input_json:
+        # Load the grouped DataFrames from JSON file
+        grouped_dfs = load_grouped_dfs_from_json(args.input_json)
+
+        # Calculate QUC and RCS
+        quc_results, rcs_results = calculate_quc_and_rcs(grouped_dfs)
+
+        # Separate data for two types of constraints
+        type1_quc = {key: quc_results[key] for key in ['d2_mgl_quc', 'd2_olmo_quc']}
+        type2_quc = {key: quc_results[key] for key in ['d3_mgl_quc', 'd3_olmo_quc']}
+
+        # Plot and save the figures
+        plot_quc(type1_quc, type2_quc, MODEL_NAMES, args.output_dir)
+        return
+
+    # Tidy table and one QUC plot per direction (type of constraints) from the aggregate table; the
+    # per-story rows for the bootstrap are read from the same CSV files or store (not from --aggregates alone)
+    sources = sources_from_args(parser, args)
+    table, models = aggregates_from_args(parser, args)
+    rows = source_rows(sources, args.store, models=args.models, directions=store_directions(args)) if (sources or args.store) and args.resamples else None
+    write_quc(table, rows, args.output_dir, models, args.direction, args.resamples, args.confidence, args.seed)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,108 @@
+import functools
+import importlib
+import os
+import socket
+
+# Startup helpers for the evaluation scripts.
+#   - lazy_module: heavy libraries (pandas, matplotlib, nltk, openai, ...) are bound at the top of a
+#     script as usual but only imported on first use, so --help and argument errors return at once.
+#   - NLTK data and tokenizer files are looked up in a local cache directory first
+#     ($CS4_CACHE_DIR, default ~/.cache/cs4). A missing resource is only downloaded when the
+#     network is reachable; offline (CS4_OFFLINE=1, HF_HUB_OFFLINE=1, or no connection) the script
+#     stops right away with the command that installs the resource, instead of hanging at import.
+
+CACHE_DIR = os.path.expanduser(os.environ.get('CS4_CACHE_DIR', os.path.join('~', '.cache', 'cs4')))
+NLTK_DIR = os.path.join(CACHE_DIR, 'nltk_data')
+# NLTK resources by package name; word_tokenize needs punkt_tab on NLTK >= 3.8.2 and punkt before
+NLTK_RESOURCES = {'punkt': 'tokenizers/punkt', 'punkt_tab': 'tokenizers/punkt_tab'}
+CONNECTIVITY_HOST = ('raw.githubusercontent.com', 443)
+
+
+class ResourceUnavailable(RuntimeError):
+    pass
+
+
+class LazyModule:
+    """Module proxy that imports the module on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+
+def lazy_module(name):
+    return LazyModule(name)
+
+
+def _env_flag(name):
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+@functools.lru_cache(maxsize=None)
+def is_offline(timeout=2.0):
+    if _env_flag('CS4_OFFLINE') or _env_flag('HF_HUB_OFFLINE'):
+        return True
+    try:
+        socket.create_connection(CONNECTIVITY_HOST, timeout=timeout).close()
+        return False
+    except OSError:
+        return True
+
+
+def _nltk_found(nltk, resource):
+    try:
+        nltk.data.find(resource)
+        return True
+    except LookupError:
+        return False
+
+
+# Function to make NLTK packages available: from NLTK's own search path or the cache directory,
+# else downloaded into the cache directory. Raises ResourceUnavailable when offline.
+@functools.lru_cache(maxsize=None)
+def ensure_nltk(*packages):
+    import nltk
+
+    if NLTK_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DIR)
+    missing = [package for package in packages if not _nltk_found(nltk, NLTK_RESOURCES.get(package, package))]
+    if not missing:
+        return
+    if is_offline():
+        raise ResourceUnavailable(f"NLTK data {', '.join(missing)} not found and the network is unavailable. "
+                                  f"Install it with: python -m nltk.downloader -d {NLTK_DIR} {' '.join(missing)}")
+    os.makedirs(NLTK_DIR, exist_ok=True)
+    for package in missing:
+        if not nltk.download(package, download_dir=NLTK_DIR, quiet=True, raise_on_error=True):
+            raise ResourceUnavailable(f"Could not download NLTK data {package} into {NLTK_DIR}")
+
+
+# Function to return nltk.word_tokenize once its sentence tokenizer data is available
+def word_tokenizer():
+    import nltk
+
+    from nltk import word_tokenize
+    ensure_nltk('punkt_tab' if hasattr(nltk.tokenize, 'PunktTokenizer') else 'punkt')
+    return word_tokenize
+
+
+# Function to give from_pretrained arguments that resolve tokenizer/model files locally: a local
+# directory or a model already in the Hugging Face cache is loaded without network calls, and a
+# model missing offline fails at once
+def pretrained_kwargs(model_name, filename='config.json'):
+    if os.path.isdir(model_name):
+        return {}
+    from huggingface_hub import try_to_load_from_cache
+
+    cached = isinstance(try_to_load_from_cache(model_name, filename), str)
+    if cached:
+        return {'local_files_only': True}
+    if is_offline():
+        raise ResourceUnavailable(f"{model_name} is not in the Hugging Face cache and the network is unavailable")
+    return {}
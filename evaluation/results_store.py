@@ -0,0 +1,108 @@
+import argparse
+import os
+import uuid
+from urllib.parse import quote
+
+from resources import lazy_module
+from telemetry import add_rows
+
+pd = lazy_module('pandas')
+
+# Columnar store of per-story results shared by the graph scripts.
+# The model CSVs are written once into a Parquet dataset partitioned as
+#   <store>/model=<label>/direction=<direction>/Number_of_Constraints=<n>/<part>.parquet
+# so the graphs' aggregation (aggregation.py) reads only Number_of_Constraints and the metric columns
+# (column projection) of the models it needs (partition pruning), memory-mapped, without parsing the
+# story text.
+# Writing a model/direction again replaces its previous files.
+
+DEFAULT_DIRECTION = 'default'
+
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(pa.schema([('model', pa.string()), ('direction', pa.string()), ('Number_of_Constraints', pa.int64())]), flavor='hive')
+
+
+def open_store(store_dir):
+    import pyarrow.dataset as ds
+    from pyarrow.fs import LocalFileSystem
+
+    return ds.dataset(store_dir, format='parquet', partitioning=_partitioning(), filesystem=LocalFileSystem(use_mmap=True))
+
+
+def store_filter(models=None, directions=None, constraints=None):
+    import pyarrow.dataset as ds
+
+    expression = None
+    for column, values in (('model', models), ('direction', directions), ('Number_of_Constraints', constraints)):
+        if values is None:
+            continue
+        condition = ds.field(column).isin(list(values))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _remove_partition(store_dir, model, direction):
+    if not os.path.isdir(store_dir):
+        return
+    for fragment in open_store(store_dir).get_fragments(filter=store_filter([model], [direction])):
+        os.remove(fragment.path)
+    # Drop the partition directories left empty
+    for root, directories, files in os.walk(store_dir, topdown=False):
+        if root != store_dir and not os.listdir(root):
+            os.rmdir(root)
+
+
+def partition_path(store_dir, model, direction, constraints):
+    return os.path.join(store_dir, f"model={quote(str(model), safe='')}", f"direction={quote(str(direction), safe='')}",
+                        f"Number_of_Constraints={int(constraints)}")
+
+
+# Function to write the results of one model (one row per story) into the store
+def write_results(df, store_dir, model, direction=DEFAULT_DIRECTION):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if 'Number_of_Constraints' not in df.columns:
+        raise ValueError("results need a Number_of_Constraints column to be stored")
+    df = df.drop(columns=[column for column in ('model', 'direction') if column in df.columns])
+    # Object columns read from CSV can mix strings and floats (NaN); store them as strings
+    df = df.astype({column: 'string' for column in df.columns if df[column].dtype == object})
+
+    _remove_partition(store_dir, model, direction)
+    name = f"{uuid.uuid4().hex}.parquet"
+    for constraints, rows in df.groupby('Number_of_Constraints', sort=True):
+        directory = partition_path(store_dir, model, direction, constraints)
+        os.makedirs(directory, exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(rows.drop(columns='Number_of_Constraints'), preserve_index=False), os.path.join(directory, name))
+
+
+# Function to load selected columns of the store; only the requested columns and partitions are read
+def read_results(store_dir, columns=None, models=None, directions=None, constraints=None):
+    table = open_store(store_dir).to_table(columns=columns, filter=store_filter(models, directions, constraints))
+    return table.to_pandas()
+
+
+# Function to load model CSVs into the store; sources is a list of (model, csv_path)
+def ingest(store_dir, sources, direction=DEFAULT_DIRECTION):
+    for model, path in sources:
+        df = pd.read_csv(path)
+        write_results(df, store_dir, model, direction)
+        add_rows(len(df))
+        print(f"Stored {len(df)} rows of {model} ({direction}) from {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write model result CSVs into the partitioned Parquet results store.")
+    parser.add_argument('--store', required=True, help="Directory of the results store")
+    parser.add_argument('--input_path', nargs='+', required=True, help="Result CSV files, one per model")
+    parser.add_argument('--models', nargs='+', required=True, help="Model label of each input file")
+    parser.add_argument('--direction', default=DEFAULT_DIRECTION, help="Direction (dataset variant) the results belong to")
+    args = parser.parse_args()
+
+    if len(args.models) != len(args.input_path):
+        parser.error("--models needs one label per --input_path file")
+    ingest(args.store, list(zip(args.models, args.input_path)), args.direction)
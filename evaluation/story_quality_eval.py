@@ -1,78 +1,175 @@
 import argparse
 import os
-import pandas as pd
-import numpy as np
-from openai import OpenAI
-from datetime import datetime
+import re
+import threading
+import time
+from batch_io import export_batch, join_results, make_custom_id, parse_custom_id, read_batch_results, summarize
+from judge_cache import JudgeCacheMiss, add_cache_arguments, open_cache
+from pairwise_ranking import AdaptiveRanker
+from resources import lazy_module
+from telemetry import add_telemetry_arguments, configure, get_telemetry, stage, usage_tokens
+
+pd = lazy_module('pandas')
+np = lazy_module('numpy')
+openai = lazy_module('openai')
 
 # Initialize OpenAI client
 def initialize_openai(api_key):
-    return OpenAI(api_key=api_key)
+    return openai.OpenAI(api_key=api_key)
+
+# Chat function to send prompt to OpenAI API; returns the response text, served from the cache when possible
+def chat(client, instruction, model="gpt-3.5-turbo", system_prompt="", cache=None):
+    return send_request(client, chat_request(instruction, model, system_prompt), cache)
 
-# Chat function to send prompt to OpenAI API
-def chat(client, instruction, model="gpt-3.5-turbo", system_prompt=""):
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
+def chat_request(instruction, model="gpt-3.5-turbo", system_prompt=""):
+    return {
+        'model': model,
+        'messages': [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": instruction},
-        ]
-    )
+        ],
+    }
 
-    return response
+def send_request(client, request, cache=None):
+    telemetry = get_telemetry()
+    if cache is not None:
+        cached = cache.get(request)
+        if cached is not None:
+            telemetry.api_call(request['model'], 0.0, status='cached')
+            return cached
 
-# Parse the evaluation results
-def parse_evaluation(evaluation):
-    if pd.isna(evaluation):
-        return None
+    started = time.perf_counter()
     try:
-        lines = [line.strip() for line in evaluation.split('\n') if line.strip()]
-        parsed = {
-            'grammar_score_A': float(lines[1].split('-')[1].split('/')[0].strip()),
-            'grammar_score_B': float(lines[2].split('-')[1].split('/')[0].strip()),
-            'coherence_score_A': float(lines[4].split('-')[1].split('/')[0].strip()),
-            'coherence_score_B': float(lines[5].split('-')[1].split('/')[0].strip()),
-            'likability_score_A': float(lines[7].split('-')[1].split('/')[0].strip()),
-            'likability_score_B': float(lines[8].split('-')[1].split('/')[0].strip()),
-            'grammar_pref': lines[0].split(': ')[1],
-            'coherence_pref': lines[3].split(': ')[1],
-            'likability_pref': lines[6].split(': ')[1],
-            'overall_pref': lines[9].split(': ')[1]
-        }
-        a = 0
-        b = 0
-        if parsed['grammar_score_A'] >= parsed['grammar_score_B']:
-            parsed['grammar_pref'] = "A"
-            a += 1
-        else:
-            parsed['grammar_pref'] = "B"
-            b += 1
+        response = client.chat.completions.create(**request)
+    except Exception as error:
+        telemetry.api_call(request['model'], time.perf_counter() - started, status='error', error=type(error).__name__)
+        raise
+    telemetry.api_call(request['model'], time.perf_counter() - started, *usage_tokens(response))
+    content = response.choices[0].message.content
+    if cache is not None:
+        cache.put(request, content)
+    return content
 
-        if parsed['coherence_score_A'] >= parsed['coherence_score_B']:
-            parsed['coherence_pref'] = "A"
-            a += 1
+METRICS = ['grammar', 'coherence', 'likability']
+SCORE_FIELDS = [f"{metric}_score_{story}" for metric in METRICS for story in 'AB']
+REASON_FIELDS = [f"{metric}_reason" for metric in METRICS]
+
+# One pass over a judge answer picks up the fields of both formats: JSON "key": value pairs (also
+# from truncated or wrapped JSON) and the older text format ("Grammar Preference: A" followed by
+# "A - 4.5/5: ..." lines). A JSON value cut off at the end of the answer is not taken.
+FIELD_PATTERN = re.compile(
+    r'"(?P<key>\w+)"\s*:\s*"?(?P<value>[^",}\n]*)(?=["\s,}])'
+    r'|(?P<metric>Grammar|Coherence|Likability)\s*Preference'
+    r'|^\s*(?P<story>[AB])\s*-\s*(?P<score>\d+(?:\.\d+)?)\s*/\s*5'
+    r'|Overall\s+Winner\s*:\s*(?P<winner>[AB])\b', re.IGNORECASE | re.MULTILINE)
+NUMBER = re.compile(r"\s*(\d+(?:\.\d+)?)")
+
+# Function to recover the scores (and the judge's overall winner) from a possibly partial answer;
+# the first valid value of a field wins
+def parse_fields(evaluation):
+    fields = {}
+    if not isinstance(evaluation, str):
+        return fields
+    metric = None
+    for match in FIELD_PATTERN.finditer(evaluation):
+        if match.group('key'):
+            key, value = match.group('key'), match.group('value')
+            if key in SCORE_FIELDS:
+                number = NUMBER.match(value)
+                value = float(number.group(1)) if number else None
+            elif key == 'overall_winner':
+                value = value.strip().upper() if value.strip().upper() in ('A', 'B') else None
+            else:
+                continue
+        elif match.group('metric'):
+            metric = match.group('metric').lower()
+            continue
+        elif match.group('story'):
+            if metric is None:
+                continue
+            key, value = f"{metric}_score_{match.group('story').upper()}", float(match.group('score'))
         else:
-            parsed['coherence_pref'] = "B"
-            b += 1
+            key, value = 'overall_winner', match.group('winner').upper()
+        if key in SCORE_FIELDS and value is not None and not 0 <= value <= 5:
+            value = None
+        if value is not None and key not in fields:
+            fields[key] = value
+    return fields
 
-        if parsed['likability_score_A'] >= parsed['likability_score_B']:
-            parsed['likability_pref'] = "A"
+def missing_fields(fields):
+    return [field for field in SCORE_FIELDS if field not in fields]
+
+# Parse the evaluation results; None until all six scores are known. Preferences are derived from
+# the scores, and the overall preference from the category wins.
+def parse_evaluation(evaluation):
+    if not isinstance(evaluation, str):
+        return None
+    fields = parse_fields(evaluation)
+    if missing_fields(fields):
+        return None
+    parsed = {field: fields[field] for field in SCORE_FIELDS}
+    a = 0
+    b = 0
+    for metric in METRICS:
+        if parsed[f"{metric}_score_A"] >= parsed[f"{metric}_score_B"]:
+            parsed[f"{metric}_pref"] = "A"
             a += 1
         else:
-            parsed['likability_pref'] = "B"
+            parsed[f"{metric}_pref"] = "B"
             b += 1
+    parsed['overall_pref'] = "A" if a >= b else "B"
+    return parsed
+
+def pairwise_eval(client, story1, story2, model="gpt-3.5-turbo", cache=None):
+    return send_request(client, pairwise_request(story1, story2, model), cache)
+
+# Models that accept a strict json_schema response format, and older ones that only have JSON mode
+# (json_object). Other models (local servers, older checkpoints) get no response_format and are read
+# by the tolerant parser.
+STRUCTURED_OUTPUT_MODELS = ('gpt-4o-mini', 'gpt-4o-2024-08-06', 'gpt-4o-2024-11-20', 'gpt-4.1', 'o1', 'o3', 'o4-mini')
+JSON_MODE_MODELS = ('gpt-4o', 'gpt-4-turbo', 'gpt-4-1106', 'gpt-4-0125', 'gpt-3.5-turbo')
 
-        if a >= b:
-            parsed['overall_pref'] = "A"
+def supports_structured_outputs(model):
+    # The bare gpt-4o alias points at a snapshot with structured outputs; its 2024-05-13 snapshot has JSON mode only
+    return model == 'gpt-4o' or model.startswith(STRUCTURED_OUTPUT_MODELS)
+
+# Function to pick the response format a model accepts for the given fields; None sends plain text
+def response_format_for(model, fields):
+    if supports_structured_outputs(model):
+        return evaluation_format(fields)
+    if model.startswith(JSON_MODE_MODELS) and model not in ('gpt-3.5-turbo-0613', 'gpt-3.5-turbo-0301'):
+        return {'type': 'json_object'}
+    return None
+
+def with_response_format(request, fields):
+    response_format = response_format_for(request['model'], fields)
+    if response_format is not None:
+        request['response_format'] = response_format
+    return request
+
+# JSON schema response format for the given fields (all of them required)
+def evaluation_format(fields):
+    properties = {}
+    for field in fields:
+        if field in SCORE_FIELDS:
+            properties[field] = {'type': 'number', 'description': "Rating out of 5"}
+        elif field == 'overall_winner':
+            properties[field] = {'type': 'string', 'enum': ['A', 'B']}
         else:
-            parsed['overall_pref'] = "B"
+            properties[field] = {'type': 'string', 'description': "One line reasoning"}
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': 'pairwise_evaluation',
+            'strict': True,
+            'schema': {'type': 'object', 'properties': properties, 'required': list(fields), 'additionalProperties': False},
+        },
+    }
 
-        return parsed
-    except Exception as e:
-        print(e)
-        return None
+EVALUATION_FIELDS = [field for metric in METRICS for field in (f"{metric}_score_A", f"{metric}_score_B", f"{metric}_reason")] + ['overall_winner']
 
-def pairwise_eval(client, story1, story2, model="gpt-3.5-turbo"):
+# Build the chat request comparing two stories
+def pairwise_request(story1, story2, model="gpt-3.5-turbo"):
     # Prompts
     system_prompt1 = """
     You are an English writing expert and you can compare and evaluate story essays on these metrics with the following definitions -
@@ -80,35 +177,16 @@ def pairwise_eval(client, story1, story2, model="gpt-3.5-turbo"):
         2. Coherence: Which story has a better logical flow and the writing fits together with respect to the plot?
         3. Likability: Which story do you find more enjoyable to read?
     You will be given two Stories - Story A and Story B.
-    Add a rating out of 5 for each category, specify which story you prefer for each metric by responding with just the letter "A" or "B" followed by a hyphen and one line reasoning for your preference.
-    For each category provide a category winner story as the letter "A" or "B", based on the category ratings.
+    Add a rating out of 5 for each story in each category and one line reasoning for the ratings.
     Finally, assign an overall winner story as the letter "A" or "B" based on the ratings and category wins.
 
-    IMPORTANT - DO NOT GIVE ANY OTHER TEXT APART FROM THE SCORE, METRICS AND PREFERENCE. FOLLOW THE EXACT FORMAT AS GIVEN IN THE FOLLOWING EXAMPLES.
-
-    EXAMPLE OUTPUT 1:
-    Grammar  Preference: A
-    A - 5/5: Story A has a few minor grammatical issues, but overall, it demonstrates strong control of language.
-    B - 4/5: Story B is well-written but has slightly more noticeable issues in grammar and sentence structure.
-    Coherence  Preference: A
-    A - 4.5/5: Story B has a strong coherence, effectively conveying the emotional journey and the progression of events.
-    B - 4/5: Story A maintains a consistent and engaging narrative flow, though some parts are a bit abstract.
-    Likability  Preference: A
-    A - 4/5: Story B's realistic and emotional narrative is likely to resonate more with a wide range of readers.
-    B - 3.5/5: Story A is imaginative and intriguing, but its abstract nature might not appeal to all readers.
-    Overall Winner: A
-
-    EXAMPLE OUTPUT 2:
-    Grammar Preference: B
-    A - 3/5: Story A has some complex sentences that are difficult to follow, with occasional grammatical errors.
-    B - 4/5: Story B is well-written with minor grammatical mistakes and clear sentence structures.
-    Coherence Preference: B
-    A - 2/5: The plot of Story A is somewhat confusing and disjointed, especially with the sudden introduction of an old sage.
-    B - 5/5: Story B maintains a coherent narrative, with each event logically building on the previous one, enhancing the story’s flow.
-    Likability Preference: B
-    A - 3/5: Story A is heartfelt but its erratic narrative structure detracts from its overall appeal.
-    B - 5/5: Story B is compelling and maintains consistent character development, making it more enjoyable and engaging.
-    Overall Winner: B
+    IMPORTANT - ANSWER WITH A SINGLE JSON OBJECT AND NO OTHER TEXT, AS IN THE FOLLOWING EXAMPLE.
+
+    EXAMPLE OUTPUT:
+    {"grammar_score_A": 5, "grammar_score_B": 4, "grammar_reason": "Story A demonstrates strong control of language; Story B has slightly more noticeable issues.",
+     "coherence_score_A": 4.5, "coherence_score_B": 4, "coherence_reason": "Story A conveys the progression of events effectively; parts of Story B are a bit abstract.",
+     "likability_score_A": 4, "likability_score_B": 3.5, "likability_reason": "Story A's emotional narrative is likely to resonate with more readers.",
+     "overall_winner": "A"}
 
     """
 
@@ -119,44 +197,114 @@ def pairwise_eval(client, story1, story2, model="gpt-3.5-turbo"):
     Story B:
     {story2}
     """
-    response1 = chat(client, prompt0, model=model, system_prompt=system_prompt1)
-    return response1.choices[0].message.content
+    return with_response_format(chat_request(prompt0, model=model, system_prompt=system_prompt1), EVALUATION_FIELDS)
+
+# Follow-up request asking only for the fields missing from the previous answer
+def requery_request(request, response, missing):
+    requery = {key: value for key, value in request.items() if key != 'response_format'}
+    requery['messages'] = request['messages'] + [
+        {"role": "assistant", "content": response or ""},
+        {"role": "user", "content": f"Your evaluation is missing these fields: {', '.join(missing)}. Answer with a JSON object with only these fields."},
+    ]
+    return with_response_format(requery, missing)
+
+class JudgeStats:
+    """Per-run counts of incomplete judge answers and the follow-up calls they needed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.comparisons = 0
+        self.calls = 0
+        self.errors = 0
+        self.parse_failures = 0
+        self.requeries = 0
+        self.recovered = 0
+        self.failed = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self):
+        comparisons = self.comparisons or 1
+        return (f"{self.comparisons} comparisons in {self.calls} judge calls: parse failures {self.parse_failures / comparisons:.1%}, "
+                f"re-queries {self.requeries / comparisons:.1%} ({self.requeries} calls asking only for missing fields), "
+                f"{self.recovered} answers completed by re-query, {self.failed} comparisons failed, {self.errors} API errors")
+
+    # A run in which every judge call raised (bad model name, unsupported parameter, no key) has no results at all
+    def raise_if_all_failed(self):
+        if self.calls and self.errors == self.calls:
+            raise RuntimeError(f"All {self.calls} judge calls failed; see the errors above")
+
+# Function to judge one pair: the first answer is parsed, and only the fields it is missing are asked
+# for again (up to max_redo calls in total). Returns (evaluations text, parsed results or None).
+def judge_pair(client, story1, story2, model="gpt-3.5-turbo", cache=None, max_redo=3, stats=None):
+    stats = stats or JudgeStats()
+    request = pairwise_request(story1, story2, model)
+    current = request
+    fields = {}
+    responses = []
+    for attempt in range(max_redo):
+        try:
+            content = send_request(client, current, cache)
+        except JudgeCacheMiss:
+            raise
+        except Exception as e:
+            print(f"Error during evaluation: {e}")
+            stats.add(calls=1, errors=1)
+            continue
+        stats.add(calls=1, requeries=int(current is not request))
+        responses.append(content)
+        for key, value in parse_fields(content).items():
+            fields.setdefault(key, value)
+        missing = missing_fields(fields)
+        if not missing:
+            break
+        if len(responses) == 1:
+            stats.add(parse_failures=1)
+        current = requery_request(request, content, missing)
+
+    results = '\n'.join(responses) if responses else None
+    parsed_results = parse_evaluation(results)
+    stats.add(comparisons=1, recovered=int(parsed_results is not None and len(responses) > 1), failed=int(parsed_results is None))
+    return results, parsed_results
+
+# Every story of an instruction is compared against the same anchor story
+def comparison_pairs(df):
+    row_with_11 = df[df['Number_of_Constraints'] == 23].iloc[1]
+    for index, other_row in df.iterrows():
+        if other_row['story_id'] == row_with_11['story_id']:
+            continue
+        yield other_row, row_with_11
+
+def ordered_pair(other_row, anchor, order):
+    return (other_row, anchor) if order else (anchor, other_row)
+
+def record_evaluation(df, row_name, results, order):
+    parsed_results = parse_evaluation(results)
+    if parsed_results:
+        for key, value in parsed_results.items():
+            df.loc[row_name, key] = value
+        df.loc[row_name, 'order'] = order
+    df.loc[row_name, 'needs_parsing'] = 0 if parsed_results else 1
+    df.loc[row_name, 'evaluations'] = results
 
 # Evaluate stories and save results
-def evaluate_stories(grouped_dfs, client, output_dir, max_trials=35, max_redo=3):
+def evaluate_stories(grouped_dfs, client, output_dir, max_trials=35, max_redo=3, cache=None):
+    stats = JudgeStats()
     count = 0
     for instruction, df in grouped_dfs.items():
         count += 1
         if count > max_trials:
             continue
         
-        row_with_11 = df[df['Number_of_Constraints'] == 23].iloc[1]
-        for index, other_row in df.iterrows():
-            if other_row['story_id'] == row_with_11['story_id']:
-                continue
-            
+        for other_row, row_with_11 in comparison_pairs(df):
             rand_trial = np.random.randint(2)
-            story_a, story_b = (other_row, row_with_11) if rand_trial else (row_with_11, other_row)
-            results = None
-            needs_parsing = 0
-            
-            for attempt in range(max_redo):
-                try:
-                    results = pairwise_eval(client, story_a['FinalGeneratedStory'], story_b['FinalGeneratedStory'])
-                    parsed_results = parse_evaluation(results)
-                    if parsed_results:
-                        for key, value in parsed_results.items():
-                            df.loc[other_row.name, key] = value
-                        df.loc[other_row.name, 'order'] = rand_trial
-                        needs_parsing = 0
-                        break
-                except Exception as e:
-                    print(f"Error during evaluation: {e}")
-                    needs_parsing = 1
-                    break
-
-            df.loc[other_row.name, 'needs_parsing'] = needs_parsing
-            df.loc[other_row.name, 'evaluations'] = results
+            story_a, story_b = ordered_pair(other_row, row_with_11, rand_trial)
+            results, _ = judge_pair(client, story_a['FinalGeneratedStory'], story_b['FinalGeneratedStory'], cache=cache, max_redo=max_redo, stats=stats)
+            record_evaluation(df, other_row.name, results, rand_trial)
+        stats.raise_if_all_failed()
         
         print(f"Evaluations complete for instruction {instruction}")
 
@@ -164,30 +312,166 @@ def evaluate_stories(grouped_dfs, client, output_dir, max_trials=35, max_redo=3)
         output_file = os.path.join(output_dir, f"{instruction}_evaluations.csv")
         df.to_csv(output_file, index=False)
         grouped_dfs[instruction] = df
+    print(stats.report())
+
+# Write every comparison to batch files instead of calling the API. The custom_id records the
+# instruction group, the row and the story order so that the import can rebuild the same pair.
+def export_evaluations(grouped_dfs, output_prefix, max_trials=35):
+    requests = []
+    for group, df in enumerate(grouped_dfs.values()):
+        if group >= max_trials:
+            continue
+        for other_row, row_with_11 in comparison_pairs(df):
+            rand_trial = np.random.randint(2)
+            story_a, story_b = ordered_pair(other_row, row_with_11, rand_trial)
+            request = pairwise_request(story_a['FinalGeneratedStory'], story_b['FinalGeneratedStory'])
+            requests.append((make_custom_id('sqe', [group, other_row.name, rand_trial], request), request))
+    return export_batch(requests, output_prefix)
+
+# Join batch results back in the same layout as evaluate_stories; failed and missing comparisons
+# are kept with needs_parsing = 1 and the reason in batch_error
+def import_evaluations(grouped_dfs, result_paths, output_dir, max_trials=35, cache=None):
+    results = read_batch_results(result_paths)
+    exported_orders = {}
+    for custom_id in results:
+        prefix, parts, _ = parse_custom_id(custom_id)
+        if prefix == 'sqe' and len(parts) == 3:
+            exported_orders[(parts[0], parts[1])] = int(parts[2])
+
+    for group, (instruction, df) in enumerate(grouped_dfs.items()):
+        if group >= max_trials:
+            continue
+        requests = []
+        keys = []
+        orders = {}
+        for other_row, row_with_11 in comparison_pairs(df):
+            order = exported_orders.get((str(group), str(other_row.name)), 0)
+            story_a, story_b = ordered_pair(other_row, row_with_11, order)
+            request = pairwise_request(story_a['FinalGeneratedStory'], story_b['FinalGeneratedStory'])
+            requests.append(request)
+            keys.append((other_row.name, make_custom_id('sqe', [group, other_row.name, order], request)))
+            orders[other_row.name] = order
+
+        joined = join_results(keys, results)
+        for request, (row_name, _) in zip(requests, keys):
+            content, error = joined[row_name]
+            record_evaluation(df, row_name, content, orders[row_name])
+            df.loc[row_name, 'batch_error'] = error
+            if cache is not None and content is not None:
+                cache.put(request, content)
+        print(f"{summarize(joined)} for instruction {instruction}")
+
+        output_file = os.path.join(output_dir, f"{instruction}_evaluations.csv")
+        df.to_csv(output_file, index=False)
+        grouped_dfs[instruction] = df
+
+# Function to build the judge for AdaptiveRanker: compares two rows of df and returns the overall
+# preference ('A'/'B'), or None when no parsable evaluation came back in max_redo attempts
+def ranking_judge(client, df, max_redo=3, cache=None, stats=None):
+    def judge(story_a, story_b):
+        _, parsed_results = judge_pair(client, df.iloc[story_a]['FinalGeneratedStory'], df.iloc[story_b]['FinalGeneratedStory'],
+                                       cache=cache, max_redo=max_redo, stats=stats)
+        return parsed_results['overall_pref'] if parsed_results else None
+    return judge
+
+# Rank every story of an instruction with adaptive pairwise comparisons instead of comparing
+# against one anchor story; saves the ranking and the comparisons made per instruction
+def rank_stories(grouped_dfs, client, output_dir, max_trials=35, max_redo=3, cache=None, concurrency=8,
+                 rank_tolerance=0.1, max_comparisons=None):
+    stats = JudgeStats()
+    calls = round_robin = 0
+    for count, (instruction, df) in enumerate(grouped_dfs.items()):
+        if count >= max_trials:
+            continue
+        df = df.reset_index(drop=True)
+        ranker = AdaptiveRanker(len(df), ranking_judge(client, df, max_redo, cache, stats), concurrency=concurrency,
+                                rank_tolerance=rank_tolerance, max_comparisons=max_comparisons)
+        ranking = ranker.run().drop(columns='item')
+        stats.raise_if_all_failed()
+        df = pd.concat([df, ranking], axis=1).sort_values('rank')
+        print(f"Ranking complete for instruction {instruction}: {ranker.report()}")
+        calls += ranker.calls
+        round_robin += ranker.round_robin_calls()
+
+        comparisons = pd.DataFrame(ranker.records, columns=['round', 'story_a', 'story_b', 'verdict'])
+        if 'story_id' in df.columns:
+            story_ids = df.sort_index()['story_id']
+            comparisons['story_a'] = story_ids.iloc[comparisons['story_a']].values
+            comparisons['story_b'] = story_ids.iloc[comparisons['story_b']].values
+        df.to_csv(os.path.join(output_dir, f"{instruction}_ranking.csv"), index=False)
+        comparisons.to_csv(os.path.join(output_dir, f"{instruction}_comparisons.csv"), index=False)
+        grouped_dfs[instruction] = df
+    print(f"{calls} ranking judge calls, {round_robin - calls} of the {round_robin} round robin calls saved")
+    print(stats.report())
+
+# Function to split the stories into groups; instructions are long free text, so their groups are numbered
+# to keep the output file names short
+def group_stories(df, group_column=None):
+    if group_column is None:
+        return {"default": df}
+    groups = df.groupby(group_column, sort=False)
+    if group_column == 'Instruction':
+        return {f"instruction_{number:03d}": group for number, (_, group) in enumerate(groups)}
+    return {str(value): group for value, group in groups}
 
 # Main function to handle argument parsing
 def main():
     parser = argparse.ArgumentParser(description="Run story evaluation using OpenAI API")
     
     # API key and input/output paths
-    parser.add_argument("--api_key", required=True, help="Your OpenAI API key")
+    parser.add_argument("--api_key", default=os.environ.get('OPENAI_API_KEY'), help="Your OpenAI API key (not needed with --export_batch/--import_batch)")
     parser.add_argument("--input_file", required=True, help="Path to input CSV file")
     parser.add_argument("--output_dir", required=True, help="Directory to save evaluation results")
     parser.add_argument("--max_trials", type=int, default=35, help="Maximum number of trials for evaluation")
+    parser.add_argument("--export_batch", default=None, help="Write the comparisons to batch files with this path prefix instead of calling the API")
+    parser.add_argument("--import_batch", nargs='+', default=None, help="Batch result JSONL files to join back instead of calling the API")
+    parser.add_argument("--ranking", choices=['anchor', 'adaptive'], default='anchor',
+                        help="anchor: compare every story against one anchor story; adaptive: rank all stories of an instruction with adaptive pairwise comparisons")
+    parser.add_argument("--group_column", default=None,
+                        help="Column to group stories by (default: Instruction for --ranking adaptive, one group otherwise)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent judge calls in adaptive ranking")
+    parser.add_argument("--rank_tolerance", type=float, default=0.1, help="Stop ranking once the mean expected rank error is at most this fraction of the stories")
+    parser.add_argument("--max_comparisons", type=int, default=None, help="Judge call budget per instruction in adaptive ranking (default: the worst case of merge sort)")
+    add_cache_arguments(parser)
+    add_telemetry_arguments(parser)
     
     args = parser.parse_args()
-
-    # Initialize OpenAI API client
-    client = initialize_openai(args.api_key)
+    configure(args.telemetry_dir)
 
     # Load the input file into a pandas DataFrame
     df = pd.read_csv(args.input_file)
     
-    # Group the DataFrame by instruction if needed
-    grouped_dfs = {"default": df}  # In case grouping is needed, adapt this based on your use case
+    # Group the DataFrame by instruction if needed; adaptive ranking only compares stories of the same instruction
+    group_column = args.group_column
+    if group_column is None and args.ranking == 'adaptive':
+        if 'Instruction' not in df.columns:
+            parser.error("--ranking adaptive ranks the stories of each instruction; the input has no Instruction column, pass --group_column")
+        group_column = 'Instruction'
+    grouped_dfs = group_stories(df, group_column)
     
     # Evaluate the stories and save results
-    evaluate_stories(grouped_dfs, client, args.output_dir, max_trials=args.max_trials)
+    cache = open_cache(args.judge_cache, args.judge_cache_max_mb, args.judge_cache_read_only)
+    if args.ranking == 'adaptive' and (args.export_batch or args.import_batch):
+        parser.error("--ranking adaptive picks each round from the previous verdicts and cannot run as a batch")
+    if args.export_batch:
+        export_evaluations(grouped_dfs, args.export_batch, max_trials=args.max_trials)
+        return
+    if args.import_batch:
+        import_evaluations(grouped_dfs, args.import_batch, args.output_dir, max_trials=args.max_trials, cache=cache)
+        return
+
+    # Initialize OpenAI API client
+    if not args.api_key:
+        parser.error("--api_key (or OPENAI_API_KEY) is required unless --export_batch/--import_batch is used")
+    client = initialize_openai(args.api_key)
+    with stage(f"story_quality_eval:{args.ranking}", rows=len(df)):
+        if args.ranking == 'adaptive':
+            rank_stories(grouped_dfs, client, args.output_dir, max_trials=args.max_trials, cache=cache, concurrency=args.concurrency,
+                         rank_tolerance=args.rank_tolerance, max_comparisons=args.max_comparisons)
+        else:
+            evaluate_stories(grouped_dfs, client, args.output_dir, max_trials=args.max_trials, cache=cache)
+    if cache is not None:
+        print(cache.report())
 
 if __name__ == "__main__":
     main()
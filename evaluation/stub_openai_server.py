@@ -0,0 +1,97 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A local OpenAI-compatible chat completions server for exercising the judge scripts without the network.
+# It answers every constraint in the prompt with "Yes"/"No" in the format the judges expect, and can
+# add latency and inject 429/500 errors to test concurrency limits and retries.
+
+CONSTRAINT_LINE = re.compile(r"^\s*(\d+)\.\s", re.MULTILINE)
+
+
+def judge_answer(user_prompt):
+    # Only number the lines after the "Constraints" header (the story itself may contain numbered lines)
+    constraints = user_prompt.split('Constraints', 1)[-1]
+    numbers = sorted({int(number) for number in CONSTRAINT_LINE.findall(constraints)})
+    lines = []
+    satisfied = 0
+    for number in numbers:
+        verdict = 'Yes' if number % 3 else 'No'
+        satisfied += verdict == 'Yes'
+        lines.append(f"{number}. {verdict} - Stub verdict for constraint {number}.")
+    lines.append(f"Number of constraints satisfied: {satisfied}")
+    return '\n'.join(lines)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    error_rate = 0.0
+    answer = staticmethod(judge_answer)
+    request_count = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with StubHandler.lock:
+            StubHandler.request_count += 1
+        time.sleep(self.latency)
+
+        if random.random() < self.error_rate:
+            status = random.choice([429, 500])
+            self._send(status, {'error': {'message': 'injected error', 'type': 'stub', 'code': status}}, {'retry-after': '0'})
+            return
+
+        user_prompt = next((message['content'] for message in reversed(body.get('messages', [])) if message['role'] == 'user'), '')
+        content = self.answer(user_prompt)
+        prompt_tokens = sum(len(message['content']) for message in body.get('messages', [])) // 4
+        completion_tokens = len(content) // 4
+        self._send(200, {
+            'id': f"chatcmpl-stub-{StubHandler.request_count}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to start the stub server on a background thread; returns (server, base_url)
+def start_stub_server(port=0, latency=0.0, error_rate=0.0, answer=None):
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'latency': latency, 'error_rate': error_rate})
+    if answer is not None:
+        handler.answer = staticmethod(answer)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stub server for the judge scripts.")
+    parser.add_argument('--port', type=int, default=8001, help="Port to listen on")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds to wait before answering each request")
+    parser.add_argument('--error_rate', type=float, default=0.0, help="Fraction of requests answered with a 429 or 500 error")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.port, args.latency, args.error_rate)
+    print(f"Stub server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
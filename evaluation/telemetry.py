@@ -0,0 +1,443 @@
+import argparse
+import atexit
+import json
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Structured telemetry for story generation, the judges and the evaluation stages.
+# Every process appends JSON events, one per line, to <dir>/events-<run>-<pid>.jsonl:
+#   stage       a timed block (a pipeline stage, one model's generation, a judge run): wall seconds,
+#               rows, rows/sec, status and the peak RSS of the process so far
+#   api_call    one judge request: model, latency, prompt/completion tokens, estimated cost, status
+#               (ok, error or cached)
+#   retry       a judge request that is sent again after an error, with the backoff delay
+#   generation  a chunk of stories from a generation backend: prompts, tokens, seconds
+# Events carry the name of the stage they happened in, so time and spend can be traced to a stage.
+# Telemetry is on when a directory is given (--telemetry_dir or $CS4_TELEMETRY_DIR) and a no-op otherwise.
+# The run id is handed to child processes in $CS4_RUN_ID, so pipeline workers and storygen ranks add
+# to the same run (export it to put several scripts in one run). Every process rewrites a Prometheus
+# textfile snapshot of its run (<dir>/cs4.prom, for node_exporter's textfile collector) when it exits, and
+#   python evaluation/telemetry.py <dir>
+# summarizes the latest run: time by stage, judge latency/tokens/spend by model, generation throughput.
+
+TELEMETRY_DIR_ENV = 'CS4_TELEMETRY_DIR'
+RUN_ID_ENV = 'CS4_RUN_ID'
+PRICES_ENV = 'CS4_PRICES'
+PROMETHEUS_FILE = 'cs4.prom'
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# USD per million (prompt, completion) tokens, matched by the longest model name prefix. These are list
+# prices, so spend is an estimate; $CS4_PRICES may name a JSON file {"model": [prompt, completion]} to
+# add or override models. Models without a price are reported as unpriced.
+PRICES = {
+    'gpt-4-turbo': (10.0, 30.0),
+    'gpt-4o-mini': (0.15, 0.6),
+    'gpt-4o': (2.5, 10.0),
+    'gpt-4': (30.0, 60.0),
+    'gpt-3.5-turbo': (0.5, 1.5),
+}
+
+
+def load_prices():
+    prices = dict(PRICES)
+    path = os.environ.get(PRICES_ENV)
+    if path:
+        with open(path, encoding='utf-8') as file:
+            prices.update({model: tuple(price) for model, price in json.load(file).items()})
+    return prices
+
+
+def price_of(model, prices=None):
+    prices = PRICES if prices is None else prices
+    matches = [name for name in prices if model.startswith(name)]
+    return prices[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens, prices=None):
+    price = price_of(model, prices)
+    if price is None or prompt_tokens is None:
+        return None
+    return (prompt_tokens * price[0] + (completion_tokens or 0) * price[1]) / 1e6
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def usage_tokens(response):
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return None, None
+    return usage.prompt_tokens, usage.completion_tokens
+
+
+def events_path(directory, run_id, pid=None):
+    return os.path.join(directory, f"events-{run_id}-{pid or os.getpid()}.jsonl")
+
+
+class StageTimer:
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.started = time.perf_counter()
+
+    def add_rows(self, count):
+        self.rows = (self.rows or 0) + count
+
+
+class Telemetry:
+    def __init__(self, directory=None, run_id=None):
+        self.directory = directory
+        self.run_id = run_id
+        self.prices = load_prices() if directory else PRICES
+        self.stages = []
+        self.lock = threading.Lock()
+        self.file = None
+        self.pid = os.getpid()
+        self.started = time.perf_counter()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def event(self, kind, **fields):
+        if not self.enabled:
+            return
+        record = {'ts': round(time.time(), 6), 'run': self.run_id, 'pid': os.getpid(), 'event': kind,
+                  'stage': self.stages[-1].name if self.stages else None, **fields}
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            # A forked pool worker inherits the parent's file; it writes to a file of its own
+            if self.file is None or self.pid != os.getpid():
+                os.makedirs(self.directory, exist_ok=True)
+                self.file = open(events_path(self.directory, self.run_id), 'a', encoding='utf-8')
+                self.pid = os.getpid()
+            self.file.write(line)
+            self.file.flush()
+
+    @contextmanager
+    def stage(self, name, rows=None, **fields):
+        timer = StageTimer(name, rows)
+        if not self.enabled:
+            yield timer
+            return
+        self.stages.append(timer)
+        status = 'error'
+        try:
+            yield timer
+            status = 'ok'
+        finally:
+            self.stages.remove(timer)
+            seconds = time.perf_counter() - timer.started
+            rows_per_second = timer.rows / seconds if timer.rows and seconds else None
+            self.event('stage', name=name, seconds=seconds, rows=timer.rows, rows_per_second=rows_per_second,
+                       status=status, peak_rss_bytes=peak_rss_bytes(), **fields)
+
+    # Function to count rows towards the innermost open stage (for code that learns its row count late)
+    def add_rows(self, count):
+        if self.stages:
+            self.stages[-1].add_rows(count)
+
+    def api_call(self, model, seconds, prompt_tokens=None, completion_tokens=None, status='ok', **fields):
+        if not self.enabled:
+            return
+        cost = estimate_cost(model, prompt_tokens, completion_tokens, self.prices) if status == 'ok' else 0.0
+        self.event('api_call', model=model, seconds=seconds, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                   cost_usd=cost, status=status, **fields)
+
+    def retry(self, model, delay, error):
+        self.event('retry', model=model, delay=delay, error=error)
+
+    def generation(self, prompts, seconds, prompt_tokens=None, completion_tokens=None, **fields):
+        self.event('generation', prompts=prompts, seconds=seconds, prompt_tokens=prompt_tokens,
+                   completion_tokens=completion_tokens, **fields)
+
+    def close(self):
+        if not self.enabled or self.pid != os.getpid():
+            return
+        self.event('process_end', seconds=time.perf_counter() - self.started, peak_rss_bytes=peak_rss_bytes())
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        write_prometheus(os.path.join(self.directory, PROMETHEUS_FILE), summarize(read_events(self.directory, self.run_id)[1]))
+
+
+_telemetry = None
+
+
+# Function to get this process' telemetry; enabled from $CS4_TELEMETRY_DIR when configure() was not called
+def get_telemetry():
+    if _telemetry is None:
+        directory = os.environ.get(TELEMETRY_DIR_ENV)
+        return configure(directory or None)
+    return _telemetry
+
+
+# Function to turn telemetry on for this process and the processes it starts; None leaves it as it is
+def configure(directory):
+    global _telemetry
+    if directory is None:
+        _telemetry = _telemetry or Telemetry()
+        return _telemetry
+    if _telemetry is not None and _telemetry.enabled:
+        return _telemetry
+    directory = os.path.abspath(directory)
+    run_id = os.environ.get(RUN_ID_ENV)
+    if run_id is None:
+        run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        os.environ[RUN_ID_ENV] = run_id
+    os.environ[TELEMETRY_DIR_ENV] = directory
+    _telemetry = Telemetry(directory, run_id)
+    _telemetry.event('process_start', argv=sys.argv)
+    atexit.register(_telemetry.close)
+    return _telemetry
+
+
+def stage(name, rows=None, **fields):
+    return get_telemetry().stage(name, rows, **fields)
+
+
+def add_rows(count):
+    get_telemetry().add_rows(count)
+
+
+def add_telemetry_arguments(parser):
+    parser.add_argument('--telemetry_dir', default=os.environ.get(TELEMETRY_DIR_ENV),
+                        help=f"Directory for JSONL telemetry events and the Prometheus snapshot (default: ${TELEMETRY_DIR_ENV}; off when unset)")
+
+
+# Function to read the events of one run (default: the most recent run in the directory)
+def read_events(directory, run_id=None):
+    events = []
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith('events-') and name.endswith('.jsonl')):
+            continue
+        if run_id is not None and not name.startswith(f"events-{run_id}-"):
+            continue
+        with open(os.path.join(directory, name), encoding='utf-8') as file:
+            for line in file:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # The last line of a process that was killed mid-write
+                    continue
+    if run_id is None and events:
+        run_id = max(events, key=lambda event: event['ts'])['run']
+        events = [event for event in events if event['run'] == run_id]
+    events.sort(key=lambda event: event['ts'])
+    return run_id, events
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    # Nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def _add(totals, key, value):
+    if value is not None:
+        totals[key] = totals.get(key, 0) + value
+
+
+# Function to aggregate the events of a run into per-stage, per-model and per-generation totals
+def summarize(events):
+    summary = {'run': events[0]['run'] if events else None, 'wall_seconds': 0.0, 'peak_rss_bytes': None,
+               'stages': {}, 'models': {}, 'generation': {}, 'spend': {}}
+    if not events:
+        return summary
+    starts = [event['ts'] - (event.get('seconds') or 0) if event['event'] == 'stage' else event['ts'] for event in events]
+    summary['wall_seconds'] = max(event['ts'] for event in events) - min(starts)
+    peaks = [event['peak_rss_bytes'] for event in events if event.get('peak_rss_bytes')]
+    summary['peak_rss_bytes'] = max(peaks) if peaks else None
+
+    for event in events:
+        kind = event['event']
+        if kind == 'stage':
+            totals = summary['stages'].setdefault(event['name'], {'parent': event['stage'], 'runs': 0, 'errors': 0, 'seconds': 0.0, 'rows': 0})
+            totals['runs'] += 1
+            totals['errors'] += event['status'] != 'ok'
+            _add(totals, 'seconds', event['seconds'])
+            _add(totals, 'rows', event['rows'])
+        elif kind in ('api_call', 'retry'):
+            totals = summary['models'].setdefault(event['model'], {'requests': 0, 'cached': 0, 'errors': 0, 'retries': 0, 'latencies': [],
+                                                                   'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0, 'unpriced': 0})
+            if kind == 'retry':
+                totals['retries'] += 1
+                continue
+            totals['requests'] += 1
+            if event['status'] == 'cached':
+                totals['cached'] += 1
+                continue
+            totals['errors'] += event['status'] == 'error'
+            totals['latencies'].append(event['seconds'])
+            _add(totals, 'prompt_tokens', event['prompt_tokens'])
+            _add(totals, 'completion_tokens', event['completion_tokens'])
+            if event['status'] == 'ok' and event['cost_usd'] is None:
+                totals['unpriced'] += 1
+            _add(totals, 'cost_usd', event['cost_usd'])
+            _add(summary['spend'], (event['stage'], event['model']), event['cost_usd'])
+        elif kind == 'generation':
+            totals = summary['generation'].setdefault(event['stage'], {'prompts': 0, 'seconds': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0})
+            _add(totals, 'prompts', event['prompts'])
+            _add(totals, 'seconds', event['seconds'])
+            _add(totals, 'prompt_tokens', event['prompt_tokens'])
+            _add(totals, 'completion_tokens', event['completion_tokens'])
+    return summary
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Function to render a run summary in the Prometheus text exposition format
+def render_prometheus(summary):
+    run = summary['run'] or ''
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+        lines.extend(f"{name}{suffix}{_labels(run=run, **labels)} {_number(value)}" for suffix, labels, value in samples)
+
+    metric('cs4_run_wall_seconds', 'gauge', "Wall time from the first to the last event of the run.", [('', {}, summary['wall_seconds'])])
+    if summary['peak_rss_bytes'] is not None:
+        metric('cs4_peak_rss_bytes', 'gauge', "Largest peak resident set size of any process of the run.", [('', {}, summary['peak_rss_bytes'])])
+    stages = summary['stages'].items()
+    metric('cs4_stage_seconds_total', 'counter', "Wall time spent in each stage.", [('', {'stage': name}, totals['seconds']) for name, totals in stages])
+    metric('cs4_stage_rows_total', 'counter', "Rows processed by each stage.", [('', {'stage': name}, totals['rows']) for name, totals in stages])
+    metric('cs4_stage_rows_per_second', 'gauge', "Rows per second of wall time in each stage.",
+           [('', {'stage': name}, totals['rows'] / totals['seconds']) for name, totals in stages if totals['rows'] and totals['seconds']])
+    metric('cs4_stage_errors_total', 'counter', "Runs of each stage that raised an error.", [('', {'stage': name}, totals['errors']) for name, totals in stages])
+
+    models = summary['models'].items()
+    requests = []
+    for model, totals in models:
+        requests.append(('', {'model': model, 'status': 'cached'}, totals['cached']))
+        requests.append(('', {'model': model, 'status': 'error'}, totals['errors']))
+        requests.append(('', {'model': model, 'status': 'ok'}, totals['requests'] - totals['cached'] - totals['errors']))
+    metric('cs4_api_requests_total', 'counter', "Judge API requests by outcome.", requests)
+    metric('cs4_api_retries_total', 'counter', "Judge API requests sent again after an error.", [('', {'model': model}, totals['retries']) for model, totals in models])
+    histogram = []
+    for model, totals in models:
+        for bound in LATENCY_BUCKETS:
+            histogram.append(('_bucket', {'model': model, 'le': f"{bound:g}"}, sum(latency <= bound for latency in totals['latencies'])))
+        histogram.append(('_bucket', {'model': model, 'le': '+Inf'}, len(totals['latencies'])))
+        histogram.append(('_sum', {'model': model}, sum(totals['latencies'])))
+        histogram.append(('_count', {'model': model}, len(totals['latencies'])))
+    metric('cs4_api_latency_seconds', 'histogram', "Latency of judge API requests (cache hits excluded).", histogram)
+    metric('cs4_api_tokens_total', 'counter', "Prompt and completion tokens of the judge requests.",
+           [('', {'model': model, 'kind': kind}, totals[f"{kind}_tokens"]) for model, totals in models for kind in ('prompt', 'completion')])
+    generation = summary['generation'].items()
+    metric('cs4_generation_prompts_total', 'counter', "Prompts generated in each generation stage.", [('', {'stage': name or ''}, totals['prompts']) for name, totals in generation])
+    metric('cs4_generation_tokens_total', 'counter', "Prompt and completion tokens counted by the generation backends.",
+           [('', {'stage': name or '', 'kind': kind}, totals[f"{kind}_tokens"]) for name, totals in generation for kind in ('prompt', 'completion')])
+    metric('cs4_generation_seconds_total', 'counter', "Time spent waiting for generated chunks in each generation stage.",
+           [('', {'stage': name or ''}, totals['seconds']) for name, totals in generation])
+    metric('cs4_estimated_spend_usd_total', 'counter', "Judge API spend estimated from list prices.",
+           [('', {'model': model, 'stage': stage_name or ''}, cost) for (stage_name, model), cost in summary['spend'].items()])
+    return '\n'.join(lines) + '\n'
+
+
+# Function to write the snapshot atomically, as the textfile collector may read it at any time
+def write_prometheus(path, summary):
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as file:
+        file.write(render_prometheus(summary))
+    os.replace(temporary, path)
+
+
+def _share(value, total):
+    return f"{100 * value / total:5.1f}%" if total else '    -'
+
+
+def _megabytes(value):
+    return f"{value / 2 ** 20:,.0f} MB" if value else 'n/a'
+
+
+# Function to format where a run's time and money went
+def format_summary(summary):
+    spend = sum(totals['cost_usd'] for totals in summary['models'].values())
+    wall = summary['wall_seconds']
+    lines = [f"Run {summary['run']}: {wall:.1f}s wall time, peak RSS {_megabytes(summary['peak_rss_bytes'])}, estimated judge spend ${spend:.4f}"]
+
+    if summary['stages']:
+        lines += ['', f"{'Stage':<40}{'Runs':>6}{'Seconds':>10}{'Wall':>8}{'Rows':>10}{'Rows/s':>10}"]
+        for name, totals in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+            rate = f"{totals['rows'] / totals['seconds']:,.1f}" if totals['rows'] and totals['seconds'] else '-'
+            label = name if totals['parent'] is None else f"  {name}"
+            errors = f" ({totals['errors']} failed)" if totals['errors'] else ''
+            lines.append(f"{label:<40}{totals['runs']:>6}{totals['seconds']:>10.2f}{_share(totals['seconds'], wall):>8}{totals['rows'] or '-':>10}{rate:>10}{errors}")
+
+    if summary['models']:
+        lines += ['', f"{'Judge model':<24}{'Requests':>9}{'Cached':>8}{'Errors':>8}{'Retries':>8}{'p50 s':>8}{'p95 s':>8}{'max s':>8}"
+                      f"{'Prompt tok':>12}{'Compl. tok':>12}{'Spend $':>10}{'Share':>8}"]
+        for model, totals in sorted(summary['models'].items(), key=lambda item: -item[1]['cost_usd']):
+            latencies = totals['latencies']
+            quantiles = ''.join(f"{value:>8.2f}" if value is not None else f"{'-':>8}" for value in
+                                (percentile(latencies, 0.5), percentile(latencies, 0.95), max(latencies) if latencies else None))
+            unpriced = ' (no price)' if totals['unpriced'] else ''
+            lines.append(f"{model:<24}{totals['requests']:>9}{totals['cached']:>8}{totals['errors']:>8}{totals['retries']:>8}{quantiles}"
+                         f"{totals['prompt_tokens']:>12,}{totals['completion_tokens']:>12,}{totals['cost_usd']:>10.4f}{_share(totals['cost_usd'], spend):>8}{unpriced}")
+
+    if summary['generation']:
+        lines += ['', f"{'Generation stage':<40}{'Prompts':>9}{'Seconds':>10}{'Prompt tok':>12}{'Compl. tok':>12}{'Tok/s':>10}"]
+        for name, totals in sorted(summary['generation'].items(), key=lambda item: -item[1]['seconds']):
+            rate = f"{totals['completion_tokens'] / totals['seconds']:,.1f}" if totals['completion_tokens'] and totals['seconds'] else '-'
+            lines.append(f"{name or '-':<40}{totals['prompts']:>9}{totals['seconds']:>10.2f}{totals['prompt_tokens']:>12,}{totals['completion_tokens']:>12,}{rate:>10}")
+
+    # The largest leaf stage (one without stages inside it) and the largest (stage, model) spend
+    parents = {totals['parent'] for totals in summary['stages'].values()}
+    leaves = {name: totals for name, totals in summary['stages'].items() if name not in parents}
+    if leaves:
+        name, totals = max(leaves.items(), key=lambda item: item[1]['seconds'])
+        lines += ['', f"Most time: {name} ({totals['seconds']:.1f}s, {_share(totals['seconds'], wall).strip()} of wall time)"]
+    if spend:
+        (stage_name, model), cost = max(summary['spend'].items(), key=lambda item: item[1])
+        lines.append(f"Most spend: {model} in {stage_name or 'no stage'} (${cost:.4f}, {_share(cost, spend).strip()} of spend)")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the telemetry of a run: time by stage, judge latency, tokens and estimated spend.")
+    parser.add_argument('telemetry_dir', help="Directory the run wrote its telemetry events to")
+    parser.add_argument('--run', default=None, help="Run id to summarize (default: the most recent run)")
+    parser.add_argument('--prometheus', default=None, help="Also write the run's metrics to this Prometheus textfile")
+    parser.add_argument('--json', action='store_true', help="Print the aggregated totals as JSON instead of a table")
+    args = parser.parse_args()
+
+    run_id, events = read_events(args.telemetry_dir, args.run)
+    if not events:
+        print(f"No telemetry events{f' for run {args.run}' if args.run else ''} in {args.telemetry_dir}")
+        sys.exit(1)
+    summary = summarize(events)
+    if args.prometheus:
+        write_prometheus(args.prometheus, summary)
+    if args.json:
+        summary['spend'] = [{'stage': stage_name, 'model': model, 'cost_usd': cost} for (stage_name, model), cost in summary['spend'].items()]
+        for totals in summary['models'].values():
+            latencies = totals.pop('latencies')
+            totals.update(latency_p50=percentile(latencies, 0.5), latency_p95=percentile(latencies, 0.95), latency_max=max(latencies, default=None))
+        print(json.dumps(summary, indent=2))
+    else:
+        print(format_summary(summary))
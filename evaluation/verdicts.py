@@ -0,0 +1,133 @@
+import argparse
+import os
+import re
+
+from resources import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+# Long-format constraint verdicts.
+# The judge answers every constraint on its own line ("3. Yes - <evidence>") and ends with
+# "Number of constraints satisfied: K". Each response is parsed once into rows of
+# (story_id, constraint_idx, verdict, evidence) and stored as Parquet, with story_id and verdict
+# dictionary-encoded. The per-story `satisfied` / `Percentage_GPT4` columns and error analyses
+# (which constraints each model satisfies) are then groupbys over this table instead of
+# re-running regexes over the free text.
+
+# Whitespace after the constraint number is [ \t]: a verdict without evidence must not run into the next line
+VERDICT_LINE = re.compile(r"^[\s*#]*(\d+)[ \t]*[.):][ \t]*\**[ \t]*(yes|no)\b\**[ \t]*[-–—:,.]?[ \t]*(.*?)[ \t]*$", re.IGNORECASE | re.MULTILINE)
+VERDICT_COLUMNS = ['story_id', 'constraint_idx', 'verdict', 'evidence']
+VERDICTS = ['No', 'Yes']
+
+
+# Function to return [(constraint_idx, verdict, evidence)] for the verdict lines of one response.
+# A constraint judged twice keeps its first verdict.
+def response_verdicts(response):
+    if not isinstance(response, str):
+        return []
+    matches = VERDICT_LINE.findall(response)
+    verdicts = []
+    seen = set()
+    for number, verdict, evidence in matches:
+        constraint_idx = int(number)
+        if constraint_idx not in seen:
+            seen.add(constraint_idx)
+            verdicts.append((constraint_idx, 'Yes' if verdict[0] in 'yY' else 'No', evidence))
+    return verdicts
+
+
+def story_ids_for(df):
+    return df['story_id'].tolist() if 'story_id' in df.columns else df.index.tolist()
+
+
+# Function to parse responses into the long verdict table; responses is any iterable, parsed one at a time
+def parse_responses(story_ids, responses):
+    ids, indices, verdicts, evidence = [], [], [], []
+    for story_id, response in zip(story_ids, responses):
+        rows = response_verdicts(response)
+        if rows:
+            ids.extend([story_id] * len(rows))
+            row_indices, row_verdicts, row_evidence = zip(*rows)
+            indices.extend(row_indices)
+            verdicts.extend(row_verdicts)
+            evidence.extend(row_evidence)
+
+    return pd.DataFrame({
+        'story_id': ids,
+        'constraint_idx': np.asarray(indices, dtype=np.int16),
+        'verdict': pd.Categorical(verdicts, categories=VERDICTS),
+        'evidence': evidence,
+    }, columns=VERDICT_COLUMNS)
+
+
+def write_verdicts(verdicts, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Categoricals become Arrow dictionary columns; story ids repeat once per constraint, so encode them too
+    verdicts.to_parquet(path, index=False, engine='pyarrow', use_dictionary=['story_id', 'verdict'])
+
+
+def read_verdicts(path, columns=None):
+    return pd.read_parquet(path, columns=columns, engine='pyarrow')
+
+
+def verdicts_path_for(output_path):
+    return os.path.splitext(output_path)[0] + '.verdicts.parquet'
+
+
+# Function to compute the per-story satisfaction columns.
+# Percentage_GPT4 (and `satisfied`, the name the graph scripts read) is the share of the story's
+# constraints judged "Yes"; constraints the judge skipped count as not satisfied, and stories
+# without any verdict (failed or missing responses) get NaN.
+def satisfaction(verdicts, df):
+    story_ids = pd.Index(story_ids_for(df))
+    yes = (verdicts['verdict'] == 'Yes').groupby(verdicts['story_id']).sum()
+    judged = verdicts.groupby('story_id').size()
+
+    satisfied_count = yes.reindex(story_ids, fill_value=0).to_numpy()
+    judged_count = judged.reindex(story_ids, fill_value=0).to_numpy()
+    if 'Number_of_Constraints' in df.columns:
+        total = df['Number_of_Constraints'].to_numpy()
+    else:
+        total = judged_count
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentage = np.where((total > 0) & (judged_count > 0), 100.0 * satisfied_count / total, np.nan)
+
+    return pd.DataFrame({
+        'Satisfied_Count': satisfied_count,
+        'Judged_Count': judged_count,
+        'Percentage_GPT4': percentage,
+        'satisfied': percentage,
+    }, index=df.index)
+
+
+# Function to line up the verdicts of several models: one row per (story_id, constraint_idx),
+# one 0/1 column per model (the layout used by the error analysis notebook)
+def verdict_matrix(verdicts_by_model):
+    columns = {model: (verdicts['verdict'] == 'Yes').astype(np.int8).set_axis(pd.MultiIndex.from_frame(verdicts[['story_id', 'constraint_idx']]))
+               for model, verdicts in verdicts_by_model.items()}
+    return pd.DataFrame(columns).fillna(0).astype(np.int8)
+
+
+# Function to add the verdict table and satisfaction columns for a judged DataFrame
+def add_satisfaction(df, verdicts_path, response_column='ResponseContent'):
+    verdicts = parse_responses(story_ids_for(df), df[response_column])
+    write_verdicts(verdicts, verdicts_path)
+    for column, values in satisfaction(verdicts, df).items():
+        df[column] = values
+    print(f"{len(verdicts)} constraint verdicts for {len(df)} stories written to {verdicts_path}")
+    return verdicts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse judge responses into a long-format Parquet verdict table and add satisfaction columns.")
+    parser.add_argument('--input_path', required=True, help="CSV written by constraint_satisfaction.py")
+    parser.add_argument('--output_path', default=None, help="CSV to write with the satisfaction columns (default: overwrite the input)")
+    parser.add_argument('--verdicts_path', default=None, help="Parquet file for the verdicts (default: <input>.verdicts.parquet)")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input_path)
+    add_satisfaction(df, args.verdicts_path or verdicts_path_for(args.input_path))
+    df.to_csv(args.output_path or args.input_path, index=False)
@@ -1,49 +1,249 @@
 import logging
 import argparse
+import hashlib
+import importlib
+import json
 import os
-import subprocess
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 
-# Set up logging
-logging.basicConfig(
-    filename='eval_execution.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
-def run_script(script_name, args):
-    """
-    Run a Python script with provided arguments using subprocess.
-    Logs the output and handles errors.
-    """
-    cmd = [sys.executable, script_name] + args
+# The evaluation scripts run in-process as pipeline stages instead of one subprocess each.
+# A stage declares the files it reads and writes; a stage that reads another stage's output runs
+# after it, and independent stages run in parallel on a pool of worker processes (each worker
+# imports pandas/matplotlib once). A stage is skipped when its parameters and the content of its
+# inputs match its last successful run and its outputs still exist.
+# With --telemetry_dir every stage is a telemetry stage (see evaluation/telemetry.py), in the worker it ran in.
+
+EVALUATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evaluation')
+if EVALUATION_DIR not in sys.path:
+    sys.path.insert(0, EVALUATION_DIR)
+from telemetry import add_telemetry_arguments, configure, stage as telemetry_stage
+
+
+class Stage:
+    def __init__(self, name, module, function, kwargs, inputs, outputs):
+        self.name = name
+        self.module = module
+        self.function = function
+        self.kwargs = kwargs
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+
+# Function to hash a file, or every file below a directory (by relative path and content)
+def path_digest(path):
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    for file_path in files:
+        digest.update(os.path.relpath(file_path, path).encode('utf-8') if file_path != path else b'')
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_key(stage):
+    payload = {
+        'function': f"{stage.module}.{stage.function}",
+        'params': stage.kwargs,
+        'inputs': {path: path_digest(path) for path in stage.inputs},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+# Runs in a worker process (or in the main process with one worker); returns the stage's seconds
+def run_stage(name, module, function, kwargs):
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    started = time.perf_counter()
+    with telemetry_stage(name, function=f"{module}.{function}"):
+        getattr(importlib.import_module(module), function)(**kwargs)
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+    return time.perf_counter() - started
+
+
+# Function to run a stage in this process, wrapped in a finished future like the pool's
+def run_inline(name, module, function, kwargs):
+    future = Future()
     try:
-        logging.info(f"Running {script_name} with arguments {args}")
-        result = subprocess.run(cmd, check=True)
-        print(f"Successfully ran {script_name}")
-        logging.info(f"Successfully ran {script_name}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error running {script_name}: {e}")
-        sys.exit(1)
+        future.set_result(run_stage(name, module, function, kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+class Pipeline:
+    def __init__(self, stages, state_path='.eval_pipeline_state.json', workers=None, force=False):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_path = state_path
+        self.workers = workers or min(len(stages), os.cpu_count() or 1)
+        self.force = force
+        producers = {output: stage.name for stage in stages for output in stage.outputs}
+        self.dependencies = {stage.name: {producers[path] for path in stage.inputs if path in producers} for stage in stages}
+        self.results = {}
+
+        missing = [(stage.name, path) for stage in stages for path in stage.inputs if path not in producers and not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(", ".join(f"{path} (input of {name})" for name, path in missing))
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        visited, active = set(), set()
+
+        def visit(name):
+            if name in active:
+                raise ValueError(f"Stage dependency cycle through {name}")
+            if name not in visited:
+                active.add(name)
+                for dependency in self.dependencies[name]:
+                    visit(dependency)
+                active.discard(name)
+                visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def save_state(self, state):
+        with open(self.state_path, 'w') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+
+    def up_to_date(self, stage, key, state):
+        return not self.force and state.get(stage.name) == key and all(os.path.exists(path) for path in stage.outputs)
+
+    def run(self):
+        state = self.load_state()
+        pending = dict(self.dependencies)
+        running = {}
+        started = time.perf_counter()
+
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            while pending or running:
+                for name in [name for name, dependencies in pending.items() if all(self.results.get(d, {}).get('status') in ('ran', 'skipped') for d in dependencies)]:
+                    stage = self.stages[name]
+                    del pending[name]
+                    key = stage_key(stage)
+                    if self.up_to_date(stage, key, state):
+                        self.results[name] = {'status': 'skipped', 'seconds': 0.0}
+                        logging.info(f"Skipped {name} (up to date)")
+                        continue
+                    for path in stage.outputs:
+                        directory = os.path.dirname(path)
+                        if directory:
+                            os.makedirs(directory, exist_ok=True)
+                    logging.info(f"Running {name} with arguments {stage.kwargs}")
+                    if executor is None:
+                        running[name] = (key, run_inline(name, stage.module, stage.function, stage.kwargs))
+                    else:
+                        running[name] = (key, executor.submit(run_stage, name, stage.module, stage.function, stage.kwargs))
+
+                # Stages whose dependencies failed can never run
+                for name in [name for name, dependencies in pending.items() if any(self.results.get(d, {}).get('status') in ('failed', 'blocked') for d in dependencies)]:
+                    del pending[name]
+                    self.results[name] = {'status': 'blocked', 'seconds': 0.0}
+                    logging.error(f"Not running {name}: an input stage failed")
+
+                if not running:
+                    continue
+                done, _ = wait([future for _, future in running.values()], return_when=FIRST_COMPLETED)
+                for name in [name for name, (_, future) in running.items() if future in done]:
+                    key, future = running.pop(name)
+                    try:
+                        self.results[name] = {'status': 'ran', 'seconds': future.result()}
+                        state[name] = key
+                        self.save_state(state)
+                        print(f"Successfully ran {name}")
+                        logging.info(f"Successfully ran {name}")
+                    except Exception as e:
+                        self.results[name] = {'status': 'failed', 'seconds': 0.0}
+                        state.pop(name, None)
+                        self.save_state(state)
+                        print(f"Error running {name}: {e}")
+                        logging.error(f"Error running {name}: {e}")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self.wall_time = time.perf_counter() - started
+        return self.results
+
+    def summary(self):
+        lines = [f"{'Stage':<32}{'Status':<10}{'Seconds':>10}"]
+        for name in self.stages:
+            result = self.results.get(name, {'status': 'not run', 'seconds': 0.0})
+            lines.append(f"{name:<32}{result['status']:<10}{result['seconds']:>10.2f}")
+        lines.append(f"{'total (wall time)':<42}{self.wall_time:>10.2f}")
+        return '\n'.join(lines)
+
+    def failed(self):
+        return any(result['status'] in ('failed', 'blocked') for result in self.results.values())
+
+
+# Function to declare the stages for the given arguments; stages whose arguments are missing are left out
+def build_stages(args):
+    stages = []
+    models = [(args.label1, args.model1_path), (args.label2, args.model2_path), (args.label3, args.model3_path)]
+    have_models = all(path for _, path in models)
+
+    # The model CSVs are read once into the results store
+    if have_models:
+        stages.append(Stage('results_store', 'results_store', 'ingest',
+                            {'store_dir': args.store, 'sources': [list(model) for model in models], 'direction': args.direction},
+                            [path for _, path in models], [args.store]))
+
+    # One aggregation pass over the store gives the small table every graph is drawn from
+    aggregates = args.store.rstrip('/\\') + '.aggregates.parquet'
+    if have_models:
+        stages.append(Stage('aggregates', 'aggregation', 'write_aggregates', {'store': args.store, 'output_path': aggregates},
+                            [args.store], [aggregates]))
+    plot_options = {'aggregates': aggregates, 'models': [label for label, _ in models], 'direction': args.direction}
+
+    if have_models and args.output_file_path_cons_satisf_graph:
+        stages.append(Stage('constraint_satisfaction_graph', 'aggregation', 'render',
+                            {'plot': 'constraint_satisfaction_graph_generation.plot_constraint_satisfaction', **plot_options,
+                             'output_file_path': args.output_file_path_cons_satisf_graph},
+                            [aggregates], [args.output_file_path_cons_satisf_graph]))
+
+    if args.input_path_diversity_calc and args.output_path_diversity_calc:
+        stages.append(Stage('diversity_calculation', 'diversity_calculation', 'main',
+                            {'input_path': args.input_path_diversity_calc, 'output_path': args.output_path_diversity_calc},
+                            [args.input_path_diversity_calc], [args.output_path_diversity_calc]))
+
+    if have_models and args.output_path_diversity_graphs:
+        stages.append(Stage('diversity_graphs', 'aggregation', 'render',
+                            {'plot': 'diversity_graphs.main', **plot_options, 'output_path': args.output_path_diversity_graphs},
+                            [aggregates], [args.output_path_diversity_graphs]))
+
+    if have_models and args.output_path_perp_graphs:
+        stages.append(Stage('perplexity_graphs', 'aggregation', 'render',
+                            {'plot': 'perplexity_graphs.plot_average_perplexity', **plot_options, 'output_path': args.output_path_perp_graphs},
+                            [aggregates], [args.output_path_perp_graphs]))
+
+    # QUC/RCS table with bootstrap intervals over the stories of the store, and the QUC plots
+    if have_models and args.output_dir_quc_and_rcs and not args.input_json_quc_and_rcs:
+        quc_table = os.path.join(args.output_dir_quc_and_rcs, 'quc_rcs.csv')
+        stages.append(Stage('quc_and_rcs', 'quc_and_rcs', 'write_store_quc',
+                            {'store': args.store, 'aggregates': aggregates, 'output_dir': args.output_dir_quc_and_rcs,
+                             'models': plot_options['models'], 'direction': args.direction},
+                            [args.store, aggregates], [quc_table]))
+
+    # constraint_satisfaction.py (judge API calls), coherence_vs_constraint_graph.py, quc_and_rcs.py from a
+    # grouped results JSON and story_quality_eval.py are still run on their own
+    return stages
+
 
 if __name__ == "__main__":
     # Set up argparse to accept all input files and necessary arguments for each script
     parser = argparse.ArgumentParser(description="Run all evaluation scripts with required inputs.")
-    
-    # # General input and output directories
-    # parser.add_argument('--input_dir', type=str, required=True, help="Directory containing input files.")
-    # parser.add_argument('--output_dir_path', type=str, required=True, help="Directory to save output files.")
-    
-    # # Specific input files for each script
-    # parser.add_argument('--coherence_csv', type=str, required=True, help="CSV file for coherence_vs_constraint_graph.py")
-    # parser.add_argument('--model1_path', type=str, required=True, help="CSV file of Model 1 for multiple scripts (constraint_satisfaction, etc.)")
-    # parser.add_argument('--model2_path', type=str, required=True, help="CSV file of Model 2 for multiple scripts (constraint_satisfaction, etc.)")
-    # parser.add_argument('--model3_path', type=str, required=True, help="CSV file of Model 3 for multiple scripts (constraint_satisfaction, etc.)")
-    # parser.add_argument('--label1', default="Gemma-7B Instruct", help="Label for the first model (default: Gemma-7B Instruct)")
-    # parser.add_argument('--label2', default="Llama-2-7B Chat", help="Label for the second model (default: Llama-2-7B Chat)")
-    # parser.add_argument('--label3', default="Mistral-7B Instruct", help="Label for the third model (default: Mistral-7B Instruct)")
-    # parser.add_argument('--quc_input_json', type=str, required=True, help="JSON file for quc_and_rcs.py")
-    # parser.add_argument('--story_quality_input', type=str, required=True, help="CSV file for story_quality_eval.py")
 
     # Model Outputs
     parser.add_argument('--model1_path', type=str, required=False, help="CSV file of Model 1 outputs for multiple scripts (constraint_satisfaction, etc.)")
@@ -74,89 +274,46 @@ if __name__ == "__main__":
     # coherence_vs_constraint_graph.py
     parser.add_argument("--input_path_coh_vs_cons_graph", nargs='+', required=False, help="List of CSV files for each model (format: model_name file_path).")
     parser.add_argument("--output_path_coh_vs_cons_graph", required=False, help="Directory to save the output plot.")
-    
+
     # quc_and_rcs.py
     parser.add_argument("--input_json_quc_and_rcs", required=False, help="Path to input JSON file containing grouped results.")
     parser.add_argument("--output_dir_quc_and_rcs", required=False, help="Directory to save the output plots.")
-    
+
+    # Pipeline
+    parser.add_argument('--store', default='output_files/results_store', help="Directory of the Parquet results store the graphs read from")
+    parser.add_argument('--direction', default='default', help="Direction (dataset variant) the model results are stored under")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for independent stages (1: run every stage in this process)")
+    parser.add_argument('--state_path', default='.eval_pipeline_state.json', help="File recording the inputs of each stage's last successful run")
+    parser.add_argument('--force', action='store_true', help="Run every stage even if it is up to date")
+    add_telemetry_arguments(parser)
+
     # Parse arguments
     args = parser.parse_args()
 
-    # Paths to the scripts
-    script_paths = {
-        "coherence_vs_constraint_graph.py": "Evaluation/coherence_vs_constraint_graph.py",
-        "constraint_satisfaction_graph_generation.py": "Evaluation/constraint_satisfaction_graph_generation.py",
-        "constraint_satisfaction.py": "Evaluation/constraint_satisfaction.py",
-        "diversity_calculation.py": "Evaluation/diversity_calculation.py",
-        "diversity_graphs.py": "Evaluation/diversity_graphs.py",
-        "perplexity_graphs.py": "Evaluation/perplexity_graphs.py",
-        "quc_and_rcs.py": "Evaluation/quc_and_rcs.py",
-        "story_quality_eval.py": "Evaluation/story_quality_eval.py"
-    }
+    # Set up logging
+    logging.basicConfig(
+        filename='eval_execution.log',
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    configure(args.telemetry_dir)
 
-    # Ensure all scripts exist before execution
-    for script_name, script_path in script_paths.items():
-        if not os.path.isfile(script_path):
-            print(f"Script {script_name} not found at {script_path}")
-            sys.exit(1)
-
-    # Run each script with its respective arguments
-    
-    # # coherence_vs_constraint_graph.py
-    # run_script(script_paths["coherence_vs_constraint_graph.py"], [
-    #     '--input_csv', args.input_path_coh_vs_cons_graph, 
-    #     '--output_dir', args.output_path_coh_vs_cons_graph,
-    # ])
-    
-    # constraint_satisfaction_graph_generation.py
-    run_script(script_paths["constraint_satisfaction_graph_generation.py"], [
-        '--file1', args.model1_path,
-        '--file2', args.model2_path,
-        '--file3', args.model3_path,
-        '--output_file_path', args.output_file_path_cons_satisf_graph
-    ])
-    
-    # constraint_satisfaction.py
-    # run_script(script_paths["constraint_satisfaction.py"], [
-    #     '--input_path', args.input_file_path_cons_satisf,
-    #     '--output_path', args.output_file_path_cons_satisf
-    # ])
-    
-    # diversity_calculation.py
-    run_script(script_paths["diversity_calculation.py"], [
-        '--input_path', args.input_path_diversity_calc,
-        '--output_path', args.output_path_diversity_calc
-    ])
-    
-    # diversity_graphs.py
-    run_script(script_paths["diversity_graphs.py"], [
-        '--file1', args.model1_path,
-        '--file2', args.model2_path,
-        '--file3', args.model3_path,
-        '--output_path', args.output_path_diversity_graphs
-    ])
-    
-    # perplexity_graph_generation.py
-    run_script(script_paths["perplexity_graphs.py"], [
-        '--file1', args.model1_path,
-        '--file2', args.model2_path,
-        '--file3', args.model3_path,
-        '--output_path', args.output_path_perp_graphs
-    ])
-    
-    # # quc_and_rcs.py
-    # run_script(script_paths["quc_and_rcs.py"], [
-    #     '--input_json', args.input_json_quc_and_rcs,
-    #     '--output_dir', args.output_dir_quc_and_rcs
-    # ])
-    
-    # # story_quality_eval.py
-    # run_script(script_paths["story_quality_eval.py"], [
-    #     '--api_key', args.api_key,
-    #     '--input_file', args.story_quality_input,
-    #     '--output_dir', args.output_dir,
-    #     '--max_trials', '35'  # Default value used here
-    # ])
+    stages = build_stages(args)
+    if not stages:
+        parser.error("No stage has all of its arguments; pass the model paths and output paths to run")
+    try:
+        pipeline = Pipeline(stages, state_path=args.state_path, workers=args.workers, force=args.force)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Cannot run the pipeline: {e}")
+        logging.error(f"Cannot run the pipeline: {e}")
+        sys.exit(1)
+
+    with telemetry_stage('pipeline'):
+        pipeline.run()
+    print(pipeline.summary())
+    logging.info("Stage timings:\n" + pipeline.summary())
+    if pipeline.failed():
+        sys.exit(1)
 
     print("All evaluation scripts have been successfully executed.")
     logging.info("All evaluation scripts have been successfully executed.")
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# The scripts import their siblings by module name (they are run from their own directory), so the
+# tests put both script directories on the path the same way benchmarks/import_time.py does (and the root,
+# for run_all_evals.py).
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ('', 'evaluation', 'code_files', 'benchmarks'):
+    if os.path.join(ROOT, directory) not in sys.path:
+        sys.path.insert(0, os.path.join(ROOT, directory))
+
+NUM_CONSTRAINTS = [7, 15, 23, 31, 39]
+
+
+# A small constraints file in the layout storygen reads: every instruction with the first k of its
+# 39 constraints for each constraint count. Base stories differ in length so orderings are exercised.
+@pytest.fixture
+def constraint_rows():
+    rows = []
+    for i in range(5):
+        lines = [f"{j + 1}. The story should mention the lantern number {i}-{j}." for j in range(max(NUM_CONSTRAINTS))]
+        base_story = f"Keeper {i} lit the lamp." + " The storm came closer." * (3 * i + 1)
+        for k in NUM_CONSTRAINTS:
+            rows.append({'Instruction': f"Write a story in less than 500 words about lighthouse {i}", 'Constraints': '\n'.join(lines),
+                         'BaseStory': base_story, 'Direction': 'direction2', 'SelectedConstraints': '\n'.join(lines[:k]),
+                         'Number_of_Constraints': k})
+    return pd.DataFrame(rows)
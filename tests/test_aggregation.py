@@ -0,0 +1,66 @@
+import os
+
+import pandas as pd
+import pytest
+
+import aggregation
+from aggregation import load_aggregates, source_fingerprint
+from results_store import write_results
+
+
+def results(seed):
+    return pd.DataFrame({'Number_of_Constraints': [7, 7, 15, 15], 'satisfied': [seed, 1.0, 0.5, 0.0],
+                         'Percentage_GPT4': [100, 50, 40, 20], 'coherence_score': [4, 2, 3, 3], 'FinalGeneratedStory': ['s'] * 4})
+
+
+@pytest.fixture
+def sources(tmp_path):
+    paths = []
+    for seed, model in enumerate(['a', 'b']):
+        path = tmp_path / f'{model}.csv'
+        results(seed).to_csv(path, index=False)
+        paths.append((model, str(path)))
+    return paths
+
+
+def fail_aggregate(df):
+    raise AssertionError("the cached table should have been used")
+
+
+def test_aggregate_statistics(sources):
+    table = load_aggregates(sources, cache_path=os.path.join(os.path.dirname(sources[0][1]), 'aggregates.parquet'))
+    row = table[(table['model'] == 'a') & (table['Number_of_Constraints'] == 7)].iloc[0]
+    assert row['stories'] == 2 and row['satisfied'] == 0.5 and row['average_percentage_gpt4'] == 75
+    assert row['normalized_coherence_score'] == 1.0
+
+
+def test_csv_sources_are_cached_until_a_file_changes(sources, tmp_path, monkeypatch):
+    monkeypatch.setattr(aggregation, 'CACHE_DIR', str(tmp_path / 'cache'))
+    first = load_aggregates(sources)
+    assert os.listdir(tmp_path / 'cache' / 'aggregates')
+
+    with monkeypatch.context() as patched:
+        patched.setattr(aggregation, 'aggregate', fail_aggregate)
+        pd.testing.assert_frame_equal(load_aggregates(sources), first)
+
+    results(5).to_csv(sources[0][1], index=False)
+    os.utime(sources[0][1], ns=(0, 0))
+    assert load_aggregates(sources)['satisfied'].max() == 3
+
+
+def test_store_models_are_read_as_partitions(sources, tmp_path, monkeypatch):
+    store = str(tmp_path / 'store')
+    for model, path in sources:
+        write_results(pd.read_csv(path), store, model)
+
+    selected = load_aggregates(store=store, models=['a'])
+    assert set(selected['model']) == {'a'}
+    assert os.path.exists(aggregation.default_cache_path(store, models=['a']))
+    assert set(load_aggregates(store=store)['model']) == {'a', 'b'}
+
+    # Rewriting another model leaves the fingerprint (and the cached table) of the selection unchanged
+    fingerprint = source_fingerprint(store=store, models=['a'])
+    write_results(results(3), store, 'b')
+    assert source_fingerprint(store=store, models=['a']) == fingerprint
+    monkeypatch.setattr(aggregation, 'aggregate', fail_aggregate)
+    pd.testing.assert_frame_equal(load_aggregates(store=store, models=['a']), selected)
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+from backends import GenerationBackend, ModelPool, StubBackend, VLLMBackend, generate_batched, iter_generate_batched, load_model_specs, stub_story
+
+PROMPTS = ['short', 'a much longer prompt than the others', 'medium prompt', 'x']
+
+
+@pytest.mark.parametrize('order', ['input', 'longest_first', 'shortest_first'])
+@pytest.mark.parametrize('chunk_size', [None, 1, 3])
+def test_batched_generation_keeps_prompt_order(order, chunk_size):
+    backend = StubBackend()
+    assert generate_batched(backend, PROMPTS, chunk_size, order) == [stub_story(prompt) for prompt in PROMPTS]
+    assert backend.prompts_seen == len(PROMPTS)
+    assert backend.calls == (1 if chunk_size is None else -(-len(PROMPTS) // chunk_size))
+
+
+def test_longest_first_submits_long_prompts_first():
+    chunks = [chunk for chunk, _ in iter_generate_batched(StubBackend(), PROMPTS, chunk_size=2, order='longest_first')]
+    assert chunks == [[1, 2], [0, 3]]
+
+
+def test_backend_returning_too_few_outputs_is_an_error():
+    class Short(GenerationBackend):
+        def generate(self, prompts, budgets=None):
+            return prompts[:-1]
+
+    with pytest.raises(RuntimeError):
+        list(iter_generate_batched(Short(), PROMPTS))
+
+
+def test_pool_closes_evicted_models():
+    pool = ModelPool(fake=True)
+    first_spec, second_spec = load_model_specs(cli_models=['model-a:vllm', 'model-b:hf'])
+    first = pool.get(first_spec)
+    assert pool.get(first_spec) is first and pool.hits == 1
+    second = pool.get(second_spec)
+    # Without a memory budget only one model stays loaded
+    assert first.closed and not second.closed
+    pool.close()
+    assert second.closed and (pool.loads, pool.evictions) == (2, 2)
+
+
+def test_vllm_backend_close_drops_the_engine():
+    backend = VLLMBackend(SimpleNamespace(), SimpleNamespace(max_tokens=16))
+    backend.close()
+    assert backend.llm is None
+
+
+def test_every_backend_can_be_closed():
+    # ModelPool.evict relies on close() being part of the interface
+    StubBackend().close()
+    GenerationBackend().close()
@@ -0,0 +1,56 @@
+import json
+
+import pandas as pd
+
+import constraint_satisfaction
+from batch_io import export_batch, join_results, make_custom_id, parse_custom_id, read_batch_results, run_fake_batch
+from stub_openai_server import judge_answer
+
+BODY = {'model': 'gpt-4-turbo', 'messages': [{'role': 'user', 'content': 'Constraints:\n1. a\n2. b'}]}
+
+
+def test_custom_ids_carry_the_row_and_a_hash_of_the_request():
+    custom_id = make_custom_id('cs', [12], BODY)
+    prefix, parts, digest = parse_custom_id(custom_id)
+    assert (prefix, parts) == ('cs', ['12'])
+    assert make_custom_id('cs', [12], dict(BODY, model='gpt-4o')) != custom_id
+
+
+def test_export_splits_files_by_request_count(tmp_path):
+    requests = [(make_custom_id('cs', [index], BODY), BODY) for index in range(5)]
+    paths = export_batch(requests, str(tmp_path / 'batch'), max_requests=2)
+    assert len(paths) == 3
+    assert [json.loads(line)['custom_id'] for path in paths for line in open(path)] == [custom_id for custom_id, _ in requests]
+
+
+def test_failed_missing_and_stale_results_are_reported(tmp_path):
+    requests = [(index, make_custom_id('cs', [index], BODY)) for index in range(20)]
+    paths = export_batch([(custom_id, BODY) for _, custom_id in requests], str(tmp_path / 'batch'))
+    run_fake_batch(paths, str(tmp_path / 'results.jsonl'), judge_answer, failure_rate=0.2, drop_rate=0.2, seed=1)
+    joined = join_results(requests, read_batch_results([str(tmp_path / 'results.jsonl')]))
+    assert set(joined) == set(range(20))
+    assert {error for content, error in joined.values() if content is None} == {'fake batch failure', 'missing from batch results'}
+    assert all(content == judge_answer(BODY['messages'][0]['content']) for content, _ in joined.values() if content is not None)
+
+    changed = [(index, make_custom_id('cs', [index], dict(BODY, model='gpt-4o'))) for index, _ in requests]
+    stale = join_results(changed, read_batch_results([str(tmp_path / 'results.jsonl')]))
+    assert {error for _, error in stale.values()} <= {'stale result: the request changed since export', 'missing from batch results'}
+
+
+def test_constraint_satisfaction_export_and_import(constraint_rows, tmp_path, monkeypatch):
+    # The offline batch modes send no request and need no API key
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    stories = tmp_path / 'stories.csv'
+    rows = constraint_rows.head(10)
+    rows.assign(FinalGeneratedStory=rows['BaseStory'], FinalPrompt=rows['Instruction']).to_csv(stories, index=False)
+    output = str(tmp_path / 'judged.csv')
+    constraint_satisfaction.main(str(stories), output, export_batch=str(tmp_path / 'batch'), rule_checks=False)
+    inputs = sorted(str(path) for path in tmp_path.glob('batch-*.jsonl'))
+    run_fake_batch(inputs, str(tmp_path / 'results.jsonl'), judge_answer, failure_rate=0.3, seed=2)
+
+    constraint_satisfaction.main(str(stories), output, import_batch=[str(tmp_path / 'results.jsonl')], rule_checks=False)
+    judged = pd.read_csv(output)
+    failed = judged['batch_error'].notna()
+    assert failed.any() and not failed.all()
+    assert judged.loc[failed, 'Percentage_GPT4'].isna().all()
+    assert judged.loc[~failed, 'Percentage_GPT4'].notna().all()
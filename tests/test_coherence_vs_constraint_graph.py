@@ -0,0 +1,13 @@
+import pandas as pd
+
+from coherence_vs_constraint_graph import Quc_9VsRcs_7_39, calculate_quc_and_rcs
+
+
+def test_quc_39_and_rcs_7_39_table():
+    grouped = {model: pd.DataFrame({'normalized_coherence_score': [0.9, 0.5], 'average_percentage_gpt4': [80.0, 40.0]}, index=['7', '39'])
+               for model in ('gemma', 'llama')}
+    table = Quc_9VsRcs_7_39(*calculate_quc_and_rcs(grouped))
+    assert list(table.columns) == ['Model', 'QUC_39', 'RCS_7-39']
+    assert list(table['Model']) == ['gemma', 'llama']
+    assert table['QUC_39'].tolist() == [20.0, 20.0]
+    assert table['RCS_7-39'].tolist() == [52.0, 52.0]
@@ -0,0 +1,56 @@
+import pytest
+
+from constraint_rules import PreCheck, check_constraint, count_words
+from verdicts import response_verdicts
+
+STORY = "The tide came in early. " + "Waves " * 40 + "And then the lamp went dark."
+CONSTRAINTS = """1. Start the story with the sentence: "The tide came in early."
+2. The lighthouse keeper must have a secret.
+3. Write a story in less than 100 words.
+4. End the story with the sentence: "The sun rose."
+5. Include a storm."""
+
+
+@pytest.mark.parametrize('constraint, satisfied', [
+    ("Write a story in less than 100 words.", True),
+    ("Write a story in at least 100 words.", False),
+    ("Write a story in about 50 words.", True),
+    ('Begin the story with the line “The tide came in early”', True),
+    ('End the story with the sentence: "And then the lamp went dark."', True),
+    ('End the story with the words "the sun rose"', False),
+])
+def test_mechanical_constraints_are_decided_by_rule(constraint, satisfied):
+    assert check_constraint(STORY, constraint)[0] == satisfied
+
+
+@pytest.mark.parametrize('constraint', [
+    "Write a story in less than 100 words and include a dialogue.",
+    "The story must have a twist ending.",
+    "Each paragraph should be under 50 words.",
+])
+def test_other_constraints_are_left_to_the_judge(constraint):
+    assert check_constraint(STORY, constraint) is None
+
+
+def test_precheck_renumbers_for_the_judge_and_merges_back():
+    check = PreCheck(STORY, CONSTRAINTS)
+    assert count_words(STORY) == 51 and check.offloaded == 3
+    assert check.judge_text() == "1. The lighthouse keeper must have a secret.\n2. Include a storm."
+    merged = check.merge("1. No - no secret is mentioned.\n2. Yes - a storm hits.\nNumber of constraints satisfied: 1")
+    assert [(number, verdict) for number, verdict, _ in response_verdicts(merged)] == [(1, 'Yes'), (2, 'No'), (3, 'Yes'), (4, 'No'), (5, 'Yes')]
+    assert merged.endswith("Number of constraints satisfied: 3")
+
+
+def test_failed_judge_call_is_not_scored_on_rules_alone():
+    assert PreCheck(STORY, CONSTRAINTS).merge(None) is None
+
+
+def test_story_decided_by_rules_needs_no_judge():
+    check = PreCheck(STORY, "1. Write a story in less than 100 words.")
+    assert not check.needs_judge
+    assert check.merge(None).endswith("Number of constraints satisfied: 1")
+
+
+def test_unnumbered_constraints_go_to_the_judge_unchanged():
+    check = PreCheck(STORY, "Include a storm.")
+    assert check.needs_judge and check.merge("Yes") == "Yes"
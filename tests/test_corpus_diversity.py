@@ -0,0 +1,81 @@
+import random
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from corpus_diversity import (MERSENNE_PRIME, SHINGLE_ORDER, StorySketch, Vocabulary, corpus_diversity, make_permutations,
+                              mulmod_mersenne61, ngram_hashes, signature_similarity)
+from lexical_features import preprocess_text, tokenize
+
+WORDS = [f"w{i}" for i in range(400)]
+
+
+def exact_jaccard(first, second):
+    shingles = [set(zip(*(tokens[offset:] for offset in range(SHINGLE_ORDER)))) for tokens in
+                (tokenize(preprocess_text(first)), tokenize(preprocess_text(second)))]
+    return len(shingles[0] & shingles[1]) / len(shingles[0] | shingles[1])
+
+
+# Stories that share a prefix of `shared` words with a base story, so their Jaccard similarity spans 0..1
+def synthetic_stories(count=12, length=200, seed=0):
+    rng = random.Random(seed)
+    base = [rng.choice(WORDS) for _ in range(length)]
+    stories = []
+    for position in range(count):
+        shared = int(length * position / (count - 1))
+        stories.append(' '.join(base[:shared] + [rng.choice(WORDS) for _ in range(length - shared)]))
+    return stories
+
+
+def test_mulmod_matches_python_integers():
+    rng = random.Random(1)
+    a = [rng.randrange(1, MERSENNE_PRIME) for _ in range(500)]
+    x = [rng.randrange(0, MERSENNE_PRIME) for _ in range(500)] + [MERSENNE_PRIME - 1]
+    a.append(MERSENNE_PRIME - 1)
+    result = mulmod_mersenne61(np.array(a, dtype=np.uint64), np.array(x, dtype=np.uint64))
+    assert [int(value) for value in result] == [first * second % MERSENNE_PRIME for first, second in zip(a, x)]
+
+
+def test_ngram_hashes_match_exact_ngram_identity():
+    ids = Vocabulary().encode('a b c a b c a b'.split())
+    hashes = ngram_hashes(ids, 3)
+    assert len(hashes) == 6
+    # "a b c" occurs twice and "b c a" twice; equal n-grams hash equally, different ones do not
+    assert hashes[0] == hashes[3] and hashes[1] == hashes[4]
+    assert len(set(hashes.tolist())) == 3
+
+
+def test_sketch_jaccard_tracks_exact_jaccard():
+    stories = synthetic_stories()
+    vocabulary, permutations = Vocabulary(), make_permutations(256)
+    sketches = [StorySketch(story, vocabulary, permutations) for story in stories]
+    errors = [abs(signature_similarity(sketches[i].signature, sketches[j].signature) - exact_jaccard(stories[i], stories[j]))
+              for i, j in combinations(range(len(stories)), 2)]
+    # The standard error of a 256-permutation estimate is at most 0.5 / 16
+    assert max(errors) < 0.15
+    assert np.mean(errors) < 0.03
+
+
+def test_unrelated_stories_are_not_near_duplicates():
+    rng = random.Random(2)
+    stories = [' '.join(rng.choice(WORDS) for _ in range(150)) for _ in range(20)]
+    frame = pd.DataFrame({'Model': 'm', 'Number_of_Constraints': 7, 'Story': stories})
+    sketched = corpus_diversity(frame).iloc[0]
+    assert sketched['near_duplicate_pairs'] == 0
+    assert sketched['minhash_similarity'] < 0.05
+
+
+@pytest.mark.parametrize('threshold', [0.5, 0.8])
+def test_sketch_clusters_agree_with_exact(threshold):
+    stories = synthetic_stories(count=10, length=300, seed=3)
+    frame = pd.DataFrame({'Model': 'm', 'Number_of_Constraints': 7, 'Story': stories})
+    exact = corpus_diversity(frame, exact=True, threshold=threshold).iloc[0]
+    sketched = corpus_diversity(frame, threshold=threshold, num_perm=256).iloc[0]
+    assert abs(sketched['minhash_similarity'] - exact['minhash_similarity']) < 0.03
+    # Pairs within sampling noise of the threshold may go either way
+    assert abs(sketched['near_duplicate_pairs'] - exact['near_duplicate_pairs']) <= 2
+    assert sketched['self_bleu'] == pytest.approx(exact['self_bleu'])
+    for n in (1, 2, 3, 4):
+        assert sketched[f'distinct_{n}'] == pytest.approx(exact[f'distinct_{n}'])
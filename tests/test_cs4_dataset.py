@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from cs4_dataset import DATASET_DIR, DATASET_FILES, ConstraintIndex, read_rows
+
+CSV = ("﻿Instruction Number,Instruction ,Number of Constraints,Constraints\n"
+       '1,Write about a lighthouse.,2,"1. Set it at night.\n2. Use a storm."\n'
+       '1,Write about a lighthouse.,3,"1. Set it at night.\n2. Use a storm.\n3. End at dawn."\n'
+       '2,Write about a garden.,2,"1. Use no names.\nStylistic Constraints:\n2. Write in the present tense."\n'
+       '2,Write about a garden.,1,"1. Start with rain."\n')
+
+
+def load(tmp_path, text=CSV):
+    path = tmp_path / 'constraints.csv'
+    path.write_text(text, encoding='utf-8')
+    return ConstraintIndex.load(str(path), str(tmp_path / 'constraints.idx'))
+
+
+def test_first_k_constraints(tmp_path):
+    index = load(tmp_path)
+    assert index.instruction_numbers() == [1, 2]
+    assert index.instruction(1) == 'Write about a lighthouse.'
+    assert index.selected_constraints(1, 2) == '1. Set it at night.\n2. Use a storm.'
+    assert index.constraints(1) == ['Set it at night.', 'Use a storm.', 'End at dawn.']
+    assert index.selected_constraints(2) == '1. Use no names.\n2. Write in the present tense.'
+    assert index.selected_constraints(1, 0) == ''
+    with pytest.raises(ValueError):
+        index.constraints(1, 4)
+
+
+def test_rows_that_are_not_prefixes_keep_their_own_lines(tmp_path):
+    index = load(tmp_path)
+    assert index.constraint_set(2, 1) == ['Start with rain.']
+    assert index.constraint_set(1, 3) == index.constraints(1)
+    with pytest.raises(KeyError):
+        index.constraint_set(1, 7)
+
+
+def test_index_is_rebuilt_when_the_csv_changes(tmp_path):
+    first = load(tmp_path)
+    assert load(tmp_path).source_sha256 == first.source_sha256
+    changed = load(tmp_path, CSV.replace('Use a storm.', 'Use fog.'))
+    assert changed.source_sha256 != first.source_sha256
+    assert changed.constraints(1, 2) == ['Set it at night.', 'Use fog.']
+
+
+@pytest.mark.parametrize('name', sorted(DATASET_FILES))
+def test_index_matches_the_dataset_csv(tmp_path, name):
+    csv_path = os.path.join(DATASET_DIR, DATASET_FILES[name])
+    index = ConstraintIndex.load(csv_path, str(tmp_path / f'{name}.idx'))
+    for number, instruction, label, constraints in read_rows(csv_path):
+        assert index.instruction(number) == instruction
+        assert index.constraint_set(number, label) == constraints
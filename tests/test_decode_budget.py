@@ -0,0 +1,59 @@
+import pytest
+
+from decode_budget import MIN_BUDGET_TOKENS, budget_report, decode_budget, minimum_words, should_stop, word_limit
+from storygen import budget_text
+
+
+@pytest.mark.parametrize('text, limit', [
+    ("Write a story in less than 377 words.\nwithin 500 words", 377),
+    ("Keep it to approximately 1,200 words", 1200),
+    ("in a maximum of 90 words", 90),
+    ("within a maximum of 90 words", 90),
+    ("Use 300 words of dialogue", None),
+])
+def test_story_word_limit(text, limit):
+    assert word_limit(text) == limit
+
+
+def test_constraint_word_counts_do_not_set_the_story_budget():
+    row = {'Instruction': "Write a story in less than 500 words about a lighthouse keeper",
+           'SelectedConstraints': "1. Begin with a title in 5 words.\n2. End within 20 words of the storm."}
+    budget = decode_budget(budget_text(row), 2000, constraints=row['SelectedConstraints'])
+    assert budget['word_limit'] == 500
+    assert decode_budget(budget_text({**row, 'Instruction': "Write a story"}), 2000)['word_limit'] == 500
+
+
+@pytest.mark.parametrize('constraints, minimum', [
+    ("1. The story must be at least 700 words long.", 700),
+    ("1. Write no more than 300 words.\n2. Use more than 40 words of dialogue.", 40),
+    ("1. Begin with a title in 5 words.", None),
+])
+def test_minimum_length_constraints(constraints, minimum):
+    assert minimum_words(constraints) == minimum
+
+
+def test_minimum_length_at_or_above_the_limit_gets_no_budget():
+    assert decode_budget("within 500 words", 2000, constraints="1. Make it at least 700 words.") is None
+    assert decode_budget("within 500 words", 2000, constraints="1. Make it at least 500 words.") is None
+    assert decode_budget("within 500 words", 2000, constraints="1. Open with at least 50 words of dialogue.")['word_limit'] == 500
+
+
+def test_budget_adds_the_margin_and_respects_the_caps():
+    assert decode_budget("within 500 words", max_tokens=2000) == {'word_limit': 500, 'max_words': 600, 'max_tokens': 840}
+    assert decode_budget("within 500 words", max_tokens=700)['max_tokens'] == 700
+    assert decode_budget("within 10 words", max_tokens=2000)['max_tokens'] == MIN_BUDGET_TOKENS
+    assert decode_budget("no limit here", max_tokens=2000) is None
+
+
+def test_generation_stops_at_the_first_sentence_end_after_the_limit():
+    budget = {'word_limit': 5, 'max_words': 8}
+    assert not should_stop("One two three. Four", budget)
+    assert not should_stop("One two three. Four five six", budget)
+    assert should_stop("One two three four five.", budget)
+    assert should_stop("One two three. Four five six seven.", budget)
+    assert should_stop("one two three four five six seven eight", budget)
+
+
+def test_budget_report_counts_saved_tokens():
+    budgets = [decode_budget("within 100 words", 1000), None]
+    assert budget_report(budgets, 1000).endswith("(832 saved)")
@@ -0,0 +1,57 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from backends import HFBackend
+
+
+class CharTokenizer:
+    """One token per character; token 0 is padding."""
+    pad_token_id = 0
+    eos_token = '\0'
+
+    def apply_chat_template(self, chat, tokenize=False, add_generation_prompt=True):
+        return f"<user>{chat[0]['content']}<assistant>"
+
+    def encode(self, text, add_special_tokens=False):
+        return [ord(character) for character in text]
+
+    def decode(self, tokens, skip_special_tokens=True):
+        return ''.join(chr(token) for token in tokens if token or not skip_special_tokens)
+
+    def batch_decode(self, sequences, skip_special_tokens=True):
+        return [self.decode(sequence.tolist(), skip_special_tokens) for sequence in sequences]
+
+
+class EchoModel:
+    """Appends '!' max_new_tokens times and records the batches it was given."""
+    device = 'cpu'
+
+    def __init__(self):
+        self.batches = []
+
+    def generate(self, input_ids, attention_mask, max_new_tokens, **kwargs):
+        self.batches.append((input_ids.shape, int(attention_mask.sum())))
+        return torch.cat([input_ids, torch.full((input_ids.shape[0], max_new_tokens), ord('!'))], dim=1)
+
+
+PROMPTS = ['a' * 30, 'b', 'c' * 10, 'd' * 3, 'e' * 60, 'f' * 5]
+
+
+def test_plan_batches_sorts_by_length_under_the_token_budget():
+    backend = HFBackend(EchoModel(), CharTokenizer(), max_tokens=10, max_tokens_per_batch=100)
+    batches = backend.plan_batches([[1] * len(prompt) for prompt in PROMPTS])
+    assert sorted(position for batch in batches for position in batch) == list(range(len(PROMPTS)))
+    assert [len(PROMPTS[batch[0]]) for batch in batches] == sorted(len(PROMPTS[batch[0]]) for batch in batches)
+    for batch in batches:
+        assert len(batch) == 1 or len(batch) * (max(len(PROMPTS[i]) for i in batch) + 10) <= 100
+
+
+def test_left_padded_batches_come_back_in_prompt_order():
+    model = EchoModel()
+    backend = HFBackend(model, CharTokenizer(), max_tokens=4, max_tokens_per_batch=200, tokenize_window=4)
+    outputs = backend.generate(PROMPTS)
+    assert outputs == [f"<user>{prompt}<assistant>!!!!" for prompt in PROMPTS]
+    assert len(model.batches) > 2
+    assert backend.prompt_tokens == sum(len(f"<user>{prompt}<assistant>") for prompt in PROMPTS)
+    assert backend.decode_tokens == 4 * len(PROMPTS)
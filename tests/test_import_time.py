@@ -0,0 +1,14 @@
+import import_time
+
+
+# The startup check of benchmarks/import_time.py as part of the test suite: a script that imports a
+# heavy library at the top again (SLOW) or no longer starts (FAIL) fails the tests
+def test_scripts_start_within_threshold(capsys):
+    failures = import_time.main(import_time.SCRIPTS, repeats=3, threshold=1.0)
+    assert failures == 0, capsys.readouterr().out
+
+
+def test_slow_and_failing_scripts_are_counted(capsys):
+    assert import_time.main(['evaluation/verdicts.py', 'evaluation/no_such_script.py'], repeats=1, threshold=0.0) == 2
+    output = capsys.readouterr().out
+    assert 'SLOW  evaluation/verdicts.py' in output and 'FAIL  evaluation/no_such_script.py' in output
@@ -0,0 +1,44 @@
+import pytest
+
+from judge_cache import JudgeCache, JudgeCacheMiss, open_cache
+from story_quality_eval import judge_pair
+
+REQUEST = {'model': 'gpt-4o-mini', 'messages': [{'role': 'user', 'content': 'Compare the stories.'}]}
+
+
+class CountingClient:
+    def __init__(self):
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    def create(self, **request):
+        self.calls += 1
+        raise AssertionError("a read-only cache must not call the judge")
+
+
+def test_cache_round_trip(tmp_path):
+    cache = JudgeCache(str(tmp_path / 'cache.sqlite'))
+    assert cache.get(REQUEST) is None
+    cache.put(REQUEST, 'A is better.')
+    assert cache.get(dict(reversed(list(REQUEST.items())))) == 'A is better.'
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = JudgeCache(str(tmp_path / 'cache.sqlite'), max_bytes=10)
+    cache.put({'n': 1}, 'x' * 6)
+    cache.put({'n': 2}, 'y' * 6)
+    assert cache.get({'n': 1}) is None and cache.get({'n': 2}) == 'y' * 6
+    assert cache.evictions == 1
+
+
+def test_read_only_miss_raises_and_never_calls_the_judge(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    JudgeCache(path).put(REQUEST, 'A is better.')
+    cache = open_cache(path, read_only=True)
+    assert cache.get(REQUEST) == 'A is better.'
+    client = CountingClient()
+    with pytest.raises(JudgeCacheMiss):
+        judge_pair(client, 'Once upon a time.', 'The end.', cache=cache)
+    assert client.calls == 0
@@ -0,0 +1,64 @@
+import os
+
+import pandas as pd
+import pytest
+
+import constraint_satisfaction
+from judge_cache import JudgeCache
+from judge_client import JudgeRunner, make_async_client
+from stub_openai_server import judge_answer, start_stub_server
+
+PROMPTS = [f"Story: story {index}\nConstraints: -\n" + '\n'.join(f"{number}. Constraint {number}." for number in range(1, index % 5 + 2))
+           for index in range(20)]
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**options):
+        server, base_url = start_stub_server(**options)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def runner(base_url, **options):
+    return JudgeRunner(make_async_client(base_url=base_url), 'stub-judge', "You are a judge.", concurrency=4,
+                       base_delay=0.001, max_delay=0.01, **options)
+
+
+def test_answers_come_back_in_prompt_order_despite_injected_errors(stub):
+    server, base_url = stub(error_rate=0.5)
+    requests = server.RequestHandlerClass.request_count
+    judge = runner(base_url, max_retries=30)
+    assert judge.run(PROMPTS, progress_every=0) == [judge_answer(prompt) for prompt in PROMPTS]
+    assert judge.retries > 0
+    assert server.RequestHandlerClass.request_count - requests == len(PROMPTS) + judge.retries
+
+
+def test_cached_answers_are_not_requested_again(stub, tmp_path):
+    server, base_url = stub()
+    cache = JudgeCache(str(tmp_path / 'cache.sqlite'))
+    first = runner(base_url, cache=cache).run(PROMPTS, progress_every=0)
+    requests = server.RequestHandlerClass.request_count
+    assert runner(base_url, cache=cache).run(PROMPTS, progress_every=0) == first
+    assert server.RequestHandlerClass.request_count == requests
+
+
+def test_constraint_satisfaction_needs_a_key_only_for_the_openai_api(constraint_rows, stub, tmp_path, monkeypatch):
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    stories = tmp_path / 'stories.csv'
+    rows = constraint_rows.head(4)
+    rows.assign(FinalGeneratedStory=rows['BaseStory'], FinalPrompt=rows['Instruction']).to_csv(stories, index=False)
+    output = str(tmp_path / 'judged.csv')
+    with pytest.raises(ValueError, match="OPENAI_API_KEY is not set"):
+        constraint_satisfaction.main(str(stories), output, rule_checks=False)
+    assert not os.path.exists(output)
+
+    server, base_url = stub()
+    constraint_satisfaction.main(str(stories), output, model='stub-judge', base_url=base_url, rule_checks=False)
+    assert pd.read_csv(output)['Percentage_GPT4'].notna().all()
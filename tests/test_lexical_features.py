@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from lexical_features import FEATURE_NAMES, lexical_features, ngram_counts, preprocess_text, story_features, tokenize
+
+STORIES = [
+    "I cannot go; we're gonna be late, and I wanna leave. Gotta run!",
+    "Lemme see: gimme the map. The wannabe captain said, \"Cannot!\"",
+    "Rain, rain, rain. The rain fell on the rain-soaked town again and again.",
+    "",
+    None,
+]
+
+
+def reference_features(story):
+    from nltk import ngrams
+    from nltk.tokenize import NLTKWordTokenizer
+
+    # word_tokenize without the sentence split: the preprocessed text has no sentence punctuation left
+    tokens = NLTKWordTokenizer().tokenize(preprocess_text(story))
+    counts = []
+    for n in (2, 3, 4):
+        grams = list(ngrams(tokens, n))
+        counts += [len(set(grams)), len(grams)]
+    return counts + [len(tokens), len(set(tokens)), float(np.mean([len(token) for token in tokens])) if tokens else 0.0]
+
+
+@pytest.mark.parametrize('story', STORIES)
+def test_features_match_the_nltk_path(story):
+    pytest.importorskip('nltk')
+    assert story_features(story) == pytest.approx(reference_features(story))
+
+
+def test_contractions_are_split_like_nltk():
+    assert tokenize('i cannot wanna go gonna wannabe') == ['i', 'can', 'not', 'wan', 'na', 'go', 'gon', 'na', 'wannabe']
+
+
+def test_packed_and_unpacked_ngram_counts_agree():
+    ids = np.random.RandomState(0).randint(0, 50, 400).astype(np.int64)
+    assert ngram_counts(ids, 50) == ngram_counts(ids, 2 ** 40)
+
+
+def test_parallel_features_equal_serial():
+    rng = np.random.RandomState(0)
+    words = np.array(['the', 'keeper', 'lit', 'a', 'lamp', "can't", 'storm', 'gonna', 'sea', 'night'])
+    stories = [' '.join(rng.choice(words, rng.randint(20, 120))) + '.' for _ in range(300)]
+    serial = lexical_features(stories, workers=1)
+    assert list(serial.columns) == FEATURE_NAMES
+    assert serial.equals(lexical_features(stories, workers=2, chunk_size=64))
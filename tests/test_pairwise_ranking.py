@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from pairwise_ranking import AdaptiveRanker, BradleyTerry, SimulatedJudge, default_budget, kendall_tau, simulate
+
+
+def test_bradley_terry_orders_a_consistent_tournament():
+    comparisons = [(winner, loser) for winner in range(4) for loser in range(winner + 1, 4)]
+    assert BradleyTerry(4).fit(comparisons).ranking() == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize('size', [4, 5, 10, 30, 100])
+def test_default_budget_is_below_a_round_robin(size):
+    assert size - 1 <= default_budget(size) < size * (size - 1) // 2
+
+
+def test_ranker_schedule_does_not_depend_on_concurrency():
+    qualities = np.random.RandomState(1).normal(0, 1.5, 12)
+    records = []
+    for concurrency in (1, 4, 8):
+        ranker = AdaptiveRanker(12, SimulatedJudge(qualities, seed=3), concurrency=concurrency, seed=3)
+        ranker.run()
+        records.append(ranker.records)
+    assert records[0] == records[1] == records[2]
+
+
+def test_ranker_saves_calls_on_five_stories():
+    ranker = AdaptiveRanker(5, SimulatedJudge([2, 1, 0, -1, -2]))
+    result = ranker.run()
+    assert ranker.calls <= default_budget(5) < 10
+    assert sorted(result['rank']) == [1, 2, 3, 4, 5]
+    assert 'round robin calls saved' in ranker.report()
+
+
+def test_ranker_recovers_the_hidden_order():
+    taus = [simulate(size=30, spread=2.0, seed=seed)['kendall_tau'] for seed in range(3)]
+    assert np.mean(taus) > 0.6
+
+
+def test_failed_verdicts_are_not_counted_as_comparisons():
+    ranker = AdaptiveRanker(6, SimulatedJudge(np.zeros(6), failure_rate=1.0))
+    ranker.run()
+    assert ranker.calls == default_budget(6) and ranker.comparisons == []
+
+
+def test_kendall_tau_of_reversed_order():
+    assert kendall_tau([1, 2, 3], [3, 2, 1]) == -1.0
@@ -0,0 +1,62 @@
+import math
+
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+
+from perplexity import PerplexityScorer
+
+
+class CharTokenizer:
+    pad_token_id = 0
+    eos_token_id = 0
+
+    def __call__(self, text):
+        return {'input_ids': [ord(character) % 97 + 1 for character in text]}
+
+
+@pytest.fixture(scope='module')
+def model():
+    torch.manual_seed(0)
+    config = transformers.GPT2Config(vocab_size=100, n_positions=64, n_embd=32, n_layer=2, n_head=2)
+    return transformers.GPT2LMHeadModel(config).eval()
+
+
+def unbatched_perplexity(model, ids):
+    with torch.no_grad():
+        return math.exp(model(input_ids=torch.tensor([ids]), labels=torch.tensor([ids])).loss.item())
+
+
+TEXTS = ["a short one", "a somewhat longer story about a lighthouse", "x", "", "tiny", "the sea " * 5]
+
+
+def test_padded_batches_match_one_story_at_a_time(model):
+    scorer = PerplexityScorer(model, CharTokenizer(), max_tokens_per_batch=120)
+    results = {}
+    for batch in scorer.score(TEXTS):
+        results.update(batch)
+    assert sorted(results) == list(range(len(TEXTS)))
+    for position, text in enumerate(TEXTS):
+        ids = CharTokenizer()(text)['input_ids']
+        perplexity, tokens = results[position]
+        if len(ids) < 2:
+            assert math.isnan(perplexity) and tokens == 0
+        else:
+            assert tokens == len(ids) - 1
+            assert perplexity == pytest.approx(unbatched_perplexity(model, ids), rel=1e-4)
+
+
+def test_long_stories_predict_every_token_once(model):
+    scorer = PerplexityScorer(model, CharTokenizer(), max_length=16, stride=5)
+    text = "a story that is far longer than the sixteen token window " * 2
+    [[(perplexity, tokens)]] = [list(batch.values()) for batch in scorer.score([text])]
+    assert tokens == len(text) - 1 and math.isfinite(perplexity)
+
+
+def test_skipped_rows_are_not_scored(model):
+    scorer = PerplexityScorer(model, CharTokenizer())
+    scored = set()
+    for batch in scorer.score(TEXTS, skip={0, 1}):
+        scored.update(batch)
+    assert scored == set(range(2, len(TEXTS)))
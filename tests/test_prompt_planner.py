@@ -0,0 +1,25 @@
+from backends import StubBackend, iter_generate_batched, stub_story
+from prompt_planner import PromptPlan
+
+PREFIXES = ['story one: ', 'story two: ', 'story one: ', 'story one: ', 'story two: ']
+PROMPTS = [prefix + suffix for prefix, suffix in zip(PREFIXES, ['a b', 'a', 'c', 'a b', 'd'])]
+
+
+def test_duplicates_are_planned_once_and_prefixes_grouped():
+    plan = PromptPlan(PROMPTS, PREFIXES)
+    assert plan.prompts == ['story one: a b', 'story one: c', 'story two: a', 'story two: d']
+    assert plan.rows == [[0, 3], [2], [1], [4]]
+    assert plan.num_unique == 4 and plan.prefix_hits == 2
+    # The duplicate prompt (4 words) and one extra use of each 2-word prefix
+    assert plan.prefill_tokens_saved == 4 + 2 + 2
+
+
+def test_expanded_outputs_reach_every_row():
+    plan = PromptPlan(PROMPTS, PREFIXES)
+    backend = StubBackend()
+    stories = [None] * len(PROMPTS)
+    for positions, texts in plan.expand(iter_generate_batched(backend, plan.prompts, chunk_size=3, prefixes=plan.prefixes)):
+        for position, text in zip(positions, texts):
+            stories[position] = text
+    assert stories == [stub_story(prompt) for prompt in PROMPTS]
+    assert backend.prompts_seen == 4
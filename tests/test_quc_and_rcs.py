@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregation import aggregate, model_frames
+from quc_and_rcs import calculate_quc_and_rcs, quc_table
+
+
+NUM_CONSTRAINTS = [7, 15, 23, 31, 39]
+
+
+# Per-story results of three models over 50 instructions, with satisfaction falling as constraints are added
+@pytest.fixture(scope='module')
+def rows():
+    rng = np.random.default_rng(0)
+    constraints = np.tile(NUM_CONSTRAINTS, 50)
+    frames = []
+    for model in ('Gemma', 'Llama', 'Mistral'):
+        satisfied = np.clip(rng.normal(90 - constraints, 15), 0, 100)
+        frames.append(pd.DataFrame({'model': model, 'direction': 'default', 'Number_of_Constraints': constraints, 'satisfied': satisfied,
+                                    'Percentage_GPT4': satisfied, 'coherence_score': rng.integers(1, 6, len(constraints)).astype(float)}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_vectorized_estimates_match_the_per_model_loop(rows):
+    table = aggregate(rows)
+    results = quc_table(table, resamples=0)
+    frames = model_frames(table, ['average_percentage_gpt4', 'normalized_coherence_score'])
+    quc, rcs = calculate_quc_and_rcs(frames)
+    for model, values in quc.items():
+        estimates = results[(results['metric'] == 'QUC') & (results['model'] == model)].set_index('Number_of_Constraints')['estimate']
+        np.testing.assert_allclose(estimates.to_numpy(), values.to_numpy())
+        changes = results[(results['metric'] == 'RCS') & (results['model'] == model)]
+        for change in changes.itertuples():
+            assert change.estimate == pytest.approx(rcs[model][f"{change.Number_of_Constraints}-{change.baseline_constraints}"])
+    assert results[['ci_low', 'ci_high']].isna().all().all()
+
+
+def test_model_differences_are_taken_once_in_input_order(rows):
+    results = quc_table(aggregate(rows), resamples=0)
+    differences = results[results['metric'] == 'QUC_difference']
+    quc = results[results['metric'] == 'QUC'].set_index(['model', 'Number_of_Constraints'])['estimate']
+    models = list(dict.fromkeys(rows['model']))
+    assert set(zip(differences['baseline_model'], differences['model'])) == {(a, b) for i, a in enumerate(models) for b in models[i + 1:]}
+    for difference in differences.itertuples():
+        assert difference.estimate == pytest.approx(quc[difference.model, difference.Number_of_Constraints] - quc[difference.baseline_model, difference.Number_of_Constraints])
+
+
+def test_bootstrap_intervals_are_seeded_and_cover_the_estimate(rows):
+    table = aggregate(rows)
+    first = quc_table(table, rows, resamples=300, seed=1, max_elements=5000)
+    assert first.equals(quc_table(table, rows, resamples=300, seed=1, max_elements=5000))
+    quc = first[first['metric'] == 'QUC']
+    assert (quc['ci_low'] <= quc['estimate']).all() and (quc['estimate'] <= quc['ci_high']).all()
+
+
+def test_constant_scores_give_zero_width_intervals(rows):
+    constant = rows.assign(Percentage_GPT4=50.0, coherence_score=3.0)
+    quc = quc_table(aggregate(constant), constant, resamples=50)
+    quc = quc[quc['metric'] == 'QUC']
+    np.testing.assert_allclose(quc['ci_low'], quc['estimate'])
+    np.testing.assert_allclose(quc['ci_high'], quc['estimate'])
@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+import storygen
+from backends import StubBackend
+from results import ResultBuilder, StreamingCSVWriter
+
+COLUMNS = ['position', 'story']
+
+
+def test_builder_keeps_column_order():
+    builder = ResultBuilder(COLUMNS)
+    builder.append({'story': 'a', 'position': 0, 'ignored': 1})
+    builder.append({'position': 1, 'story': 'b'})
+    assert len(builder) == 2
+    assert builder.to_frame().to_dict('list') == {'position': [0, 1], 'story': ['a', 'b']}
+
+
+def test_streaming_writer_restores_input_order(tmp_path):
+    path = str(tmp_path / 'out.csv')
+    writer = StreamingCSVWriter(path, COLUMNS, flush_every=2)
+    for position in (2, 0, 4, 1, 3):
+        writer.put(position, {'position': position, 'story': f"story {position}"})
+    writer.close()
+    assert pd.read_csv(path)['position'].tolist() == [0, 1, 2, 3, 4]
+    assert writer.rows_written == 5
+
+
+def test_streaming_writer_reports_a_missing_row(tmp_path):
+    writer = StreamingCSVWriter(str(tmp_path / 'out.csv'), COLUMNS)
+    writer.put(1, {'position': 1, 'story': 'b'})
+    with pytest.raises(RuntimeError):
+        writer.close()
+
+
+def test_empty_stream_keeps_the_header(tmp_path):
+    path = str(tmp_path / 'out.csv')
+    StreamingCSVWriter(path, COLUMNS).close()
+    assert list(pd.read_csv(path).columns) == COLUMNS
+
+
+def test_streamed_output_matches_the_in_memory_frame(constraint_rows, tmp_path):
+    rows = constraint_rows.head(12).assign(Final_Prompt='', FinalGeneratedStory='', Model='stub')
+    path = str(tmp_path / 'streamed.csv')
+    storygen.addNewStory(rows, [], StubBackend(), batch_size=5, order='longest_first', stream_path=path)
+    in_memory = storygen.addNewStory(rows, [], StubBackend(), batch_size=5, order='longest_first')
+    pd.testing.assert_frame_equal(pd.read_csv(path), in_memory, check_dtype=False)
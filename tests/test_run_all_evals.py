@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from run_all_evals import Pipeline, Stage, path_digest, stage_key
+
+CALLS = []
+
+
+# Stage function run in-process by the pipeline (one worker)
+def copy_upper(source, target, suffix=''):
+    CALLS.append(target)
+    with open(source) as f, open(target, 'w') as out:
+        out.write(f.read().upper() + suffix)
+
+
+@pytest.fixture
+def files(tmp_path):
+    CALLS.clear()
+    source = tmp_path / 'source.txt'
+    source.write_text('story')
+    return source, tmp_path / 'upper.txt', tmp_path / 'final.txt', str(tmp_path / 'state.json')
+
+
+def stages(source, upper, final, suffix=''):
+    return [Stage('final', __name__, 'copy_upper', {'source': str(upper), 'target': str(final)}, [str(upper)], [str(final)]),
+            Stage('upper', __name__, 'copy_upper', {'source': str(source), 'target': str(upper), 'suffix': suffix}, [str(source)], [str(upper)])]
+
+
+def run(source, upper, final, state, suffix='', force=False):
+    pipeline = Pipeline(stages(source, upper, final, suffix), state_path=state, workers=1, force=force)
+    return {name: result['status'] for name, result in pipeline.run().items()}
+
+
+def test_stage_key_follows_parameters_and_input_content(files):
+    source, upper, final, _ = files
+    first = stages(source, upper, final)[1]
+    key = stage_key(first)
+    assert stage_key(stages(source, upper, final)[1]) == key
+    assert stage_key(stages(source, upper, final, suffix='!')[1]) != key
+    source.write_text('another story')
+    assert stage_key(first) != key
+
+
+def test_path_digest_covers_every_file_of_a_directory(tmp_path):
+    (tmp_path / 'store' / 'model=a').mkdir(parents=True)
+    (tmp_path / 'store' / 'model=a' / 'part.parquet').write_bytes(b'1')
+    digest = path_digest(str(tmp_path / 'store'))
+    (tmp_path / 'store' / 'model=b').mkdir()
+    (tmp_path / 'store' / 'model=b' / 'part.parquet').write_bytes(b'1')
+    assert path_digest(str(tmp_path / 'store')) != digest
+
+
+def test_unchanged_stages_are_skipped_and_changes_rerun_downstream(files):
+    source, upper, final, state = files
+    assert run(source, upper, final, state) == {'upper': 'ran', 'final': 'ran'}
+    assert CALLS == [str(upper), str(final)] and final.read_text() == 'STORY'
+    assert run(source, upper, final, state) == {'upper': 'skipped', 'final': 'skipped'}
+
+    source.write_text('new story')
+    assert run(source, upper, final, state) == {'upper': 'ran', 'final': 'ran'}
+    assert final.read_text() == 'NEW STORY'
+
+    final.unlink()
+    assert run(source, upper, final, state) == {'upper': 'skipped', 'final': 'ran'}
+    assert run(source, upper, final, state, force=True) == {'upper': 'ran', 'final': 'ran'}
+
+
+def test_failed_stage_blocks_its_dependents_and_is_not_recorded(files):
+    source, upper, final, state = files
+    pipeline = Pipeline(stages(source, upper, final, suffix=None), state_path=state, workers=1)
+    assert {name: result['status'] for name, result in pipeline.run().items()} == {'upper': 'failed', 'final': 'blocked'}
+    assert json.load(open(state)) == {}
+
+
+def test_missing_inputs_and_cycles_are_rejected(files, tmp_path):
+    source, upper, final, state = files
+    with pytest.raises(FileNotFoundError):
+        Pipeline([Stage('a', __name__, 'copy_upper', {}, [str(tmp_path / 'missing.txt')], [str(upper)])], state_path=state)
+    with pytest.raises(ValueError):
+        Pipeline([Stage('a', __name__, 'copy_upper', {}, [str(final)], [str(upper)]),
+                  Stage('b', __name__, 'copy_upper', {}, [str(upper)], [str(final)])], state_path=state)
@@ -0,0 +1,22 @@
+import pytest
+
+from run_benchmarks import BENCHMARKS, compare, run_suite
+
+
+def results(**medians):
+    return {'benchmarks': {name: {'1': {'median': median}} for name, median in medians.items()}}
+
+
+def test_slowdowns_beyond_the_threshold_are_regressions():
+    baseline = results(fast=1.0, noisy=0.01, steady=1.0)
+    current = results(fast=1.5, noisy=0.04, steady=1.2, added=3.0)
+    assert compare(baseline, current) == [('fast', '1', 1.0, 1.5, 1.5)]
+    assert compare(baseline, current, threshold=1.1) == [('fast', '1', 1.0, 1.5, 1.5), ('steady', '1', 1.0, 1.2, pytest.approx(1.2))]
+    assert compare(baseline, current, min_seconds=0.0)[-1][:2] == ('noisy', '1')
+
+
+# Every benchmark still runs on the smallest corpus
+def test_suite_runs_every_benchmark_at_scale_one():
+    timings = run_suite(list(BENCHMARKS), scales=[1], repeats=1)['benchmarks']
+    assert set(timings) == set(BENCHMARKS)
+    assert all(scales['1']['rows'] > 0 and scales['1']['median'] > 0 for scales in timings.values())
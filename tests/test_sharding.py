@@ -0,0 +1,31 @@
+import pandas as pd
+import pytest
+
+import storygen
+from backends import StubBackend
+from sharding import part_path, shard_of
+
+
+def test_shard_assignment_is_stable_and_covers_every_rank():
+    keys = [(f"instruction {index}", 'constraints', 'direction2', 'model') for index in range(200)]
+    ranks = [shard_of(key, 4) for key in keys]
+    assert ranks == [shard_of(key, 4) for key in keys]
+    assert set(ranks) == {0, 1, 2, 3}
+    assert part_path('out/d2_stub_d2.csv', 1, 4) == 'out/d2_stub_d2.part-001-of-004.csv'
+
+
+@pytest.mark.parametrize('num_workers', [2, 3])
+def test_merged_parts_equal_a_single_worker_run(constraint_rows, tmp_path, monkeypatch, num_workers):
+    path = tmp_path / 'constraints_direction2.csv'
+    constraint_rows.to_csv(path, index=False)
+    monkeypatch.chdir(tmp_path)
+    output = tmp_path / storygen.output_file_for('stub', 'd2')
+
+    storygen.generalcall(StubBackend(), 'stub-model', str(path), output_name='stub')
+    single = pd.read_csv(output)
+    output.unlink()
+
+    for rank in range(num_workers):
+        storygen.generalcall(StubBackend(), 'stub-model', str(path), output_name='stub', num_workers=num_workers, worker_rank=rank)
+    storygen.merge_outputs(str(path), 'stub', num_workers)
+    pd.testing.assert_frame_equal(pd.read_csv(output), single)
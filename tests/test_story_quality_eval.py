@@ -0,0 +1,136 @@
+import json
+import re
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from story_quality_eval import (EVALUATION_FIELDS, JudgeStats, evaluate_stories, group_stories, judge_pair, pairwise_request,
+                                parse_evaluation, rank_stories, requery_request, response_format_for)
+
+ANSWER = {"grammar_score_A": 5, "grammar_score_B": 4, "grammar_reason": "A is cleaner.",
+          "coherence_score_A": 4.5, "coherence_score_B": 4, "coherence_reason": "A flows better.",
+          "likability_score_A": 4, "likability_score_B": 3.5, "likability_reason": "A is warmer.",
+          "overall_winner": "A"}
+
+
+class FakeClient:
+    """Chat completions client that answers with the given texts and, like the API, rejects json_schema
+    for models without structured outputs."""
+
+    def __init__(self, answers, schema_models=('gpt-4o-mini',)):
+        self.answers = list(answers)
+        self.schema_models = schema_models
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        self.requests.append(request)
+        if request.get('response_format', {}).get('type') == 'json_schema' and request['model'] not in self.schema_models:
+            raise ValueError("400: response_format json_schema is not supported with this model")
+        message = SimpleNamespace(content=self.answers.pop(0))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+class QualityClient(FakeClient):
+    """Judge that prefers the story with the higher "quality N" in its text."""
+
+    def __init__(self):
+        super().__init__([])
+
+    def create(self, **request):
+        self.requests.append(request)
+        a, b = (float(value) for value in re.findall(r"quality (\d+)", request['messages'][-1]['content']))
+        answer = {**ANSWER, **{f"{metric}_score_A": a for metric in ('grammar', 'coherence', 'likability')},
+                  **{f"{metric}_score_B": b for metric in ('grammar', 'coherence', 'likability')}, 'overall_winner': 'A' if a >= b else 'B'}
+        message = SimpleNamespace(content=json.dumps(answer))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.mark.parametrize('model, expected', [('gpt-4o-mini', 'json_schema'), ('gpt-4o-2024-08-06', 'json_schema'),
+                                             ('gpt-3.5-turbo', 'json_object'), ('gpt-4-turbo', 'json_object'),
+                                             ('gpt-4o-2024-05-13', 'json_object'), ('meta-llama/Llama-3-8B', None)])
+def test_response_format_follows_model_support(model, expected):
+    response_format = response_format_for(model, EVALUATION_FIELDS)
+    assert (response_format or {}).get('type') == expected
+    assert (pairwise_request('a', 'b', model).get('response_format') or {}).get('type') == expected
+
+
+def test_default_model_is_judged_without_json_schema():
+    client = FakeClient([json.dumps(ANSWER)])
+    results, parsed = judge_pair(client, 'story one', 'story two')
+    assert parsed is not None and parsed['overall_pref'] == 'A'
+    assert client.requests[0]['response_format'] == {'type': 'json_object'}
+
+
+def test_requery_asks_only_for_missing_fields():
+    partial = {key: value for key, value in ANSWER.items() if not key.startswith('likability')}
+    missing = {key: value for key, value in ANSWER.items() if key.startswith('likability')}
+    client = FakeClient([json.dumps(partial), json.dumps(missing)], schema_models=('gpt-4o-mini',))
+    stats = JudgeStats()
+    _, parsed = judge_pair(client, 'story one', 'story two', model='gpt-4o-mini', stats=stats)
+    assert parsed is not None
+    schema = client.requests[1]['response_format']['json_schema']['schema']
+    assert sorted(schema['required']) == ['likability_score_A', 'likability_score_B']
+    assert (stats.calls, stats.requeries, stats.recovered, stats.failed) == (2, 1, 1, 0)
+
+
+def test_requery_of_plain_text_model_sends_no_response_format():
+    request = pairwise_request('a', 'b', 'local-model')
+    assert 'response_format' not in requery_request(request, 'partial answer', ['overall_winner'])
+
+
+def test_text_format_answers_are_still_parsed():
+    answer = ("Grammar Preference: A\nA - 4.5/5: tidy\nB - 4/5: fine\nCoherence Preference: B\nA - 3/5: jumps\nB - 4/5: steady\n"
+              "Likability Preference: A\nA - 5/5: warm\nB - 3/5: flat\nOverall Winner: A")
+    parsed = parse_evaluation(answer)
+    assert parsed is not None and parsed['overall_pref'] == 'A'
+
+
+def test_run_fails_loudly_when_every_call_errors():
+    # An endpoint that rejects the request outright: every attempt errors and the comparison fails
+    stats = JudgeStats()
+    _, parsed = judge_pair(FakeClient([], schema_models=()), 'a', 'b', model='gpt-4o-mini', stats=stats)
+    assert parsed is None
+    assert stats.errors == stats.calls == 3
+    with pytest.raises(RuntimeError, match="All 3 judge calls failed"):
+        stats.raise_if_all_failed()
+
+
+def test_stories_are_grouped_by_numbered_instruction():
+    df = pd.DataFrame({'Instruction': ['write a/b story', 'other', 'write a/b story'], 'FinalGeneratedStory': ['x', 'y', 'z']})
+    groups = group_stories(df, 'Instruction')
+    assert list(groups) == ['instruction_000', 'instruction_001']
+    assert list(groups['instruction_000']['FinalGeneratedStory']) == ['x', 'z']
+    assert list(group_stories(df)) == ['default']
+
+
+def stories(instructions=2):
+    return pd.DataFrame([{'Instruction': f"instruction {instruction}", 'story_id': f"{instruction}-{quality}", 'Number_of_Constraints': constraints,
+                          'FinalGeneratedStory': f"A story of quality {quality}."}
+                         for instruction in range(instructions) for quality, constraints in enumerate([7, 23, 23, 31, 39])])
+
+
+def test_anchor_evaluation_runs_end_to_end(tmp_path, capsys):
+    client = QualityClient()
+    grouped = group_stories(stories(), 'Instruction')
+    evaluate_stories(grouped, client, str(tmp_path))
+    assert len(client.requests) == 2 * 4
+    for name in grouped:
+        evaluations = pd.read_csv(tmp_path / f"{name}_evaluations.csv")
+        judged = evaluations.dropna(subset=['evaluations'])
+        assert len(judged) == 4 and (judged['needs_parsing'] == 0).all()
+        # The anchor is the second story with 23 constraints (quality 2); the story shown as A wins when it is better
+        better = judged['story_id'].str.endswith(('3', '4'))
+        assert ((judged['overall_pref'] == 'A') == (better == (judged['order'] == 1))).all()
+    assert "8 comparisons in 8 judge calls" in capsys.readouterr().out
+
+
+def test_adaptive_ranking_runs_end_to_end(tmp_path, capsys):
+    grouped = group_stories(stories(), 'Instruction')
+    rank_stories(grouped, QualityClient(), str(tmp_path), concurrency=2)
+    for name in grouped:
+        ranking = pd.read_csv(tmp_path / f"{name}_ranking.csv")
+        assert ranking['story_id'].str[-1].iloc[[0, -1]].tolist() == ['4', '0']
+        assert len(pd.read_csv(tmp_path / f"{name}_comparisons.csv")) == 8
+    assert "16 ranking judge calls, 4 of the 20 round robin calls saved" in capsys.readouterr().out
@@ -0,0 +1,47 @@
+import os
+
+import pandas as pd
+
+import storygen
+from backends import StubBackend, stub_story
+
+
+def test_clear_cache_removes_entries_of_paths_with_spaces(tmp_path, monkeypatch):
+    cache = tmp_path / 'hf cache; echo'
+    (cache / 'models--a' / 'blobs').mkdir(parents=True)
+    (cache / 'models--a' / 'blobs' / 'weights').write_text('x')
+    (cache / 'version.txt').write_text('1')
+    sibling = tmp_path / 'hf'
+    sibling.mkdir()
+    monkeypatch.setattr(storygen.subprocess, 'check_output', lambda command: b"Filesystem Size Used Avail Use% Mounted\n/dev/x 1G 900M 100M 90% /\n")
+    storygen.clear_cache_if_needed(str(cache))
+    assert cache.is_dir() and os.listdir(cache) == []
+    # Nothing outside the directory is touched, even with spaces and ';' in the path
+    assert sibling.is_dir()
+
+
+def test_generation_with_stub_backend_writes_every_row(constraint_rows, tmp_path, monkeypatch):
+    path = tmp_path / 'constraints_direction2.csv'
+    constraint_rows.to_csv(path, index=False)
+    monkeypatch.chdir(tmp_path)
+    storygen.generalcall(StubBackend(), 'google/gemma-7b-it', str(path), batch_size=7)
+    output = pd.read_csv(tmp_path / 'gemma' / 'd2_gemma_d2.csv')
+    assert len(output) == len(constraint_rows)
+    assert output['Number_of_Constraints'].tolist() == constraint_rows['Number_of_Constraints'].tolist()
+    assert output['FinalGeneratedStory'].tolist() == [stub_story(prompt) for prompt in output['Final_Prompt']]
+
+
+def test_checkpointed_generation_resumes_without_regenerating(constraint_rows, tmp_path, monkeypatch):
+    path = tmp_path / 'constraints_direction2.csv'
+    constraint_rows.to_csv(path, index=False)
+    monkeypatch.chdir(tmp_path)
+    checkpoints = str(tmp_path / 'checkpoints')
+
+    first = StubBackend()
+    storygen.generalcall(first, 'google/gemma-7b-it', str(path), checkpoint_dir=checkpoints, flush_every=4)
+    assert first.prompts_seen == len(constraint_rows)
+    second = StubBackend()
+    storygen.generalcall(second, 'google/gemma-7b-it', str(path), checkpoint_dir=checkpoints, flush_every=4)
+    assert second.prompts_seen == 0
+    output = pd.read_csv(tmp_path / 'gemma' / 'd2_gemma_d2.csv')
+    assert len(output) == len(constraint_rows) and output['FinalGeneratedStory'].notna().all()
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from telemetry import PROMETHEUS_FILE, Telemetry, estimate_cost, format_summary, read_events, render_prometheus, summarize
+
+
+def test_prices_match_the_longest_model_prefix():
+    assert estimate_cost('gpt-4o-mini-2024-07-18', 1_000_000, 1_000_000) == pytest.approx(0.75)
+    assert estimate_cost('gpt-4-0613', 1_000_000, 0) == pytest.approx(30.0)
+    assert estimate_cost('claude-local', 10, 10) is None
+
+
+def test_disabled_telemetry_writes_nothing(tmp_path):
+    telemetry = Telemetry()
+    with telemetry.stage('judge', rows=3) as timer:
+        telemetry.add_rows(2)
+        telemetry.api_call('gpt-4o', 0.5, 10, 10)
+    assert timer.rows == 3 and os.listdir(tmp_path) == []
+
+
+def test_run_events_summarize_by_stage_and_model(tmp_path):
+    telemetry = Telemetry(str(tmp_path), 'run1')
+    with telemetry.stage('pipeline'):
+        with telemetry.stage('judge'):
+            telemetry.api_call('gpt-4o', 0.2, 1000, 100)
+            telemetry.retry('gpt-4o', 1.0, 'RateLimitError')
+            telemetry.api_call('gpt-4o', 0.4, None, None, status='error')
+            telemetry.api_call('gpt-4o', 0.0, status='cached')
+            telemetry.add_rows(3)
+        with pytest.raises(ValueError):
+            with telemetry.stage('generation'):
+                telemetry.generation(4, 2.0, 40, 400)
+                raise ValueError
+    telemetry.close()
+
+    run_id, events = read_events(str(tmp_path))
+    summary = summarize(events)
+    assert run_id == 'run1'
+    judge = summary['stages']['judge']
+    assert (judge['parent'], judge['runs'], judge['errors'], judge['rows']) == ('pipeline', 1, 0, 3)
+    assert summary['stages']['generation']['errors'] == 1 and summary['stages']['pipeline']['errors'] == 0
+    model = summary['models']['gpt-4o']
+    assert (model['requests'], model['cached'], model['errors'], model['retries']) == (3, 1, 1, 1)
+    assert model['latencies'] == [0.2, 0.4] and model['prompt_tokens'] == 1000
+    assert summary['spend'] == {('judge', 'gpt-4o'): pytest.approx((1000 * 2.5 + 100 * 10.0) / 1e6)}
+    assert summary['generation']['generation']['completion_tokens'] == 400
+    assert 'Most spend: gpt-4o in judge' in format_summary(summary)
+
+    prometheus = (tmp_path / PROMETHEUS_FILE).read_text()
+    assert prometheus == render_prometheus(summary)
+    assert 'cs4_api_requests_total{run="run1",model="gpt-4o",status="ok"} 1' in prometheus
+    assert 'cs4_api_latency_seconds_bucket{run="run1",model="gpt-4o",le="0.25"} 1' in prometheus
+
+
+def test_a_truncated_last_line_is_skipped(tmp_path):
+    telemetry = Telemetry(str(tmp_path), 'run2')
+    telemetry.event('process_start')
+    with open(tmp_path / 'events-run2-1.jsonl', 'w') as file:
+        file.write('{"ts": 1, "run": "run2"')
+    assert [event['event'] for event in read_events(str(tmp_path), 'run2')[1]] == ['process_start']
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from verdicts import parse_responses, read_verdicts, response_verdicts, satisfaction, verdict_matrix, write_verdicts
+
+RESPONSE = """1. Yes - the story is set in a coastal town.
+**2. No** - only one career is mentioned.
+3) yes: the health issue drives the plot
+2. Yes - judged again later
+Number of constraints satisfied: 2"""
+
+
+def test_verdict_lines_are_parsed_once_per_constraint():
+    assert response_verdicts(RESPONSE) == [(1, 'Yes', 'the story is set in a coastal town.'),
+                                           (2, 'No', 'only one career is mentioned.'),
+                                           (3, 'Yes', 'the health issue drives the plot')]
+    assert response_verdicts(None) == [] and response_verdicts('I cannot judge this story.') == []
+
+
+def test_satisfaction_counts_skipped_constraints_as_unsatisfied():
+    df = pd.DataFrame({'story_id': ['s1', 's2', 's3'], 'Number_of_Constraints': [4, 2, 3]})
+    verdicts = parse_responses(df['story_id'], [RESPONSE, "1. Yes\n2. Yes", None])
+    result = satisfaction(verdicts, df)
+    assert result['Satisfied_Count'].tolist() == [2, 2, 0]
+    assert result['Percentage_GPT4'].tolist()[:2] == [50.0, 100.0]
+    assert np.isnan(result['Percentage_GPT4'].iloc[2])
+
+
+def test_verdict_table_round_trip(tmp_path):
+    verdicts = parse_responses(['s1', 's2'], [RESPONSE, "1. No - missing"])
+    path = str(tmp_path / 'verdicts.parquet')
+    write_verdicts(verdicts, path)
+    loaded = read_verdicts(path)
+    assert loaded['verdict'].tolist() == ['Yes', 'No', 'Yes', 'No']
+    assert loaded['constraint_idx'].tolist() == [1, 2, 3, 1]
+
+
+def test_verdict_matrix_lines_up_models():
+    first = parse_responses(['s1'], ["1. Yes\n2. No"])
+    second = parse_responses(['s1'], ["1. No\n2. Yes"])
+    matrix = verdict_matrix({'base': first, 'instruct': second})
+    assert matrix.to_dict('list') == {'base': [1, 0], 'instruct': [0, 1]}